@@ -1,33 +1,282 @@
+import asyncio
+import collections
 import json
 import logging
 import os
 import re
+import time
 from typing import Any, Callable, Dict, Optional
 
-import httpx
 import google.generativeai as genai
 
 try:
-    from database import get_user_by_phone
+    from settings import env_flag, env_float
 except ImportError:
-    from backend.database import get_user_by_phone
+    from backend.settings import env_flag, env_float
+
+try:
+    from profile_cache import profile_cache
+except ImportError:
+    from backend.profile_cache import profile_cache
+
+try:
+    from write_behind import activity_buffer
+except ImportError:
+    from backend.write_behind import activity_buffer
+
+try:
+    from weather_grid import get_cell_weather
+except ImportError:
+    from backend.weather_grid import get_cell_weather
 
 # MP3-only voice generation (no ogg/ffmpeg)
 try:
-    from voice_service import send_voice_note
+    from voice_service import VoiceNoteStream, send_voice_note
 except ImportError:
-    from backend.voice_service import send_voice_note
+    from backend.voice_service import VoiceNoteStream, send_voice_note
+
+try:
+    import bridge
+except ImportError:
+    from backend import bridge
+
+try:
+    from answer_cache import answer_cache, normalise_question
+except ImportError:
+    from backend.answer_cache import answer_cache, normalise_question
+
+try:
+    from async_database import get_claims_by_phone
+except ImportError:
+    from backend.async_database import get_claims_by_phone
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-BRIDGE_BASE_URL = "http://localhost:8080"
+
+# ==========================================
+# 🚦 LOCAL INTENT ROUTER (skips Gemini for deterministic flows)
+# ==========================================
+# English, Hindi (Devanagari) and Hinglish keywords, compiled once.
+_INTENT_PATTERNS = {
+    "health": re.compile(
+        r"health|ndvi|\bsehat\b|सेहत|स्वास्थ्य|hariyali|हरियाली"
+        r"|fasal (?:kaisi|kesi) hai|फसल कैसी है",
+    ),
+    "claim_status": re.compile(
+        r"\b(?:claim|claims|dava|daava|bima|beema)\b|क्लेम|दावा|बीमा",
+    ),
+    "weather": re.compile(
+        r"\b(?:weather|forecast|rain|raining|rainfall|temperature|temp|mausam|mosam"
+        r"|barish|baarish|barsaat|tapman|garmi)\b|मौसम|बारिश|वर्षा|तापमान|गर्मी",
+    ),
+}
+
+# A greeting is routed only when it is the *whole* message ("hi", "namaste ji")
+_GREETING_RE = re.compile(
+    r"(?:hi+|hello+|hey+|helo|namaste|namaskar|namaskaar|ram ram|jai kisan"
+    r"|good (?:morning|evening|afternoon)|नमस्ते|नमस्कार|राम राम|जय किसान|हाय|हेलो)"
+    r"(?:\s+(?:ji|जी|sir|spectra|bhai|bhaiya))?",
+)
+
+# Asking what to *do* needs real advice, not a canned weather/claim card
+_ADVICE_RE = re.compile(
+    r"\b(?:should|how|why|what to do|chahiye|karu|karun|karein|kare|spray"
+    r"|irrigat\w*|fertili[sz]\w*)\b|चाहिए|करूं|करें|क्यों|कैसे",
+)
+
+# Starting a claim needs the LLM's help, not the claim-status card
+_CLAIM_FILING_RE = re.compile(
+    r"\b(?:file|filing|apply|applying|register|raise|submit|start|new|make"
+    r"|want|need|darj|karna|karni)\b|दर्ज|आवेदन|करना|करनी",
+)
+
+INTENT_MAX_WORDS = 8
+
+
+def _load_intent_model() -> Optional[Any]:
+    """Optional small text classifier (scikit-learn pipeline saved with joblib).
+
+    Only consulted when the keyword tables do not match. It must expose
+    `predict_proba` and `classes_` using the intent names above.
+    """
+    path = os.getenv("INTENT_MODEL_PATH")
+    if not path:
+        return None
+    try:
+        import joblib  # type: ignore
+
+        return joblib.load(path)
+    except Exception as e:
+        logger.warning("Intent model unavailable (%s); keyword routing only", e)
+        return None
+
+
+class IntentRouter:
+    """Microsecond keyword/pattern router in front of the LLM."""
+
+    def __init__(self, model: Any = None, min_confidence: float = 0.8):
+        self.model = model
+        self.min_confidence = min_confidence
+        self.counts: Dict[str, int] = collections.Counter()
+
+    def classify(self, text: str) -> Optional[str]:
+        """Return an intent name, or None when the message needs the LLM."""
+        t = normalise_question(text)
+        if not t:
+            return None
+
+        if _INTENT_PATTERNS["health"].search(t):
+            return "health"
+        if _GREETING_RE.fullmatch(t):
+            return "greeting"
+
+        short = len(t.split()) <= INTENT_MAX_WORDS
+        if short and not _ADVICE_RE.search(t):
+            if _INTENT_PATTERNS["claim_status"].search(t):
+                if _CLAIM_FILING_RE.search(t):
+                    return None
+                return "claim_status"
+            if _INTENT_PATTERNS["weather"].search(t):
+                return "weather"
+
+        if self.model is not None:
+            try:
+                probs = self.model.predict_proba([t])[0]
+                best = max(range(len(probs)), key=probs.__getitem__)
+                intent = str(self.model.classes_[best])
+                if probs[best] >= self.min_confidence and intent in ROUTED_INTENTS:
+                    return intent
+            except Exception as e:
+                logger.warning("Intent model failed: %s", e)
+        return None
+
+    def route(self, text: str) -> Optional[str]:
+        intent = self.classify(text)
+        self.counts[intent or "llm"] += 1
+        return intent
+
+    def stats(self) -> Dict[str, Any]:
+        total = sum(self.counts.values())
+        llm = self.counts.get("llm", 0)
+        return {
+            "routed": {k: v for k, v in self.counts.items() if k != "llm"},
+            "llm": llm,
+            "total": total,
+            "llm_avoided_share": round((total - llm) / total, 3) if total else 0.0,
+        }
+
+
+ROUTED_INTENTS = ("health", "weather", "claim_status", "greeting")
+
+# Sent when POWER is down; the scheduler never stores it as a rendered brief
+WEATHER_UNAVAILABLE = "⚠️ Unable to fetch weather right now. Please try later."
+
+intent_router = IntentRouter(model=_load_intent_model())
 
 
 def _is_health_request(text: str) -> bool:
-    t = (text or "").lower()
-    return "health" in t or "ndvi" in t or "crop health" in t
+    return bool(_INTENT_PATTERNS["health"].search((text or "").casefold()))
+
+
+def _weather_advice(rain: float, temp: float) -> str:
+    advice = "Monitor your field today."
+    if rain > 10:
+        advice = "Rain expected. Avoid irrigation today."
+    elif temp > 35:
+        advice = "High heat expected. Check soil moisture and irrigate if dry."
+    return advice
+
+
+def _stale_note(weather: dict, hindi: bool) -> str:
+    """Line flagging last-known-good weather (POWER down), else ""."""
+    if not weather.get("stale"):
+        return ""
+    as_of = str(weather.get("as_of") or "")[:10] or "?"
+    if hindi:
+        return f"⏳ पुराना डेटा: {as_of} तक का (अभी का मौसम उपलब्ध नहीं)\n"
+    return f"⏳ Last known reading, as of {as_of} (live data unavailable)\n"
+
+
+async def _handle_weather_request(user: dict, recipient_id: str) -> None:
+    """Weather flow: NASA POWER for the farm's grid cell, no LLM."""
+
+    lat = user.get("lat") or (user.get("location", {}) or {}).get("lat")
+    lon = user.get("lon") or (user.get("location", {}) or {}).get("lon")
+    if lat is None or lon is None:
+        await send_text_via_bridge(
+            recipient_id,
+            "⚠️ I need your farm location (lat/lon) to check the weather.",
+        )
+        return
+
+    weather = await get_cell_weather(float(lat), float(lon))
+    if not isinstance(weather, dict) or "error" in weather:
+        await send_text_via_bridge(recipient_id, WEATHER_UNAVAILABLE)
+        return
+
+    rain = float(weather.get("rainfall_mm", 0) or 0)
+    temp = float(weather.get("temperature_c", 0) or 0)
+    advice = _weather_advice(rain, temp)
+
+    hindi = voice_language(user) == "hi"
+    stale = _stale_note(weather, hindi)
+    if hindi:
+        text = (
+            "🌦 मौसम अपडेट\n\n"
+            f"{stale}"
+            f"🌧 वर्षा: {rain:.0f} मिमी\n"
+            f"🌡 तापमान: {temp:.0f}°C\n\n"
+            f"✅ सलाह: {advice}"
+        )
+    else:
+        text = (
+            "🌦 Weather Update\n\n"
+            f"{stale}"
+            f"🌧 Rain: {rain:.0f} mm\n"
+            f"🌡 Temp: {temp:.0f} °C\n\n"
+            f"✅ Advice: {advice}"
+        )
+    await send_text_via_bridge(recipient_id, text)
+
+
+async def _handle_claim_status_request(
+    user: dict, phone: str, recipient_id: str
+) -> None:
+    """Claim flow: latest insurance claims straight from Mongo, no LLM."""
+    claims = await get_claims_by_phone(user.get("phone") or phone)
+    if not claims:
+        await send_text_via_bridge(
+            recipient_id,
+            "📄 You have no insurance claims on record. "
+            "Ask us here if you need to file one.",
+        )
+        return
+
+    lines = ["📄 **Your Claims:**"]
+    for claim in claims:
+        lines.append(
+            f"• {claim.get('claim_id')} ({claim.get('claim_type')}): "
+            f"{claim.get('status', 'Pending')}"
+        )
+    await send_text_via_bridge(recipient_id, "\n".join(lines))
+
+
+async def _handle_greeting(user: dict, recipient_id: str) -> None:
+    name = user.get("name") or ""
+    if voice_language(user) == "hi":
+        text = (
+            f"🙏 नमस्ते {name}! मैं Spectra हूँ।\n"
+            "आप पूछ सकते हैं: मौसम, फसल की सेहत, क्लेम की स्थिति, या खेती से जुड़ा कोई भी सवाल।"
+        )
+    else:
+        text = (
+            f"🙏 Namaste {name}! I'm Spectra.\n"
+            "You can ask me about the weather, crop health, your claim status, "
+            "or any farming question."
+        )
+    await send_text_via_bridge(recipient_id, text)
 
 
 async def _handle_health_request(user: dict, recipient_id: str) -> None:
@@ -88,8 +337,7 @@ async def _handle_health_request(user: dict, recipient_id: str) -> None:
 
         await send_text_via_bridge(recipient_id, text_part)
 
-        lang = "hi" if "hindi" in str(user.get("language", "")).lower() else "en"
-        await send_voice_note(recipient_id, voice_part, language=lang)
+        await send_voice_note(recipient_id, voice_part, language=voice_language(user))
 
     except Exception as e:
         logger.error("Health request failed: %s", e, exc_info=True)
@@ -118,15 +366,115 @@ def _configure_gemini() -> None:
 MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
 
 
+# Cap on concurrent Gemini round trips across all conversations, and the total
+# time one message may spend in the tool loop (queueing + LLM + tools).
+LLM_MAX_CONCURRENCY = max(1, int(env_float("LLM_MAX_CONCURRENCY", 4)))
+AGENT_DEADLINE_SECONDS = env_float("AGENT_DEADLINE_SECONDS", 45)
+# Stream the final answer and deliver it while Gemini is still writing
+STREAM_REPLIES = env_flag("AGENT_STREAM_REPLIES", default=True)
+
+VOICE_DIVIDER = "===VOICE_SUMMARY==="
+
+_llm_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+_llm_stats: Dict[str, float] = {
+    "in_flight": 0,
+    "waiting": 0,
+    "calls": 0,
+    "timeouts": 0,
+    "total_seconds": 0.0,
+}
+# Seconds from "reply generation started" to "first WhatsApp text delivered"
+_first_message_seconds: collections.deque = collections.deque(maxlen=1000)
+
+
+def _chunk_text(chunk: Any) -> str:
+    try:
+        return chunk.text or ""
+    except Exception:
+        # Chunks without text parts (e.g. safety/finish metadata) raise here
+        return ""
+
+
+async def _generate(
+    model: Any, prompt: str, timeout: float, sink: Optional["ReplyStream"] = None
+) -> Any:
+    """One Gemini round trip without blocking the event loop.
+
+    Waiting for a free slot counts against `timeout`, so a saturated LLM can
+    never push a message past its deadline. With a `sink`, the response is
+    streamed into it chunk by chunk and the sink is returned.
+    """
+    if timeout <= 0:
+        _llm_stats["timeouts"] += 1
+        raise asyncio.TimeoutError("Agent deadline exceeded")
+
+    async def call() -> Any:
+        _llm_stats["waiting"] += 1
+        try:
+            await _llm_slots.acquire()
+        finally:
+            _llm_stats["waiting"] -= 1
+        _llm_stats["in_flight"] += 1
+        started = time.monotonic()
+        try:
+            generate_async = getattr(model, "generate_content_async", None)
+            if sink is not None and generate_async is not None:
+                async for chunk in await generate_async(prompt, stream=True):
+                    await sink.feed(_chunk_text(chunk))
+                return sink
+            if generate_async is not None:
+                resp = await generate_async(prompt)
+            else:
+                resp = await asyncio.to_thread(model.generate_content, prompt)
+            if sink is not None:
+                await sink.feed(getattr(resp, "text", "") or "")
+                return sink
+            return resp
+        finally:
+            _llm_stats["in_flight"] -= 1
+            _llm_stats["calls"] += 1
+            _llm_stats["total_seconds"] += time.monotonic() - started
+            _llm_slots.release()
+
+    try:
+        return await asyncio.wait_for(call(), timeout=timeout)
+    except asyncio.TimeoutError:
+        _llm_stats["timeouts"] += 1
+        raise
+
+
+def llm_stats() -> Dict[str, Any]:
+    calls = _llm_stats["calls"]
+    firsts = sorted(_first_message_seconds)
+    return {
+        "streaming": STREAM_REPLIES,
+        "first_message_ms_p50": (
+            round(firsts[len(firsts) // 2] * 1000, 1) if firsts else 0.0
+        ),
+        "max_concurrency": LLM_MAX_CONCURRENCY,
+        "deadline_seconds": AGENT_DEADLINE_SECONDS,
+        "in_flight": int(_llm_stats["in_flight"]),
+        "waiting": int(_llm_stats["waiting"]),
+        "calls": int(calls),
+        "timeouts": int(_llm_stats["timeouts"]),
+        "avg_seconds": round(_llm_stats["total_seconds"] / calls, 3) if calls else 0.0,
+    }
+
+
 def _available_tools() -> Dict[str, Callable[..., Any]]:
-    """Simple dict-based tools (no genai.protos)."""
+    """Simple dict-based tools (no genai.protos).
+
+    Tools may be plain functions or coroutines; `_run_tool` handles both.
+    """
     try:
-        from tools import get_nasa_weather
+        from tools import calculate_ndvi
     except ImportError:
-        from backend.tools import get_nasa_weather
+        from backend.tools import calculate_ndvi
 
     return {
-        "get_nasa_weather": get_nasa_weather,
+        # Cell-cached: farmers in one POWER grid cell share a fetch
+        "get_nasa_weather": get_cell_weather,
+        "calculate_ndvi": calculate_ndvi,
     }
 
 
@@ -167,58 +515,192 @@ def _extract_json_object(text: str) -> Dict[str, Any]:
             return {"final": text.strip()}
 
 
-def _run_tool(name: str, args: Dict[str, Any]) -> Dict[str, Any]:
-    tools = _available_tools()
+async def _run_tool(
+    name: str,
+    args: Dict[str, Any],
+    timeout: Optional[float] = None,
+    tools: Optional[Dict[str, Callable[..., Any]]] = None,
+) -> Dict[str, Any]:
+    """Run one tool without blocking the loop (sync tools go to a thread)."""
+    tools = tools if tools is not None else _available_tools()
     if name not in tools:
         return {"error": f"Unknown tool '{name}'"}
 
+    fn = tools[name]
     try:
-        result = tools[name](**(args or {}))
+        if asyncio.iscoroutinefunction(fn):
+            call = fn(**(args or {}))
+        else:
+            call = asyncio.to_thread(fn, **(args or {}))
+        result = await asyncio.wait_for(call, timeout=timeout)
         if isinstance(result, dict):
             return result
         return {"result": result}
+    except asyncio.TimeoutError:
+        return {"error": f"Tool '{name}' timed out"}
     except Exception as e:
         return {"error": str(e)}
 
 
-async def _gemini_with_tools(prompt: str, max_steps: int = 4) -> str:
-    """Robust tool loop using dict JSON protocol (no proto function calling)."""
-    _configure_gemini()
-    model = genai.GenerativeModel(MODEL_NAME)
-
-    tool_results: list[Dict[str, Any]] = []
-    for _ in range(max_steps):
-        tools_desc = [
-            {
-                "name": "get_nasa_weather",
-                "args": {"lat": "number", "lon": "number"},
-                "returns": "{rainfall_mm:number, temperature_c:number, note?:string}",
-            }
-        ]
-
-        protocol = (
-            "Return ONLY valid JSON (no Markdown, no code fences). Choose ONE:\n"
-            '- Tool call: {"tool": "tool_name", "args": {...}}\n'
-            '- Final answer: {"final": "text"}\n'
-            "If you need newlines inside a string, write them as \\n (escaped).\n"
+def _requested_tool_calls(data: Any) -> list[Dict[str, Any]]:
+    """Normalise a single `{"tool": ...}` or batched `{"tools": [...]}` reply."""
+    if not isinstance(data, dict):
+        return []
+    raw = data.get("tools") if isinstance(data.get("tools"), list) else [data]
+
+    calls = []
+    for item in raw:
+        if isinstance(item, dict) and item.get("tool"):
+            args = item.get("args")
+            calls.append(
+                {
+                    "tool": str(item["tool"]),
+                    "args": args if isinstance(args, dict) else {},
+                }
+            )
+    return calls
+
+
+async def _run_tool_calls(
+    calls: list[Dict[str, Any]], deadline: float, runtime: "AgentRuntime"
+) -> list[Dict[str, Any]]:
+    """Run every tool the model asked for in one step concurrently."""
+    remaining = max(0.0, deadline - time.monotonic())
+    results = await asyncio.gather(
+        *(
+            _run_tool(c["tool"], c["args"], timeout=remaining, tools=runtime.tools)
+            for c in calls
         )
+    )
+    return [dict(call, result=result) for call, result in zip(calls, results)]
+
+
+TOOLS_DESC = [
+    {
+        "name": "get_nasa_weather",
+        "args": {"lat": "number", "lon": "number"},
+        "returns": "{rainfall_mm:number, temperature_c:number, note?:string}",
+    },
+    {
+        "name": "calculate_ndvi",
+        "args": {"lat": "number", "lon": "number"},
+        "returns": "{ndvi:number, status:string} or {error:string}",
+    },
+]
+
+TOOL_PROTOCOL = (
+    "Return ONLY valid JSON (no Markdown, no code fences). Choose ONE:\n"
+    '- Tool call: {"tool": "tool_name", "args": {...}}\n'
+    '- Several independent tool calls at once: {"tools": [{"tool": "tool_name", "args": {...}}, ...]}\n'
+    '- Final answer: {"final": "text"}\n'
+    "If you need newlines inside a string, write them as \\n (escaped).\n"
+)
+
+# Streaming variant: tool calls stay JSON, but the final answer is plain text
+# so it can be forwarded to WhatsApp while it is still being generated.
+TOOL_PROTOCOL_STREAMING = (
+    "To use tools, return ONLY valid JSON (no Markdown, no code fences):\n"
+    '- Tool call: {"tool": "tool_name", "args": {...}}\n'
+    '- Several independent tool calls at once: {"tools": [{"tool": "tool_name", "args": {...}}, ...]}\n'
+    "When you are ready to answer, write the final answer directly as plain "
+    "text (NOT JSON, do not start it with '{').\n"
+)
+
+PERSONA = (
+    "You are Spectra, an agricultural assistant for Indian farmers.\n"
+    "Keep answers simple, practical, and safe.\n\n"
+)
+
+REPLY_FORMAT = (
+    "Respond in TWO parts separated by the divider '===VOICE_SUMMARY==='\n"
+    "Part 1: WhatsApp text (<=120 words).\n"
+    "Part 2: voice script (<=2 short sentences).\n\n"
+)
+
+
+class AgentRuntime:
+    """Per-process agent state that does not change between messages.
+
+    Built once at FastAPI startup: the configured Gemini model, the tool
+    registry, the serialised protocol/tool prefix and the (optional) RAG
+    lookup. Each message then only pays for its own prompt and LLM calls.
+    """
 
+    def __init__(
+        self,
+        model: Any = None,
+        tools: Optional[Dict[str, Callable[..., Any]]] = None,
+        rag_fn: Optional[Callable[[str], str]] = None,
+        load_rag: bool = True,
+    ):
+        if model is None:
+            _configure_gemini()
+            model = genai.GenerativeModel(MODEL_NAME)
+        self.model = model
+        self.tools = tools if tools is not None else _available_tools()
+        self.rag_fn = rag_fn
+        if rag_fn is None and load_rag:
+            self.rag_fn = _safe_import_rag()
+        tools_json = json.dumps(TOOLS_DESC, ensure_ascii=False)
+        self.prompt_prefix = TOOL_PROTOCOL + "\nTOOLS:\n" + tools_json
+        self.stream_prompt_prefix = TOOL_PROTOCOL_STREAMING + "\nTOOLS:\n" + tools_json
+
+    def build_step_prompt(
+        self, prompt: str, tool_results: list, streaming: bool = False
+    ) -> str:
         tool_ctx = ""
         if tool_results:
             tool_ctx = "\n\nTOOL_RESULTS (most recent last):\n" + json.dumps(
                 tool_results, ensure_ascii=False
             )
+        prefix = self.stream_prompt_prefix if streaming else self.prompt_prefix
+        return prefix + tool_ctx + "\n\nUSER_CONTEXT_AND_REQUEST:\n" + prompt
+
+
+_runtime: Optional[AgentRuntime] = None
+
+
+def init_runtime() -> AgentRuntime:
+    """Build (or rebuild) the shared runtime. Called from FastAPI startup."""
+    global _runtime
+    _runtime = AgentRuntime()
+    return _runtime
+
+
+def get_runtime() -> AgentRuntime:
+    """Shared runtime; built on first use if startup could not build it."""
+    return _runtime if _runtime is not None else init_runtime()
+
+
+async def _gemini_with_tools(
+    prompt: str,
+    max_steps: int = 4,
+    deadline: Optional[float] = None,
+    runtime: Optional[AgentRuntime] = None,
+    stream: Optional["ReplyStream"] = None,
+) -> str:
+    """Robust tool loop using dict JSON protocol (no proto function calling).
+
+    `deadline` is a `time.monotonic()` timestamp shared by every step; once it
+    passes, the loop raises `asyncio.TimeoutError`. With a `stream`, each step
+    is streamed and a plain-text final answer is delivered as it arrives.
+    """
+    if deadline is None:
+        deadline = time.monotonic() + AGENT_DEADLINE_SECONDS
+    runtime = runtime or get_runtime()
+
+    tool_results: list[Dict[str, Any]] = []
+    for _ in range(max_steps):
+        full_prompt = runtime.build_step_prompt(
+            prompt, tool_results, streaming=stream is not None
+        )
 
-        full_prompt = (
-            protocol
-            + "\nTOOLS:\n"
-            + json.dumps(tools_desc, ensure_ascii=False)
-            + tool_ctx
-            + "\n\nUSER_CONTEXT_AND_REQUEST:\n"
-            + prompt
+        resp = await _generate(
+            runtime.model, full_prompt, deadline - time.monotonic(), sink=stream
         )
+        if stream is not None and stream.mode == "text":
+            return await stream.finish()
 
-        resp = model.generate_content(full_prompt)
         raw_text = getattr(resp, "text", "") or ""
         try:
             data = _extract_json_object(raw_text)
@@ -228,14 +710,11 @@ async def _gemini_with_tools(prompt: str, max_steps: int = 4) -> str:
             )
             return raw_text.strip() or ""
 
-        if isinstance(data, dict) and data.get("tool"):
-            tool_name = str(data.get("tool"))
-            args = data.get("args")
-            if not isinstance(args, dict):
-                args = {}
-            tool_results.append(
-                {"tool": tool_name, "args": args, "result": _run_tool(tool_name, args)}
-            )
+        calls = _requested_tool_calls(data)
+        if calls:
+            if stream is not None:
+                stream.reset()
+            tool_results.extend(await _run_tool_calls(calls, deadline, runtime))
             continue
 
         final = data.get("final") if isinstance(data, dict) else None
@@ -264,6 +743,137 @@ def resolve_jid(sender_raw):
     return f"{sender}@s.whatsapp.net"
 
 
+def voice_language(user: dict) -> str:
+    """gTTS language code for a farmer's stored language name ("Hindi")."""
+    return "hi" if "hindi" in str(user.get("language", "")).lower() else "en"
+
+
+class ReplyStream:
+    """Delivers a streamed final answer to WhatsApp while Gemini is writing it.
+
+    The first non-blank character decides the step type: JSON (a tool call)
+    is only buffered; plain text is the final answer. For the answer, the text
+    part is sent the moment the voice divider shows up, and the voice script
+    after it is fed to a `VoiceNoteStream` so gTTS starts on finished
+    sentences before the model is done.
+    """
+
+    def __init__(self, recipient_id: str, language: str = "en"):
+        self.recipient_id = recipient_id
+        self.language = language
+        self.started = time.monotonic()
+        self.raw = ""
+        self.mode: Optional[str] = None
+        self.text_sent = False
+        self._send_task: Optional[asyncio.Task] = None
+        self._voice: Optional[VoiceNoteStream] = None
+
+    @property
+    def text(self) -> str:
+        return self.raw
+
+    @property
+    def delivered(self) -> bool:
+        return self.mode == "text" and self.text_sent
+
+    def reset(self) -> None:
+        """Forget the previous (tool-call) step before streaming the next."""
+        self.raw = ""
+        self.mode = None
+
+    async def feed(self, chunk: str) -> None:
+        if not chunk:
+            return
+        self.raw += chunk
+        if self.mode is None:
+            head = self.raw.lstrip()
+            if not head:
+                return
+            self.mode = "json" if head[0] in "{`" else "text"
+        if self.mode != "text":
+            return
+
+        if self._voice is not None:
+            self._voice.feed(chunk)
+        elif VOICE_DIVIDER in self.raw:
+            text_part, voice_part = self.raw.split(VOICE_DIVIDER, 1)
+            self._send_text(text_part.strip())
+            self._voice = VoiceNoteStream(self.recipient_id, language=self.language)
+            self._voice.feed(voice_part)
+
+    def _send_text(self, text: str) -> None:
+        self.text_sent = True
+        if text:
+            self._send_task = asyncio.create_task(self._send_and_time(text))
+
+    async def _send_and_time(self, text: str) -> None:
+        await send_text_via_bridge(self.recipient_id, text)
+        _first_message_seconds.append(time.monotonic() - self.started)
+
+    async def finish(self) -> str:
+        """Flush whatever is still pending once the model is done."""
+        if not self.text_sent:
+            self._send_text(self.raw.strip())
+        if self._send_task is not None:
+            await self._send_task
+        if self._voice is not None:
+            await self._voice.finish()
+        return self.raw.strip()
+
+
+async def _deliver_reply(recipient_id: str, ai_reply: str, language: str) -> None:
+    """Send a complete reply: text part first, then the voice note."""
+    started = time.monotonic()
+    if VOICE_DIVIDER in ai_reply:
+        parts = ai_reply.split(VOICE_DIVIDER, 1)
+        text_part = parts[0].strip()
+        voice_part = parts[1].strip() if len(parts) > 1 else ""
+
+        if text_part:
+            await send_text_via_bridge(recipient_id, text_part)
+            _first_message_seconds.append(time.monotonic() - started)
+
+        if voice_part:
+            await send_voice_note(recipient_id, voice_part, language=language)
+    else:
+        await send_text_via_bridge(recipient_id, ai_reply)
+
+
+async def _generate_reply(
+    user: dict,
+    lat: Any,
+    lon: Any,
+    user_text: str,
+    stream: Optional[ReplyStream] = None,
+) -> str:
+    """RAG context + Gemini tool loop for one farmer message."""
+    deadline = time.monotonic() + AGENT_DEADLINE_SECONDS
+    runtime = get_runtime()
+
+    rag_text = ""
+    if runtime.rag_fn:
+        # Vector search is CPU/disk bound; keep it off the event loop
+        ctx = await asyncio.to_thread(runtime.rag_fn, user_text) or ""
+        if ctx:
+            rag_text = f"\n\nRELEVANT_KB:\n{ctx}"
+
+    prompt = (
+        PERSONA
+        + f"Farmer name: {user.get('name')}\n"
+        + f"Crop: {user.get('crop', 'crop')}\n"
+        + f"Location: lat={lat}, lon={lon}\n"
+        + rag_text
+        + "\n\n"
+        + REPLY_FORMAT
+        + f"User message: {user_text}"
+    )
+
+    logger.info("🧠 Generating reply for %s", user.get("name"))
+    return await _gemini_with_tools(
+        prompt, deadline=deadline, runtime=runtime, stream=stream
+    )
+
+
 # ==========================================
 # 🧠 MAIN AUTONOMOUS AGENT
 # ==========================================
@@ -287,7 +897,7 @@ async def handle_incoming_message(payload: dict):
         .replace(" ", "")
         .strip()
     )
-    user = get_user_by_phone(clean_phone)
+    user = await profile_cache.get(clean_phone)
 
     if not user:
         await send_text_via_bridge(
@@ -296,65 +906,59 @@ async def handle_incoming_message(payload: dict):
         )
         return "Register Prompt"
 
-    # If user asks about crop health, do the deterministic NASA+GIS MCP flow
-    if _is_health_request(user_text):
+    # sender_jid (for proactive messages), last_active and message count are
+    # buffered and written in bulk by the write-behind flusher
+    if user.get("_id") is not None:
+        activity_buffer.record(user["_id"], reply_to_jid or None)
+
+    # Deterministic flows (health, weather, claims, greetings) skip Gemini
+    intent = intent_router.route(user_text)
+    if intent == "health":
         await _handle_health_request(user, recipient_id)
         return "Health Done"
-
-    # Persist sender_jid for proactive messaging (scheduler)
-    if reply_to_jid:
-        try:
-            try:
-                from database import update_user_sender_jid
-            except ImportError:
-                from backend.database import update_user_sender_jid
-            update_user_sender_jid(clean_phone, reply_to_jid)
-        except Exception:
-            pass
-
+    if intent == "weather":
+        await _handle_weather_request(user, recipient_id)
+        return "Weather Done"
+    if intent == "claim_status":
+        await _handle_claim_status_request(user, clean_phone, recipient_id)
+        return "Claim Status Done"
+    if intent == "greeting":
+        await _handle_greeting(user, recipient_id)
+        return "Greeting Done"
+
+    lang = voice_language(user)
+    stream = ReplyStream(recipient_id, language=lang) if STREAM_REPLIES else None
     try:
         lat = user.get("lat") or (user.get("location", {}) or {}).get("lat")
         lon = user.get("lon") or (user.get("location", {}) or {}).get("lon")
 
-        rag_fn = _safe_import_rag()
-        rag_text = ""
-        if rag_fn:
-            ctx = rag_fn(user_text) or ""
-            if ctx:
-                rag_text = f"\n\nRELEVANT_KB:\n{ctx}"
-
-        prompt = (
-            "You are Spectra, an agricultural assistant for Indian farmers.\n"
-            "Keep answers simple, practical, and safe.\n\n"
-            f"Farmer name: {user.get('name')}\n"
-            f"Crop: {user.get('crop', 'crop')}\n"
-            f"Location: lat={lat}, lon={lon}\n" + rag_text + "\n\n"
-            "Respond in TWO parts separated by the divider '===VOICE_SUMMARY==='\n"
-            "Part 1: WhatsApp text (<=120 words).\n"
-            "Part 2: voice script (<=2 short sentences).\n\n"
-            f"User message: {user_text}"
-        )
+        cache_key = answer_cache.key(user, lat, lon, user_text)
+        ai_reply = await answer_cache.get(cache_key, name=user.get("name"))
+        if ai_reply is None:
+            ai_reply = await _generate_reply(user, lat, lon, user_text, stream=stream)
+            # Only well-formed replies are worth serving to other farmers
+            if VOICE_DIVIDER in ai_reply:
+                await answer_cache.set(cache_key, ai_reply, user=user)
+        else:
+            stream = None
+            logger.info("♻️ Answer cache hit for %s", user.get("name"))
 
-        logger.info("🧠 Generating reply for %s", user.get("name"))
-        ai_reply = await _gemini_with_tools(prompt)
         logger.info("🤖 [GEMINI REPLY] %s", ai_reply)
 
-        if "===VOICE_SUMMARY===" in ai_reply:
-            parts = ai_reply.split("===VOICE_SUMMARY===", 1)
-            text_part = parts[0].strip()
-            voice_part = parts[1].strip() if len(parts) > 1 else ""
-
-            if text_part:
-                await send_text_via_bridge(recipient_id, text_part)
-
-            if voice_part:
-                lang = (
-                    "hi" if "hindi" in str(user.get("language", "")).lower() else "en"
-                )
-                await send_voice_note(recipient_id, voice_part, language=lang)
-        else:
-            await send_text_via_bridge(recipient_id, ai_reply)
+        # A streamed answer has already been delivered as it was generated
+        if stream is None or not stream.delivered:
+            await _deliver_reply(recipient_id, ai_reply, lang)
 
+    except asyncio.TimeoutError:
+        logger.warning("⏱️ Agent deadline exceeded for %s", clean_phone)
+        if stream is not None and stream.delivered:
+            # The farmer already has the text; only the voice note was cut off
+            return "Timeout"
+        await send_text_via_bridge(
+            recipient_id,
+            "⏳ Spectra is busy right now. Please send your question again in a minute.",
+        )
+        return "Timeout"
     except Exception as e:
         logger.error("❌ Agent error: %s", e, exc_info=True)
         await send_text_via_bridge(recipient_id, "System error. Please try again.")
@@ -363,27 +967,10 @@ async def handle_incoming_message(payload: dict):
 
 
 # --- 📤 TEXT SENDER ---
-async def send_text_via_bridge(to_jid: str, text: str):
-    async with httpx.AsyncClient() as client:
-        payload = {"recipient": to_jid, "phone": to_jid, "message": text}
-
-        endpoints = ["/api/send", "/send/text", "/send"]
-
-        for endpoint in endpoints:
-            url = f"{BRIDGE_BASE_URL}{endpoint}"
-            try:
-                resp = await client.post(url, json=payload, timeout=5)
-
-                if resp.status_code == 200:
-                    print(f"✅ Message Delivered via {endpoint}!")
-                    return
-                elif resp.status_code != 404:
-                    print(f"⚠️ Bridge Error ({resp.status_code}): {resp.text}")
-                    return
-            except Exception as e:
-                print(f"❌ Connection Error to {endpoint}: {e}")
-
-        print("❌ Failed to send message on all known endpoints.")
+async def send_text_via_bridge(to_jid: str, text: str) -> bool:
+    """Send a WhatsApp text through the pooled bridge client. True if delivered."""
+    payload = {"recipient": to_jid, "phone": to_jid, "message": text}
+    return await bridge.post_text(payload)
 
 
 # =========================================================
@@ -395,11 +982,6 @@ async def generate_morning_brief(farmer: dict) -> str:
     Generates a short, reliable morning advisory.
     This is used by the scheduler — NOT WhatsApp chat.
     """
-    try:
-        from tools import get_nasa_weather  # local import avoids circulars
-    except ImportError:
-        from backend.tools import get_nasa_weather
-
     lat = farmer.get("lat") or (farmer.get("location", {}) or {}).get("lat")
     lon = farmer.get("lon") or (farmer.get("location", {}) or {}).get("lon")
     crop = farmer.get("crop", "crop")
@@ -408,22 +990,21 @@ async def generate_morning_brief(farmer: dict) -> str:
     if lat is None or lon is None:
         return "⚠️ Location missing. Please share your farm location in the app."
 
-    weather = get_nasa_weather(float(lat), float(lon))
+    weather = await get_cell_weather(float(lat), float(lon))
     if not isinstance(weather, dict) or "error" in weather:
-        return "⚠️ Unable to fetch weather right now. Please try later."
+        return WEATHER_UNAVAILABLE
 
     rain = float(weather.get("rainfall_mm", 0) or 0)
     temp = float(weather.get("temperature_c", 0) or 0)
 
-    advice = "Monitor your field today."
-    if rain > 10:
-        advice = "Rain expected. Avoid irrigation today."
-    elif temp > 35:
-        advice = "High heat expected. Check soil moisture and irrigate if dry."
+    advice = _weather_advice(rain, temp)
+    hindi = language.lower().startswith("hi")
+    stale = _stale_note(weather, hindi)
 
-    if language.lower().startswith("hi"):
+    if hindi:
         return (
             "🌅 सुप्रभात!\n\n"
+            f"{stale}"
             f"🌱 फसल: {crop}\n"
             f"🌧 वर्षा: {rain:.0f} मिमी\n"
             f"🌡 तापमान: {temp:.0f}°C\n\n"
@@ -432,6 +1013,7 @@ async def generate_morning_brief(farmer: dict) -> str:
 
     return (
         "🌅 Good Morning!\n\n"
+        f"{stale}"
         f"🌱 Crop: {crop}\n"
         f"🌧 Rain: {rain:.0f} mm\n"
         f"🌡 Temp: {temp:.0f} °C\n\n"
@@ -0,0 +1,175 @@
+"""Answer cache in front of the Gemini tool loop.
+
+Farmers growing the same crop in the same area ask near-identical questions
+("should I water my crops?"). Answers are cached under
+(crop, coarse lat/lon cell, language, normalised question) with a TTL, an LRU
+bound in memory and, optionally, a shared Mongo copy (ANSWER_CACHE_PERSIST=1)
+so other workers and restarts can reuse them.
+
+The farmer's name (whole words, any casing) is swapped for a placeholder
+before storing, so a cached answer never greets the next farmer by someone
+else's name. Answers that mention other profile details (phone, Aadhaar,
+bank account, village, exact coordinates), or the name more than once, are
+not cached at all: we can't tell which mention is personal.
+"""
+
+import hashlib
+import logging
+import math
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+try:
+    from settings import env_flag, env_float
+except ImportError:
+    from backend.settings import env_flag, env_float
+
+try:
+    from cache import TTLCache
+except ImportError:
+    from backend.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+NAME_PLACEHOLDER = "\x00NAME\x00"
+
+# Profile fields that must never reach another farmer through the cache
+PRIVATE_FIELDS = ("phone", "aadhar", "bank_acc", "village", "district", "address")
+
+
+def normalise_question(text: str) -> str:
+    """Case/spacing/punctuation-insensitive form of a question.
+
+    Punctuation and symbols (emoji included) are dropped by Unicode category
+    rather than by regex word classes, which would also strip Devanagari
+    vowel signs.
+    """
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return " ".join(
+        "".join(" " if unicodedata.category(c)[0] in "PS" else c for c in text).split()
+    )
+
+
+def grid_cell(lat: Any, lon: Any, cell_deg: float) -> str:
+    try:
+        lat_f, lon_f = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return "nocell"
+    return f"{math.floor(lat_f / cell_deg)}:{math.floor(lon_f / cell_deg)}"
+
+
+def _personal_details(user: Dict[str, Any]) -> List[str]:
+    details = [str(user.get(f) or "").strip() for f in PRIVATE_FIELDS]
+    for field in ("lat", "lon"):
+        try:
+            value = float(user.get(field))
+        except (TypeError, ValueError):
+            continue
+        details += [str(value), f"{value:.2f}"]
+    return [d for d in details if len(d) >= 3]
+
+
+def anonymise(answer: str, user: Dict[str, Any]) -> Optional[str]:
+    """`answer` with the farmer's name replaced, or None if it is too personal."""
+    folded = answer.casefold()
+    if any(d.casefold() in folded for d in _personal_details(user)):
+        return None
+    name = str(user.get("name") or "").strip()
+    if not name:
+        return answer
+    pattern = re.compile(rf"(?<!\w){re.escape(name)}(?!\w)", re.IGNORECASE)
+    anonymised, mentions = pattern.subn(NAME_PLACEHOLDER, answer)
+    return anonymised if mentions <= 1 else None
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        maxsize: Optional[int] = None,
+        ttl: Optional[float] = None,
+        cell_deg: Optional[float] = None,
+        persist: Optional[bool] = None,
+    ):
+        self.ttl = ttl if ttl is not None else env_float("ANSWER_CACHE_TTL", 3 * 3600)
+        self.cell_deg = cell_deg or env_float("ANSWER_CACHE_CELL_DEG", 0.25)
+        self.memory = TTLCache(
+            maxsize=maxsize or int(env_float("ANSWER_CACHE_MAX", 5000)), ttl=self.ttl
+        )
+        self.persist = (
+            persist if persist is not None else env_flag("ANSWER_CACHE_PERSIST")
+        )
+        self.enabled = self.ttl > 0
+        self.persistent_hits = 0
+        self.persistent_errors = 0
+        self.skipped_personal = 0
+
+    def key(self, user: Dict[str, Any], lat: Any, lon: Any, question: str) -> str:
+        parts = [
+            str(user.get("crop") or "crop").strip().casefold(),
+            grid_cell(lat, lon, self.cell_deg),
+            str(user.get("language") or "English").strip().casefold(),
+            normalise_question(question),
+        ]
+        return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+    async def get(self, key: str, name: Optional[str] = None) -> Optional[str]:
+        if not self.enabled:
+            return None
+        answer = self.memory.get(key)
+        if answer is None and self.persist:
+            answer = await self._load(key)
+            if answer is not None:
+                self.persistent_hits += 1
+                self.memory.set(key, answer)
+        if answer is None:
+            return None
+        return answer.replace(NAME_PLACEHOLDER, name or "")
+
+    async def set(
+        self, key: str, answer: str, user: Optional[Dict[str, Any]] = None
+    ) -> None:
+        if not self.enabled or not answer:
+            return
+        answer = anonymise(answer, user or {})
+        if answer is None:
+            self.skipped_personal += 1
+            return
+        self.memory.set(key, answer)
+        if self.persist:
+            await self._store(key, answer)
+
+    async def _load(self, key: str) -> Optional[str]:
+        try:
+            from async_database import get_cached_answer
+        except ImportError:
+            from backend.async_database import get_cached_answer
+        try:
+            return await get_cached_answer(key)
+        except Exception as e:
+            self.persistent_errors += 1
+            logger.warning("Answer cache read failed: %s", e)
+            return None
+
+    async def _store(self, key: str, answer: str) -> None:
+        try:
+            from async_database import save_cached_answer
+        except ImportError:
+            from backend.async_database import save_cached_answer
+        try:
+            await save_cached_answer(key, answer, self.ttl)
+        except Exception as e:
+            self.persistent_errors += 1
+            logger.warning("Answer cache write failed: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            self.memory.stats(),
+            persist=self.persist,
+            persistent_hits=self.persistent_hits,
+            persistent_errors=self.persistent_errors,
+            skipped_personal=self.skipped_personal,
+        )
+
+
+answer_cache = AnswerCache()
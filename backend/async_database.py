@@ -0,0 +1,570 @@
+"""Async MongoDB repository (pymongo's native asyncio driver).
+
+The app's repository: request handlers, the WhatsApp agent and the jobs
+never block the event loop on a query. Phone normalisation, the user-change
+hooks and the user/claim query builders live in database.py, which also
+keeps a small sync API for scripts (phone migration, benchmarks).
+
+The client is created on first use, not at import, with a pool sized by
+MONGO_MAX_POOL_SIZE / MONGO_MIN_POOL_SIZE. Pool waits and server selection
+are bounded so a Mongo outage fails requests fast instead of piling them up.
+"""
+
+import asyncio
+import datetime
+import os
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import (
+    ASCENDING,
+    DESCENDING,
+    AsyncMongoClient,
+    ReplaceOne,
+    ReturnDocument,
+)
+from pymongo.errors import DuplicateKeyError
+
+try:
+    from settings import env_int
+except ImportError:
+    from backend.settings import env_int
+
+try:
+    from database import (
+        USER_INDEXES,
+        claim_document,
+        normalise_phone,
+        notify_user_changed,
+        user_lookups,
+        user_upsert,
+        utcnow,
+    )
+except ImportError:
+    from backend.database import (
+        USER_INDEXES,
+        claim_document,
+        normalise_phone,
+        notify_user_changed,
+        user_lookups,
+        user_upsert,
+        utcnow,
+    )
+
+DB_NAME = "agrispace_db"
+
+# What the dashboard may see of a farmer: never Aadhaar or bank details
+FARMER_FIELDS = (
+    "name",
+    "phone",
+    "crop",
+    "language",
+    "lat",
+    "lon",
+    "risk_score",
+    "ndvi_history",
+    "risk_computed_at",
+    "last_active",
+)
+CLAIM_FIELDS = (
+    "claim_id",
+    "phone",
+    "farmer_name",
+    "claim_type",
+    "date",
+    "status",
+    "ai_analysis",
+)
+# Same thresholds the insurance dashboard colours by
+RISK_BANDS = {
+    "low": {"$lt": 40},
+    "medium": {"$gte": 40, "$lte": 70},
+    "high": {"$gt": 70},
+}
+
+_client: Optional[AsyncMongoClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+_user_indexes_ready = False
+_answer_cache_indexed = False
+
+
+def get_client() -> AsyncMongoClient:
+    """Return the app-wide Mongo client, creating it on first use."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client = AsyncMongoClient(
+            os.getenv("MONGO_URI"),
+            maxPoolSize=env_int("MONGO_MAX_POOL_SIZE", 50),
+            minPoolSize=env_int("MONGO_MIN_POOL_SIZE", 5),
+            maxIdleTimeMS=60_000,
+            waitQueueTimeoutMS=env_int("MONGO_POOL_WAIT_MS", 2000),
+            serverSelectionTimeoutMS=env_int("MONGO_SELECT_TIMEOUT_MS", 5000),
+            connectTimeoutMS=5000,
+            retryWrites=True,
+        )
+        _client_loop = loop
+    return _client
+
+
+async def close_client() -> None:
+    global _client, _client_loop
+    if _client is not None:
+        await _client.close()
+    _client = None
+    _client_loop = None
+
+
+def _db():
+    return get_client()[DB_NAME]
+
+
+def users():
+    return _db()["users"]
+
+
+def claims():
+    return _db()["claims"]
+
+
+def answer_cache_col():
+    return _db()["answer_cache"]
+
+
+def brief_runs():
+    return _db()["brief_runs"]
+
+
+def brief_deliveries():
+    return _db()["brief_deliveries"]
+
+
+def brief_renders():
+    return _db()["brief_renders"]
+
+
+def brief_shards():
+    return _db()["brief_shards"]
+
+
+def leases():
+    return _db()["leases"]
+
+
+async def ensure_user_indexes():
+    global _user_indexes_ready
+    if _user_indexes_ready:
+        return
+    for keys, options in USER_INDEXES:
+        await users().create_index(keys, **options)
+    _user_indexes_ready = True
+
+
+async def ensure_indexes():
+    """Indexes behind the webhook lookups and the paginated dashboard lists."""
+    await ensure_user_indexes()
+    await users().create_index([("crop", ASCENDING), ("_id", ASCENDING)])
+    await users().create_index([("risk_score", ASCENDING), ("_id", ASCENDING)])
+    await users().create_index([("risk_computed_at", ASCENDING)])
+    await claims().create_index([("phone", ASCENDING), ("date", DESCENDING)])
+    await claims().create_index([("status", ASCENDING), ("_id", DESCENDING)])
+    # Per-farmer delivery markers are only needed for a few days
+    await brief_deliveries().create_index(
+        "claimed_at", expireAfterSeconds=7 * 24 * 3600
+    )
+    await brief_shards().create_index([("run_id", ASCENDING), ("status", ASCENDING)])
+    await brief_renders().create_index("rendered_at", expireAfterSeconds=2 * 24 * 3600)
+
+
+async def save_user(
+    phone: str,
+    name: str,
+    aadhar: str,
+    bank_acc: str,
+    language: str,
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    crop: Optional[str] = None,
+):
+    e164 = normalise_phone(phone)
+    if e164 is None:
+        raise ValueError(f"Invalid phone number: {phone!r}")
+    await ensure_user_indexes()
+
+    query, update = user_upsert(e164, name, aadhar, bank_acc, language, lat, lon, crop)
+    result = await users().update_one(query, update, upsert=True)
+    notify_user_changed(e164)
+    print(f"✅ User {name} saved.")
+    return result.upserted_id or "Updated"
+
+
+async def get_user_by_phone(phone: str):
+    e164 = normalise_phone(phone)
+    if e164 is None:
+        return None
+    for query in user_lookups(e164):
+        user = await users().find_one(query)
+        if user:
+            return user
+    return None
+
+
+# Fields the morning brief needs; no Aadhaar/bank details in memory
+BRIEF_FIELDS = (
+    "phone",
+    "name",
+    "crop",
+    "language",
+    "lat",
+    "lon",
+    "location",
+    "sender_jid",
+    "last_sender_jid",
+    "whatsapp_jid",
+)
+
+
+def _brief_query() -> Dict[str, Any]:
+    return {
+        "$or": [
+            {"sender_jid": {"$type": "string", "$ne": ""}},
+            {"last_sender_jid": {"$type": "string", "$ne": ""}},
+            {"whatsapp_jid": {"$type": "string", "$ne": ""}},
+        ]
+    }
+
+
+async def iter_brief_recipients(
+    after: Any = None,
+    batch_size: int = 500,
+    start: Any = None,
+    end: Any = None,
+) -> AsyncIterator[dict]:
+    """Stream farmers with a WhatsApp JID, in `_id` order after `after`.
+
+    `start` (inclusive) and `end` (exclusive) restrict it to one shard.
+    """
+    query = _brief_query()
+    id_range = {}
+    if after is not None:
+        id_range["$gt"] = after
+    if start is not None:
+        id_range["$gte"] = start
+    if end is not None:
+        id_range["$lt"] = end
+    if id_range:
+        query["_id"] = id_range
+    cursor = (
+        users()
+        .find(query, {f: 1 for f in BRIEF_FIELDS})
+        .sort("_id", ASCENDING)
+        .batch_size(batch_size)
+    )
+    async for farmer in cursor:
+        yield farmer
+
+
+async def brief_shard_bounds(shards: int) -> List[list]:
+    """Split the brief recipients into up to `shards` `[start, end)` id ranges.
+
+    The first range starts and the last ends open (None), so farmers created
+    after planning still belong to a shard.
+    """
+    cursor = await users().aggregate(
+        [
+            {"$match": _brief_query()},
+            {"$bucketAuto": {"groupBy": "$_id", "buckets": max(1, shards)}},
+        ]
+    )
+    starts = [bucket["_id"]["min"] async for bucket in cursor]
+    if not starts:
+        return [[None, None]]
+    starts[0] = None
+    return [[lo, hi] for lo, hi in zip(starts, starts[1:] + [None])]
+
+
+def parse_cursor(cursor: Optional[str]) -> Optional[ObjectId]:
+    """Decode a page cursor (the last document's id); ValueError if malformed."""
+    if not cursor:
+        return None
+    try:
+        return ObjectId(cursor)
+    except (InvalidId, TypeError):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def _projection(fields: Optional[Iterable[str]], allowed: Iterable[str]) -> dict:
+    allowed = tuple(allowed)
+    wanted = [f for f in (fields or allowed) if f in allowed] or list(allowed)
+    return {f: 1 for f in wanted}
+
+
+def farmer_query(crop: Optional[str] = None, risk: Optional[str] = None) -> dict:
+    query: Dict[str, Any] = {}
+    if crop:
+        query["crop"] = crop
+    if risk:
+        # Farmers without a stored score yet are not in any band
+        query["risk_score"] = RISK_BANDS[risk]
+    return query
+
+
+def claim_query(
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+) -> dict:
+    query: Dict[str, Any] = {}
+    if status:
+        query["status"] = status
+    if date_from or date_to:
+        # Claim dates are ISO strings, so string order is date order
+        query["date"] = {}
+        if date_from:
+            query["date"]["$gte"] = date_from
+        if date_to:
+            query["date"].update(_date_to_bound(date_to))
+    return query
+
+
+def _date_to_bound(date_to: str) -> Dict[str, str]:
+    """Inclusive upper bound; a bare day includes every claim made that day."""
+    try:
+        day = datetime.date.fromisoformat(date_to)
+    except ValueError:
+        return {"$lte": date_to}  # a full timestamp
+    return {"$lt": (day + datetime.timedelta(days=1)).isoformat()}
+
+
+def _with_defaults(farmer: dict, projection: Optional[dict] = None) -> dict:
+    # risk_score / ndvi_history are written by risk_job.py; absent until scored
+    if (projection is None or "crop" in projection) and not farmer.get("crop"):
+        farmer["crop"] = "Unknown"
+    return farmer
+
+
+async def iter_farmers(
+    query: dict,
+    fields: Optional[Iterable[str]] = None,
+    after: Optional[ObjectId] = None,
+    limit: int = 0,
+    batch_size: int = 500,
+) -> AsyncIterator[dict]:
+    """Farmers in `_id` order after `after`, projected, streamed in batches."""
+    if after is not None:
+        query = {**query, "_id": {"$gt": after}}
+    projection = _projection(fields, FARMER_FIELDS)
+    cursor = (
+        users()
+        .find(query, projection)
+        .sort("_id", ASCENDING)
+        .limit(limit)
+        .batch_size(batch_size)
+    )
+    async for farmer in cursor:
+        yield _with_defaults(farmer, projection)
+
+
+async def iter_claims(
+    query: dict,
+    fields: Optional[Iterable[str]] = None,
+    before: Optional[ObjectId] = None,
+    limit: int = 0,
+    batch_size: int = 500,
+) -> AsyncIterator[dict]:
+    """Claims newest first (by `_id`) before `before`, projected, streamed."""
+    if before is not None:
+        query = {**query, "_id": {"$lt": before}}
+    cursor = (
+        claims()
+        .find(query, _projection(fields, CLAIM_FIELDS))
+        .sort("_id", DESCENDING)
+        .limit(limit)
+        .batch_size(batch_size)
+    )
+    async for claim in cursor:
+        yield claim
+
+
+async def page(items: AsyncIterator[dict], limit: int) -> Dict[str, Any]:
+    """Collect one page and the cursor for the next one (None on the last)."""
+    docs = [doc async for doc in items]
+    next_cursor = str(docs[-1]["_id"]) if len(docs) == limit else None
+    for doc in docs:
+        doc.pop("_id", None)
+    return {"items": docs, "next_cursor": next_cursor}
+
+
+async def start_brief_run(run_id: str) -> dict:
+    """Get (or create) the state document of a day's briefing run.
+
+    Every call starts a new `attempt` (1, 2, ...), so delivery claims left
+    by a crashed attempt can be told apart from the current one's.
+    """
+    now = utcnow()
+    return await brief_runs().find_one_and_update(
+        {"_id": run_id},
+        {
+            "$setOnInsert": {
+                "started_at": now,
+                "checkpoint": None,
+                "status": "running",
+            },
+            "$set": {"resumed_at": now},
+            "$inc": {"attempt": 1},
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def save_brief_checkpoint(run_id: str, checkpoint: Any, stats: dict) -> None:
+    """Advance the run's cursor checkpoint (never backwards)."""
+    await brief_runs().update_one(
+        {"_id": run_id},
+        {
+            "$max": {"checkpoint": checkpoint},
+            "$set": {
+                "stats": stats,
+                "updated_at": utcnow(),
+            },
+        },
+    )
+
+
+async def finish_brief_run(run_id: str, stats: dict) -> None:
+    await brief_runs().update_one(
+        {"_id": run_id},
+        {
+            "$set": {
+                "status": "done",
+                "stats": stats,
+                "finished_at": utcnow(),
+            }
+        },
+    )
+
+
+async def claim_brief_delivery(
+    run_id: str,
+    farmer_id: Any,
+    stale_after: float,
+    state_id: Optional[str] = None,
+    attempt: int = 0,
+) -> Optional[str]:
+    """Claim the right to brief one farmer today.
+
+    Returns None once claimed, else the status of the marker in the way:
+    "sent", or "claimed" while another run state is sending. The marker's
+    `_id` is unique per (run, farmer). A claim can be taken over if the
+    earlier attempt failed, if it is older than `stale_after` seconds, or if
+    an earlier attempt of the same run state (`state_id`, the run or shard
+    whose checkpoint covers the farmer) left it behind when it crashed. A
+    send that was in flight during the crash may go out twice; none is lost.
+    """
+    now = utcnow()
+    stale = now - datetime.timedelta(seconds=stale_after)
+    marker_id = f"{run_id}:{farmer_id}"
+    try:
+        await brief_deliveries().update_one(
+            {
+                "_id": marker_id,
+                "$or": [
+                    {"status": "failed"},
+                    {"status": "claimed", "claimed_at": {"$lt": stale}},
+                    {
+                        "status": "claimed",
+                        "state_id": state_id,
+                        "attempt": {"$lt": attempt},
+                    },
+                ],
+            },
+            {
+                "$set": {
+                    "status": "claimed",
+                    "claimed_at": now,
+                    "run_id": run_id,
+                    "state_id": state_id,
+                    "attempt": attempt,
+                }
+            },
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        marker = await brief_deliveries().find_one({"_id": marker_id}, {"status": 1})
+        return (marker or {}).get("status", "claimed")
+    return None
+
+
+async def mark_brief_delivery(run_id: str, farmer_id: Any, status: str) -> None:
+    await brief_deliveries().update_one(
+        {"_id": f"{run_id}:{farmer_id}"},
+        {
+            "$set": {
+                "status": status,
+                "done_at": utcnow(),
+            }
+        },
+    )
+
+
+async def save_brief_renders(run_id: str, renders: List[dict]) -> None:
+    """Store pre-rendered briefs (each with a `farmer_id`) for a run."""
+    now = utcnow()
+    ops = [
+        ReplaceOne(
+            {"_id": f"{run_id}:{render['farmer_id']}"},
+            dict(render, run_id=run_id, rendered_at=now),
+            upsert=True,
+        )
+        for render in renders
+    ]
+    if ops:
+        await brief_renders().bulk_write(ops, ordered=False)
+
+
+async def get_brief_render(run_id: str, farmer_id: Any) -> Optional[dict]:
+    return await brief_renders().find_one({"_id": f"{run_id}:{farmer_id}"})
+
+
+async def create_claim_record(phone: str, claim_type: str):
+    claim = claim_document(await get_user_by_phone(phone), phone, claim_type)
+    await claims().insert_one(claim)
+    return claim
+
+
+async def get_claims_by_phone(phone: str, limit: int = 3) -> List[dict]:
+    cursor = claims().find({"phone": phone}, {"_id": 0}).sort("date", -1).limit(limit)
+    return await cursor.to_list(None)
+
+
+async def update_claim_status(claim_id: str, status: str, analysis: str):
+    await claims().update_one(
+        {"claim_id": claim_id}, {"$set": {"status": status, "ai_analysis": analysis}}
+    )
+
+
+async def get_cached_answer(key: str) -> Optional[str]:
+    doc = await answer_cache_col().find_one(
+        {
+            "_id": key,
+            "expires_at": {"$gt": utcnow()},
+        },
+        {"answer": 1},
+    )
+    return doc.get("answer") if doc else None
+
+
+async def save_cached_answer(key: str, answer: str, ttl_seconds: float):
+    global _answer_cache_indexed
+    if not _answer_cache_indexed:
+        await answer_cache_col().create_index("expires_at", expireAfterSeconds=0)
+        _answer_cache_indexed = True
+
+    expires_at = utcnow() + datetime.timedelta(seconds=ttl_seconds)
+    await answer_cache_col().update_one(
+        {"_id": key},
+        {"$set": {"answer": answer, "expires_at": expires_at}},
+        upsert=True,
+    )
@@ -0,0 +1,52 @@
+"""Micro-benchmark: per-message agent setup, cold vs warm runtime.
+
+Cold reproduces what every message used to pay before the first LLM call
+(configure Gemini, build the model, import the tool registry, serialise the
+protocol/tool prefix). Warm uses the shared AgentRuntime built at startup.
+No network calls are made.
+
+    cd backend && python bench_agent_runtime.py
+"""
+
+import os
+import timeit
+
+os.environ.setdefault("GOOGLE_API_KEY", "bench-key")
+
+import agent  # noqa: E402
+
+STEPS = 3  # typical tool-loop steps per message
+PROMPT = "Farmer name: Ravi\nCrop: Wheat\nUser message: should I water today?"
+
+
+def cold_message() -> None:
+    agent._configure_gemini()
+    agent.genai.GenerativeModel(agent.MODEL_NAME)
+    agent._available_tools()
+    for _ in range(STEPS):
+        (
+            agent.TOOL_PROTOCOL
+            + "\nTOOLS:\n"
+            + agent.json.dumps(agent.TOOLS_DESC, ensure_ascii=False)
+            + "\n\nUSER_CONTEXT_AND_REQUEST:\n"
+            + PROMPT
+        )
+
+
+def warm_message(runtime: agent.AgentRuntime) -> None:
+    for _ in range(STEPS):
+        runtime.build_step_prompt(PROMPT, [])
+
+
+def main() -> None:
+    runtime = agent.AgentRuntime(load_rag=False)
+    n = 2000
+    cold = min(timeit.repeat(cold_message, number=n, repeat=3)) / n
+    warm = min(timeit.repeat(lambda: warm_message(runtime), number=n, repeat=3)) / n
+    print(f"cold setup per message: {cold * 1e6:9.1f} µs")
+    print(f"warm setup per message: {warm * 1e6:9.1f} µs")
+    print(f"speed-up:               {cold / warm:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark: morning brief fan-out against a local stand-in bridge.
+
+Starts a minimal keep-alive HTTP server that answers the bridge's text
+endpoint after BENCH_BRIDGE_LATENCY_MS, then runs `morning_briefing_job`
+over BENCH_FARMERS synthetic farmers (no Mongo, no NASA calls; run state
+delivery markers and pre-rendered briefs are stubbed in memory, so this
+measures the delivery phase). The job's
+usual env knobs apply (BRIEF_CONCURRENCY, BRIDGE_SEND_RATE, ...).
+
+    cd backend && BENCH_FARMERS=10000 BRIDGE_SEND_RATE=200 python bench_morning_brief.py
+"""
+
+import asyncio
+import os
+
+os.environ.setdefault("GOOGLE_API_KEY", "bench-key")
+
+import bridge  # noqa: E402
+import scheduler  # noqa: E402
+
+N_FARMERS = int(os.getenv("BENCH_FARMERS", "10000"))
+LATENCY = float(os.getenv("BENCH_BRIDGE_LATENCY_MS", "20")) / 1000
+RESPONSE = (
+    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+    b'Content-Length: 16\r\n\r\n{"success":true}'
+)
+
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            await reader.readexactly(length)
+            await asyncio.sleep(LATENCY)
+            writer.write(RESPONSE)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _farmers(after=None, **kwargs):
+    for i in range(0 if after is None else after + 1, N_FARMERS):
+        yield {
+            "_id": i,
+            "phone": f"91{7000000000 + i}",
+            "sender_jid": f"91{7000000000 + i}@s.whatsapp.net",
+            "crop": "Wheat",
+        }
+
+
+async def _brief(farmer: dict) -> str:
+    return f"🌅 Good Morning!\n\n🌱 Crop: {farmer['crop']}\n✅ Advice: irrigate lightly"
+
+
+async def _render(run_id, farmer_id):
+    return {
+        "text": f"🌅 Good Morning!\n\n🌱 Crop: Wheat\n✅ Advice: irrigate ({farmer_id})"
+    }
+
+
+async def _run(run_id, *args):
+    return {"_id": run_id, "checkpoint": None, "status": "running"}
+
+
+async def _claim(run_id, farmer_id, *args):
+    return None
+
+
+async def _senders(run_id):
+    return 0
+
+
+async def main() -> None:
+    server = await asyncio.start_server(_serve, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    bridge.BRIDGE_BASE_URL = f"http://127.0.0.1:{port}"
+    scheduler.iter_brief_recipients = _farmers
+    scheduler.generate_morning_brief = _brief
+    scheduler.start_brief_run = _run
+    scheduler.get_brief_render = _render
+    scheduler.claim_brief_delivery = _claim
+    scheduler.live_delivery_shards = _senders
+    scheduler.mark_brief_delivery = scheduler.save_brief_checkpoint = _run
+    scheduler.finish_brief_run = _run
+    os.environ.setdefault("BRIEF_PROGRESS_EVERY", str(max(1, N_FARMERS // 5)))
+
+    async with server:
+        stats = await scheduler.morning_briefing_job()
+        await bridge.close_client()
+    print(
+        f"{N_FARMERS} farmers in {stats['seconds']}s "
+        f"({stats['per_second']} msg/s, {stats['failed']} failed)"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+"""Benchmark: farmer lookup by phone, old regex scan vs indexed E.164 lookup.
+
+Loads BENCH_USERS synthetic farmers (default 1,000,000) into a scratch
+database on MONGO_URI, then compares the old unanchored `$regex` fallback
+with `get_user_by_phone` on the `phone_e164` unique index. Mongo's explain()
+output shows the plan (COLLSCAN vs IXSCAN) and documents examined, which is
+what makes the new lookup O(log n).
+
+    cd backend && MONGO_URI=mongodb://localhost:27017 python bench_phone_lookup.py
+"""
+
+import os
+import random
+import time
+
+from pymongo import MongoClient
+
+import database
+
+N_USERS = int(os.getenv("BENCH_USERS", "1000000"))
+N_LOOKUPS = int(os.getenv("BENCH_LOOKUPS", "200"))
+BATCH = 10000
+
+
+def _plan(cursor) -> tuple:
+    stats = cursor.explain()["executionStats"]
+    stage = stats["executionStages"]
+    while "inputStage" in stage and stage["stage"] not in ("COLLSCAN", "IXSCAN"):
+        stage = stage["inputStage"]
+    return stage["stage"], stats["totalDocsExamined"]
+
+
+def _time_ms(fn, phones) -> float:
+    start = time.perf_counter()
+    for phone in phones:
+        fn(phone)
+    return (time.perf_counter() - start) * 1000 / len(phones)
+
+
+def main() -> None:
+    client = MongoClient(os.environ["MONGO_URI"])
+    client.drop_database("agrispace_bench")
+    users = client["agrispace_bench"]["users"]
+    database.users_collection = users
+    database._user_indexes_ready = False
+
+    print(f"Loading {N_USERS} users...")
+    for start in range(0, N_USERS, BATCH):
+        users.insert_many(
+            {"phone": f"91{7000000000 + i}", "phone_e164": f"+91{7000000000 + i}"}
+            for i in range(start, min(start + BATCH, N_USERS))
+        )
+    database.ensure_user_indexes()
+
+    sample = [f"{7000000000 + random.randrange(N_USERS)}" for _ in range(N_LOOKUPS)]
+
+    regex_stage, regex_docs = _plan(users.find({"phone": {"$regex": sample[0]}}))
+    index_stage, index_docs = _plan(users.find({"phone_e164": "+91" + sample[0]}))
+    regex_ms = _time_ms(
+        lambda p: users.find_one({"phone": {"$regex": p}}),
+        sample[: max(1, N_LOOKUPS // 20)],
+    )
+    index_ms = _time_ms(database.get_user_by_phone, sample)
+
+    print(
+        f"regex scan:     {regex_stage:8} docs examined={regex_docs:>9}  {regex_ms:8.3f} ms/lookup"
+    )
+    print(
+        f"indexed lookup: {index_stage:8} docs examined={index_docs:>9}  {index_ms:8.3f} ms/lookup"
+    )
+    client.drop_database("agrispace_bench")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Shared HTTP client for the WhatsApp bridge (Go / whatsmeow on :8080).
+
+One keep-alive `httpx.AsyncClient` lives for the whole app, so text sends and
+voice-note uploads reuse pooled TCP connections instead of dialling the bridge
+for every message. Older bridge builds expose the text endpoint under
+different paths; the one that works is discovered once and remembered.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Dict, Optional
+
+import httpx
+
+try:
+    from settings import env_int
+except ImportError:
+    from backend.settings import env_int
+
+logger = logging.getLogger(__name__)
+
+BRIDGE_BASE_URL = os.getenv("BRIDGE_BASE_URL", "http://localhost:8080")
+TEXT_ENDPOINTS = ("/api/send", "/send/text", "/send")
+AUDIO_ENDPOINT = "/api/send_audio"
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+_text_endpoint: Optional[str] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the app-wide bridge client, creating it on first use."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        max_conns = env_int("BRIDGE_MAX_CONNECTIONS", 50)
+        _client = httpx.AsyncClient(
+            base_url=BRIDGE_BASE_URL,
+            timeout=httpx.Timeout(5.0),
+            limits=httpx.Limits(
+                max_connections=max_conns,
+                max_keepalive_connections=max_conns,
+                keepalive_expiry=60.0,
+            ),
+        )
+        _client_loop = loop
+    return _client
+
+
+async def close_client() -> None:
+    global _client, _client_loop
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+
+async def post_text(payload: Dict[str, Any]) -> bool:
+    """POST a text message, using the cached endpoint when we have one."""
+    global _text_endpoint
+    client = get_client()
+
+    candidates = [_text_endpoint] if _text_endpoint else list(TEXT_ENDPOINTS)
+    not_found = False
+    for endpoint in candidates:
+        try:
+            resp = await client.post(endpoint, json=payload)
+        except Exception as e:
+            logger.error("❌ Connection Error to %s: %s", endpoint, e)
+            continue
+
+        if resp.status_code == 200:
+            if _text_endpoint != endpoint:
+                logger.info("✅ Bridge text endpoint: %s", endpoint)
+                _text_endpoint = endpoint
+            return True
+        if resp.status_code != 404:
+            logger.warning("⚠️ Bridge Error (%s): %s", resp.status_code, resp.text)
+            return False
+        not_found = True
+
+    if _text_endpoint and not_found:
+        # The remembered endpoint vanished (bridge upgraded?): rediscover once
+        _text_endpoint = None
+        return await post_text(payload)
+
+    logger.error("❌ Failed to send message on all known endpoints.")
+    return False
+
+
+async def post_audio(
+    data: Dict[str, Any], files: Dict[str, Any], timeout: float = 60
+) -> httpx.Response:
+    """Upload a voice note; media uploads get a longer timeout than text."""
+    return await get_client().post(
+        AUDIO_ENDPOINT, data=data, files=files, timeout=timeout
+    )
@@ -0,0 +1,303 @@
+"""Cross-process coordination for scheduled jobs, backed by Mongo leases.
+
+Every uvicorn worker (and every node) runs `scheduler_loop`. A lease
+document in `leases` elects one leader, and only the leader plans a day's
+briefing run: it splits the recipients into BRIEF_SHARDS contiguous `_id`
+ranges stored in `brief_shards`. Every instance, leader included, then
+claims shards one at a time under a lease it keeps renewing, so brief
+throughput grows with the number of workers.
+
+Each run has two phases with one shard set each: "render" shards (claimable
+at once) precompute and store the briefs, and "deliver" shards (claimable
+from the run's delivery time) only send what was rendered. Render shards are
+claimed first.
+
+BRIDGE_SEND_RATE is the bridge's limit for the whole deployment, so
+delivery shards split it: each one sends at rate / `live_delivery_shards`,
+re-read every few seconds as shards start and finish.
+
+An instance that dies stops renewing. After SCHEDULER_LEASE_SECONDS its
+leadership or its shard can be taken over; the shard's checkpoint and the
+per-farmer delivery markers keep the new owner from re-sending briefs.
+"""
+
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+try:
+    from settings import env_float
+except ImportError:
+    from backend.settings import env_float
+
+try:
+    from async_database import brief_shard_bounds, brief_shards, leases
+except ImportError:
+    from backend.async_database import brief_shard_bounds, brief_shards, leases
+
+logger = logging.getLogger(__name__)
+
+# Unique per process, readable in the lease documents
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def lease_seconds() -> float:
+    return max(1.0, env_float("SCHEDULER_LEASE_SECONDS", 60))
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class LeaseLost(Exception):
+    """The lease a job was running under was taken over by another instance."""
+
+
+class Lease:
+    """A named, expiring lock held by one instance at a time."""
+
+    def __init__(
+        self, name: str, owner: str = INSTANCE_ID, ttl: Optional[float] = None
+    ):
+        self.name = name
+        self.owner = owner
+        self.ttl = ttl if ttl is not None else lease_seconds()
+        self.held = False
+        self.acquired = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def acquire(self) -> bool:
+        """Take the lease if it is free or expired, or renew it if ours."""
+        now = _now()
+        try:
+            await leases().update_one(
+                {
+                    "_id": self.name,
+                    "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now}}],
+                },
+                {
+                    "$set": {
+                        "owner": self.owner,
+                        "expires_at": now + datetime.timedelta(seconds=self.ttl),
+                        "renewed_at": now,
+                    }
+                },
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            self.held = False  # someone else holds it
+            return False
+        if not self.held:
+            self.acquired += 1
+            logger.info("%s acquired lease %s", self.owner, self.name)
+        self.held = True
+        return True
+
+    async def release(self) -> None:
+        if self.held:
+            await leases().delete_one({"_id": self.name, "owner": self.owner})
+        self.held = False
+
+    async def _try_acquire(self) -> None:
+        try:
+            await self.acquire()
+        except Exception as e:
+            # Mongo unreachable: assume the lease is lost rather than act as
+            # the holder after it may have expired
+            self.held = False
+            logger.warning("Lease %s renewal failed: %s", self.name, e)
+
+    async def _keep(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            await self._try_acquire()
+
+    async def start(self) -> None:
+        """Try to take the lease now, then keep trying/renewing in the background."""
+        if self._task is None:
+            await self._try_acquire()
+            self._task = asyncio.create_task(self._keep())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.release()
+        except Exception as e:
+            logger.warning("Lease %s release failed: %s", self.name, e)
+
+
+async def plan_brief_run(
+    run_id: str, shards: int, deliver_at: Optional[datetime.datetime] = None
+) -> int:
+    """Create the shard documents of a run (idempotent); returns the count.
+
+    Every `_id` range gets a render shard and a deliver shard; deliver
+    shards cannot be claimed before `deliver_at` (None: right away).
+
+    The first planner's boundaries are stored in a plan document, so two
+    instances planning the same run can never produce overlapping shards.
+    """
+    plan_id = f"{run_id}:plan"
+    plan = await brief_shards().find_one({"_id": plan_id})
+    if plan is None:
+        bounds = await brief_shard_bounds(shards)
+        try:
+            plan = await brief_shards().find_one_and_update(
+                {"_id": plan_id},
+                {
+                    "$setOnInsert": {
+                        "kind": "plan",
+                        "run_id": run_id,
+                        "bounds": bounds,
+                        "created_at": _now(),
+                    }
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            plan = await brief_shards().find_one({"_id": plan_id})
+
+    phases = [("render", f"{run_id}:render", None), ("deliver", run_id, deliver_at)]
+    ops = [
+        UpdateOne(
+            {"_id": f"{prefix}:{i:03d}"},
+            {
+                "$setOnInsert": {
+                    "kind": "shard",
+                    "run_id": run_id,
+                    "phase": phase,
+                    "step": step,
+                    "start": start,
+                    "end": end,
+                    "not_before": not_before,
+                    "status": "pending",
+                    "owner": None,
+                    "lease_until": None,
+                    "attempts": 0,
+                }
+            },
+            upsert=True,
+        )
+        for step, (phase, prefix, not_before) in enumerate(phases)
+        for i, (start, end) in enumerate(plan["bounds"])
+    ]
+    await brief_shards().bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+async def claim_shard(
+    run_id: str, owner: str = INSTANCE_ID, ttl: Optional[float] = None
+) -> Optional[dict]:
+    """Take the next due pending (or abandoned) shard of a run, or None."""
+    now = _now()
+    ttl = ttl if ttl is not None else lease_seconds()
+    return await brief_shards().find_one_and_update(
+        {
+            "run_id": run_id,
+            "kind": "shard",
+            "$and": [
+                {
+                    "$or": [
+                        {"status": "pending"},
+                        {"status": "running", "lease_until": {"$lt": now}},
+                    ]
+                },
+                {"$or": [{"not_before": None}, {"not_before": {"$lte": now}}]},
+            ],
+        },
+        {
+            "$set": {
+                "status": "running",
+                "owner": owner,
+                "lease_until": now + datetime.timedelta(seconds=ttl),
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("step", ASCENDING), ("_id", ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def renew_shard(
+    shard_id: str, owner: str = INSTANCE_ID, ttl: Optional[float] = None
+) -> bool:
+    """Extend our lease on a shard; False if another instance took it over."""
+    ttl = ttl if ttl is not None else lease_seconds()
+    result = await brief_shards().update_one(
+        {"_id": shard_id, "owner": owner, "status": "running"},
+        {"$set": {"lease_until": _now() + datetime.timedelta(seconds=ttl)}},
+    )
+    return result.matched_count == 1
+
+
+async def live_delivery_shards(run_id: str) -> int:
+    """Delivery shards of `run_id` currently held under an unexpired lease."""
+    return await brief_shards().count_documents(
+        {
+            "run_id": run_id,
+            "kind": "shard",
+            "phase": "deliver",
+            "status": "running",
+            "lease_until": {"$gt": _now()},
+        }
+    )
+
+
+async def finish_shard(
+    shard_id: str, stats: Dict[str, Any], owner: str = INSTANCE_ID
+) -> None:
+    await brief_shards().update_one(
+        {"_id": shard_id, "owner": owner},
+        {"$set": {"status": "done", "stats": stats, "finished_at": _now()}},
+    )
+
+
+async def run_with_lease(
+    job: Awaitable[Any], renew: Callable[[], Awaitable[bool]], ttl: float
+) -> Any:
+    """Await `job`, renewing its lease every ttl/3 seconds.
+
+    If a renewal reports the lease lost, the job is cancelled and LeaseLost
+    is raised. A renewal that errors (Mongo blip) is retried on the next tick.
+    """
+    task = asyncio.ensure_future(job)
+    lost = False
+
+    async def keep() -> None:
+        nonlocal lost
+        while True:
+            await asyncio.sleep(ttl / 3)
+            try:
+                if await renew():
+                    continue
+            except Exception as e:
+                logger.warning("Lease renewal failed: %s", e)
+                continue
+            lost = True
+            task.cancel()
+            return
+
+    keeper = asyncio.create_task(keep())
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if lost:
+            raise LeaseLost()
+        raise
+    finally:
+        keeper.cancel()
+        await asyncio.gather(keeper, return_exceptions=True)
@@ -1,5 +1,6 @@
-from pymongo import MongoClient
+from pymongo import ASCENDING, MongoClient, UpdateOne
 import os
+import re
 from dotenv import load_dotenv
 from typing import Optional
 import datetime
@@ -7,19 +8,123 @@ import random
 
 load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
+# Country code assumed for numbers registered without one (10-digit mobiles)
+DEFAULT_COUNTRY_CODE = os.getenv("DEFAULT_COUNTRY_CODE", "91")
 
-try:
-    client = MongoClient(MONGO_URI)
-    db = client["agrispace_db"]
-    users_collection = db["users"]
-    claims_collection = db["claims"]
-    print("✅ Database: Connected successfully!")
-except Exception as e:
-    print(f"❌ Database Connection Failed: {e}")
+# Query builders and phone helpers shared with async_database.py (the app's
+# repository), plus the small sync API scripts need: phone migration,
+# benchmarks. The client is only created when a collection is first used.
+_client = None
 
 
-def save_user(
-    phone: str,
+def get_sync_db():
+    global _client
+    if _client is None:
+        _client = MongoClient(MONGO_URI)
+        print("✅ Database: Client created")
+    return _client["agrispace_db"]
+
+
+class _LazyCollection:
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_sync_db()[self._name], attr)
+
+
+users_collection = _LazyCollection("users")
+
+
+_NON_DIGITS = re.compile(r"\D")
+
+
+def normalise_phone(raw: str) -> Optional[str]:
+    """Canonical E.164 form ("+919876543210") of a phone number, or None.
+
+    Accepts what the app and the WhatsApp bridge send: "9876543210",
+    "+91 98765 43210", "919876543210", "whatsapp:+91...", "0098...",
+    "09876543210" and phone JIDs ("91...@s.whatsapp.net").
+    """
+    text = str(raw or "").strip().replace("whatsapp:", "")
+    if "@" in text:
+        user, _, server = text.partition("@")
+        if server != "s.whatsapp.net":
+            return None  # @lid / group JIDs are not phone numbers
+        text = user.split(":")[0]  # drop the device suffix
+    digits = _NON_DIGITS.sub("", text)
+    if text.startswith("+"):
+        pass
+    elif digits.startswith("00"):
+        digits = digits[2:]
+    elif len(digits) == 11 and digits.startswith("0"):
+        digits = DEFAULT_COUNTRY_CODE + digits[1:]
+    elif len(digits) == 10:
+        digits = DEFAULT_COUNTRY_CODE + digits
+    if not 8 <= len(digits) <= 15 or digits.startswith("0"):
+        return None
+    return "+" + digits
+
+
+def legacy_phones(e164: str) -> list:
+    """Formats older documents may still store in `phone` (pre-migration)."""
+    digits = e164[1:]
+    forms = [digits, e164]
+    if digits.startswith(DEFAULT_COUNTRY_CODE):
+        forms.append(digits[len(DEFAULT_COUNTRY_CODE) :])
+    return forms
+
+
+_user_listeners = []
+
+
+def on_user_changed(callback):
+    """Register `callback(phone_e164)`, called after a user document is written.
+
+    Caches in front of `get_user_by_phone` use this for explicit invalidation.
+    """
+    _user_listeners.append(callback)
+
+
+def notify_user_changed(e164: str):
+    for callback in _user_listeners:
+        try:
+            callback(e164)
+        except Exception as e:
+            print(f"⚠️ User change listener failed: {e}")
+
+
+def utcnow() -> datetime.datetime:
+    """Timezone-aware UTC now; the one convention for stored timestamps."""
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+# (keys, options) of the users indexes, created by both the sync and async APIs
+USER_INDEXES = (
+    (
+        [("phone_e164", ASCENDING)],
+        {
+            "unique": True,
+            # Documents not yet migrated have no phone_e164 and must not collide
+            "partialFilterExpression": {"phone_e164": {"$type": "string"}},
+            "name": "phone_e164_unique",
+        },
+    ),
+    ([("phone", ASCENDING)], {"name": "phone"}),
+)
+
+
+def user_lookups(e164: str) -> list:
+    """Queries to try in order for the user with phone `e164`."""
+    return [
+        {"phone_e164": e164},
+        # Documents written before the phone migration ran
+        {"phone_e164": {"$exists": False}, "phone": {"$in": legacy_phones(e164)}},
+    ]
+
+
+def user_upsert(
+    e164: str,
     name: str,
     aadhar: str,
     bank_acc: str,
@@ -28,13 +133,16 @@ def save_user(
     lon: Optional[float] = None,
     crop: Optional[str] = None,
 ):
+    """(filter, update) that registers or updates the farmer with phone `e164`."""
     user_data = {
-        "phone": phone,
+        # `phone` keeps the digits-only form used for JIDs and claims
+        "phone": e164[1:],
+        "phone_e164": e164,
         "name": name,
         "aadhar": aadhar,
         "bank_acc": bank_acc,
         "language": language,
-        "last_active": datetime.datetime.now(),
+        "last_active": utcnow(),
     }
 
     if lat is not None and lon is not None:
@@ -45,64 +153,85 @@ def save_user(
     if crop is not None:
         user_data["crop"] = crop
 
-    result = users_collection.update_one(
-        {"phone": phone}, {"$set": user_data}, upsert=True
-    )
-    print(f"✅ User {name} saved.")
-    return result.upserted_id or "Updated"
-
-
-def get_user_by_phone(phone: str):
-    user = users_collection.find_one({"phone": phone})
-    if not user:
-        clean_phone = phone.replace("whatsapp:", "")
-        user = users_collection.find_one({"phone": {"$regex": clean_phone}})
-    return user
-
-
-def get_all_farmers():
-    return list(users_collection.find())
+    return {"$or": user_lookups(e164)}, {"$set": user_data}
 
 
-def get_all_farmers_with_risk():
-    farmers = list(users_collection.find({}, {"_id": 0}))
-    enhanced_farmers = []
-
-    for f in farmers:
-        if "risk_score" not in f:
-            f["risk_score"] = random.randint(10, 95)
-            f["ndvi_history"] = [random.uniform(0.1, 0.8) for _ in range(5)]
-
-        if "crop" not in f or not f["crop"]:
-            f["crop"] = "Unknown"
-
-        enhanced_farmers.append(f)
-
-    return enhanced_farmers
-
-
-def create_claim_record(phone: str, claim_type: str):
-    user = get_user_by_phone(phone)
-    farmer_name = user.get("name", "Unknown") if user else "Unknown"
-
-    claim = {
+def claim_document(user: Optional[dict], phone: str, claim_type: str) -> dict:
+    """A new pending claim for `user` (None if the phone is not registered)."""
+    return {
         "claim_id": f"CLM-{random.randint(10000, 99999)}",
-        "phone": phone,
-        "farmer_name": farmer_name,
+        "phone": user.get("phone", phone) if user else phone,
+        "farmer_name": user.get("name", "Unknown") if user else "Unknown",
         "claim_type": claim_type,
-        "date": datetime.datetime.now().isoformat(),
+        "date": utcnow().isoformat(),
         "status": "Pending",
         "ai_analysis": "Pending",
     }
-    claims_collection.insert_one(claim)
-    return claim
 
 
-def get_all_claims_data():
-    return list(claims_collection.find({}, {"_id": 0}))
+_user_indexes_ready = False
+
 
+def ensure_user_indexes():
+    """Unique index on the canonical phone plus a plain one for legacy lookups."""
+    global _user_indexes_ready
+    if _user_indexes_ready:
+        return
+    for keys, options in USER_INDEXES:
+        users_collection.create_index(keys, **options)
+    _user_indexes_ready = True
 
-def update_claim_status(claim_id: str, status: str, analysis: str):
-    claims_collection.update_one(
-        {"claim_id": claim_id}, {"$set": {"status": status, "ai_analysis": analysis}}
+
+def get_user_by_phone(phone: str):
+    """Indexed point lookup by canonical phone (no collection scans)."""
+    e164 = normalise_phone(phone)
+    if e164 is None:
+        return None
+    for query in user_lookups(e164):
+        user = users_collection.find_one(query)
+        if user:
+            return user
+    return None
+
+
+def migrate_phone_numbers(batch_size: int = 1000) -> dict:
+    """Backfill `phone_e164` (and canonical `phone`) on existing users.
+
+    Idempotent and restartable: only documents without `phone_e164` are
+    touched. Numbers that cannot be parsed, or that collide with an already
+    migrated user, are left alone and reported.
+    """
+    report = {"scanned": 0, "updated": 0, "invalid": [], "duplicates": []}
+    taken = set()
+    batch = []
+
+    def flush():
+        if batch:
+            result = users_collection.bulk_write(batch, ordered=False)
+            report["updated"] += result.modified_count
+            batch.clear()
+
+    cursor = users_collection.find(
+        {"phone_e164": {"$exists": False}}, {"phone": 1}, batch_size=batch_size
     )
+    for doc in cursor:
+        report["scanned"] += 1
+        e164 = normalise_phone(doc.get("phone"))
+        if e164 is None:
+            report["invalid"].append(str(doc["_id"]))
+            continue
+        if e164 in taken or users_collection.find_one({"phone_e164": e164}, {"_id": 1}):
+            report["duplicates"].append(str(doc["_id"]))
+            continue
+        taken.add(e164)
+        batch.append(
+            UpdateOne(
+                {"_id": doc["_id"]},
+                {"$set": {"phone": e164[1:], "phone_e164": e164}},
+            )
+        )
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    ensure_user_indexes()
+    return report
@@ -0,0 +1,132 @@
+"""Duplicate suppression for WhatsApp webhook deliveries.
+
+When the backend is slow the bridge may post the same message again. Each
+payload is reduced to a key: the WhatsApp message ID when the bridge sends
+one, otherwise a hash of sender + content + timestamp. Keys are remembered for
+DEDUP_TTL_SECONDS in a bounded in-process TTL cache (O(1), checked before any
+DB or LLM work).
+
+With REDIS_URL set (and the optional `redis` package installed) keys are also
+claimed with SET NX in Redis, so several uvicorn workers or nodes agree on
+what was already seen. Redis errors fail open: a message is never dropped
+because the shared tier is unavailable.
+"""
+
+import hashlib
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    from settings import env_float
+except ImportError:
+    from backend.settings import env_float
+
+try:
+    from cache import TTLCache
+except ImportError:
+    from backend.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class DedupStore:
+    def __init__(
+        self,
+        ttl: Optional[float] = None,
+        maxsize: Optional[int] = None,
+        no_id_ttl: Optional[float] = None,
+        redis_url: Optional[str] = None,
+    ):
+        self.ttl = ttl if ttl is not None else env_float("DEDUP_TTL_SECONDS", 600)
+        # Without a message ID or timestamp the key is just sender + text, so
+        # only suppress within a short retry window (a farmer may say "hi" twice)
+        self.no_id_ttl = (
+            no_id_ttl if no_id_ttl is not None else env_float("DEDUP_NO_ID_TTL", 30)
+        )
+        self.local = TTLCache(
+            maxsize=maxsize or int(env_float("DEDUP_MAX_KEYS", 50000)), ttl=self.ttl
+        )
+        self.redis_url = redis_url if redis_url is not None else os.getenv("REDIS_URL")
+        self._redis: Any = None
+
+        self.checked = 0
+        self.duplicates = 0
+        self.shared_duplicates = 0
+        self.shared_errors = 0
+
+    def key_for(self, payload: dict) -> Tuple[str, float]:
+        """Return (key, ttl) for a webhook payload."""
+        msg_id = str(payload.get("id") or payload.get("message_id") or "").strip()
+        sender = str(payload.get("from") or payload.get("sender_jid") or "")
+        if msg_id:
+            return f"wa:id:{sender}:{msg_id}", self.ttl
+
+        timestamp = str(payload.get("timestamp") or "")
+        raw = "|".join([sender, str(payload.get("content") or ""), timestamp])
+        digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+        return f"wa:h:{digest}", self.ttl if timestamp else self.no_id_ttl
+
+    def _shared(self) -> Any:
+        if self._redis is None and self.redis_url:
+            try:
+                import redis.asyncio as redis_asyncio  # type: ignore
+
+                self._redis = redis_asyncio.from_url(self.redis_url)
+            except Exception as e:
+                logger.warning("Shared dedup disabled (%s)", e)
+                self.redis_url = None
+        return self._redis
+
+    async def seen(self, payload: dict) -> bool:
+        """True if this payload was already accepted; otherwise remember it."""
+        self.checked += 1
+        key, ttl = self.key_for(payload)
+        if self.local.get(key) is not None:
+            self.duplicates += 1
+            return True
+        self.local.set(key, True, ttl=ttl)
+
+        shared = self._shared()
+        if shared is not None:
+            try:
+                claimed = await shared.set(key, 1, nx=True, ex=max(1, int(ttl)))
+                if not claimed:
+                    self.duplicates += 1
+                    self.shared_duplicates += 1
+                    return True
+            except Exception as e:
+                self.shared_errors += 1
+                logger.warning("Shared dedup check failed: %s", e)
+        return False
+
+    async def forget(self, payload: dict) -> None:
+        """Undo `seen` for a payload we could not accept, so a retry gets in."""
+        key, _ = self.key_for(payload)
+        self.local.pop(key)
+        shared = self._shared()
+        if shared is not None:
+            try:
+                await shared.delete(key)
+            except Exception as e:
+                self.shared_errors += 1
+                logger.warning("Shared dedup forget failed: %s", e)
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "shared_duplicates": self.shared_duplicates,
+            "shared_errors": self.shared_errors,
+            "shared": bool(self.redis_url),
+            "keys": len(self.local),
+            "max_keys": self.local.maxsize,
+        }
+
+
+dedup_store = DedupStore()
@@ -0,0 +1,310 @@
+"""Bulk farmer onboarding from CSV or JSONL (cooperative spreadsheets).
+
+The body is parsed as it streams in: bytes are decoded incrementally and
+cut into rows (never the whole file in memory, no temp file). Each row is
+validated with the same `FarmerRegistration` model as /api/register, gets
+its phone normalised to E.164, and is upserted through async_database in
+large unordered `bulk_write` batches. Bad rows do not stop the import; each
+one is reported with its line number.
+
+    cd backend && python farmer_import.py farmers.csv
+    curl --data-binary @farmers.csv -H "Content-Type: text/csv" \\
+         http://localhost:8000/api/farmers/import
+"""
+
+import argparse
+import asyncio
+import codecs
+import csv
+import json
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+try:
+    import async_database
+    import database
+    from models import FarmerRegistration
+    from settings import env_int
+except ImportError:
+    from backend import async_database, database
+    from backend.models import FarmerRegistration
+    from backend.settings import env_int
+
+# Column names cooperatives actually use -> FarmerRegistration fields
+COLUMN_ALIASES = {
+    "phone": "phone_number",
+    "mobile": "phone_number",
+    "aadhaar": "aadhar",
+    "bank_account": "bank_acc",
+    "lon": "long",
+    "lng": "long",
+    "longitude": "long",
+    "latitude": "lat",
+}
+MAX_REPORTED_ERRORS = 1000
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, str]]:
+    """Yield (line number, line with its newline) as UTF-8 bytes arrive."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    line_no = 0
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            line_no += 1
+            yield line_no, line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield line_no + 1, pending
+
+
+def _csv_row(header: List[str], cells: List[str]) -> Dict[Any, Any]:
+    # Same shape as csv.DictReader: extra cells under None, missing ones None
+    row: Dict[Any, Any] = dict(zip(header, cells))
+    for key in header[len(cells) :]:
+        row[key] = None
+    if len(cells) > len(header):
+        row[None] = cells[len(header) :]
+    return row
+
+
+def _ends_quoted(line: str, quoted: bool) -> bool:
+    """Whether a record is still inside a quoted field after `line`.
+
+    `quoted` is the state before the line. As in the csv module's default
+    dialect, a quote opens a field only as its first character (elsewhere it
+    is a literal, e.g. `Ram "Bhai`), and `""` inside a quoted field is an
+    escaped quote.
+    """
+    field_start = not quoted
+    i = 0
+    while i < len(line):
+        char = line[i]
+        if quoted:
+            if char == '"':
+                if line[i + 1 : i + 2] == '"':
+                    i += 1
+                else:
+                    quoted = False
+        elif char == '"' and field_start:
+            quoted = True
+        field_start = not quoted and char in ",\r\n"
+        i += 1
+    return quoted
+
+
+async def iter_records(
+    chunks: AsyncIterator[bytes], fmt: str
+) -> AsyncIterator[Tuple[int, Any]]:
+    """Yield (line number, row dict or parse error) from a CSV/JSONL body.
+
+    A CSV record ends on the line that closes its last quoted field, so
+    quoted cells may contain newlines; its line number is that last line.
+    A quoted field still open at the end of the body is reported as an error
+    on the line it started.
+    """
+    header: Optional[List[str]] = None
+    record = ""
+    record_line = 0
+    quoted = False
+    async for line_no, line in iter_lines(chunks):
+        if fmt != "csv":
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_no, e
+                continue
+            if isinstance(row, dict):
+                yield line_no, row
+            else:
+                yield line_no, ValueError(
+                    f"expected a JSON object, got {type(row).__name__}"
+                )
+            continue
+
+        if not record:
+            record_line = line_no
+        record += line
+        quoted = _ends_quoted(line, quoted)
+        if quoted:
+            continue
+        cells = next(csv.reader([record]), [])
+        record = ""
+        if not cells:
+            continue
+        if header is None:
+            header = cells
+        else:
+            yield line_no, _csv_row(header, cells)
+    if record:
+        yield record_line, ValueError("quoted field is never closed")
+
+
+def _clean(row: Dict[str, Any]) -> Dict[str, Any]:
+    cleaned = {}
+    for key, value in row.items():
+        if key is None:
+            continue  # extra CSV cells without a header
+        key = str(key).strip().lower()
+        if isinstance(value, str):
+            value = value.strip()
+        if value in ("", None):
+            continue
+        cleaned[COLUMN_ALIASES.get(key, key)] = value
+    return cleaned
+
+
+def row_to_upsert(row: Dict[str, Any]) -> Tuple[str, UpdateOne]:
+    """Validate one row; ValueError / ValidationError if it is unusable."""
+    farmer = FarmerRegistration.model_validate(_clean(row))
+    e164 = database.normalise_phone(farmer.phone_number)
+    if e164 is None:
+        raise ValueError(f"Invalid phone number: {farmer.phone_number!r}")
+    query, update = database.user_upsert(
+        e164,
+        farmer.name,
+        farmer.aadhar,
+        farmer.bank_acc,
+        farmer.language,
+        lat=farmer.lat,
+        lon=farmer.long,
+        crop=farmer.crop,
+    )
+    return e164, UpdateOne(query, update, upsert=True)
+
+
+def _describe(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(p) for p in e['loc']) or 'row'}: {e['msg']}"
+            for e in error.errors()
+        )
+    return str(error)
+
+
+async def import_farmers(
+    chunks: AsyncIterator[bytes],
+    fmt: str = "csv",
+    batch_size: Optional[int] = None,
+    collection: Any = None,
+) -> Dict[str, Any]:
+    """Import every row of a streamed body; returns counts and per-row errors."""
+    if collection is None:
+        await async_database.ensure_user_indexes()
+        collection = async_database.users()
+    batch_size = batch_size or env_int("FARMER_IMPORT_BATCH_SIZE", 1000)
+    report: Dict[str, Any] = {
+        "rows": 0,
+        "inserted": 0,
+        "updated": 0,
+        "failed": 0,
+        "errors": [],
+    }
+    started = time.monotonic()
+
+    def error(line_no: int, message: str) -> None:
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"line": line_no, "error": message})
+
+    # phone -> (line, op); a phone repeated in one batch keeps its last row,
+    # which also keeps concurrent upserts of one phone out of the same batch
+    batch: Dict[str, Tuple[int, UpdateOne]] = {}
+
+    async def flush() -> None:
+        if not batch:
+            return
+        phones: List[str] = list(batch)
+        lines = [batch[p][0] for p in phones]
+        failed = set()
+        try:
+            result = await collection.bulk_write(
+                [batch[p][1] for p in phones], ordered=False
+            )
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            for write_error in details.get("writeErrors", []):
+                failed.add(write_error["index"])
+                error(
+                    lines[write_error["index"]],
+                    write_error.get("errmsg", "write failed"),
+                )
+        report["inserted"] += details.get("nUpserted", 0)
+        report["updated"] += details.get("nMatched", 0)
+        for i, phone in enumerate(phones):
+            if i not in failed:
+                database.notify_user_changed(phone)
+        batch.clear()
+
+    async for line_no, row in iter_records(chunks, fmt):
+        report["rows"] += 1
+        if isinstance(row, Exception):
+            error(line_no, f"Unreadable row: {row}")
+            continue
+        try:
+            phone, op = row_to_upsert(row)
+        except (ValueError, ValidationError) as e:
+            error(line_no, _describe(e))
+            continue
+        batch.pop(phone, None)
+        batch[phone] = (line_no, op)
+        if len(batch) >= batch_size:
+            await flush()
+    await flush()
+
+    elapsed = time.monotonic() - started
+    report["seconds"] = round(elapsed, 2)
+    report["rows_per_second"] = round(report["rows"] / elapsed, 1) if elapsed else 0.0
+    return report
+
+
+def _read_chunks(path: str, size: int = 1 << 16) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while chunk := f.read(size):
+            yield chunk
+
+
+async def import_file(
+    path: str, fmt: str, batch_size: Optional[int] = None
+) -> Dict[str, Any]:
+    async def chunks() -> AsyncIterator[bytes]:
+        for chunk in _read_chunks(path):
+            yield chunk
+
+    try:
+        return await import_farmers(chunks(), fmt, batch_size=batch_size)
+    finally:
+        await async_database.close_client()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk import farmers from CSV/JSONL")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=("csv", "jsonl"))
+    parser.add_argument("--batch-size", type=int)
+    args = parser.parse_args()
+
+    fmt = args.format or (
+        "jsonl" if args.path.endswith((".jsonl", ".ndjson")) else "csv"
+    )
+    report = asyncio.run(import_file(args.path, fmt, batch_size=args.batch_size))
+
+    print(
+        f"📥 {report['rows']} rows: {report['inserted']} new, {report['updated']} updated, "
+        f"{report['failed']} failed in {report['seconds']}s ({report['rows_per_second']} rows/s)"
+    )
+    for err in report["errors"][:20]:
+        print(f"   line {err['line']}: {err['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""Webhook ingestion queue.
+
+The WhatsApp bridge only needs to know we *received* a message, so
+`/whatsapp-webhook` hands payloads to this queue and returns immediately.
+A fixed pool of asyncio workers drains it.
+
+Ordering: while a sender has messages queued or in flight they all go to the
+same worker lane, so a farmer's messages are handled one after another. A
+sender with nothing pending is given the least-loaded lane, so one slow
+conversation does not hold up unrelated farmers behind it.
+Backpressure: the total number of queued + in-flight messages is capped;
+`submit` waits a short while for room and then gives up so the endpoint can
+answer 503 and let the bridge retry later.
+Coalescing: farmers often type "hello" / "my wheat" / "leaves yellow" as
+separate messages. A sender's text messages that arrive within
+WEBHOOK_COALESCE_SECONDS of each other are merged into one payload (one LLM
+turn, one reply). The window is short and a message ending in a question
+mark flushes the burst at once, so a single question is not held back.
+Media (voice notes, images) is never merged: it flushes the open burst and
+is queued on its own. A burst holds a single queue slot and at most
+WEBHOOK_COALESCE_MAX_MESSAGES messages, so memory stays bounded.
+"""
+
+import asyncio
+import collections
+import logging
+import time
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+try:
+    from settings import env_float, env_int
+except ImportError:
+    from backend.settings import env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict], Awaitable[Any]]
+
+
+_QUESTION_END = ("?", "？", "।")
+
+
+def is_text(payload: dict) -> bool:
+    return str(payload.get("type") or "text") == "text"
+
+
+def _ends_question(payload: dict) -> bool:
+    return str(payload.get("content") or "").rstrip().endswith(_QUESTION_END)
+
+
+def merge_payloads(payloads: List[dict]) -> dict:
+    """Combine a text burst from one sender into a single payload.
+
+    Bursts only ever hold text messages, so apart from `content` the latest
+    payload's fields (id, timestamp, sender_jid) stand for the burst.
+    """
+    if len(payloads) == 1:
+        return payloads[0]
+    merged = dict(payloads[-1])
+    merged["content"] = "\n".join(
+        str(p.get("content") or "").strip()
+        for p in payloads
+        if str(p.get("content") or "").strip()
+    )
+    merged["merged_count"] = len(payloads)
+    merged["message_ids"] = [p.get("id") for p in payloads if p.get("id")]
+    return merged
+
+
+class _Burst:
+    __slots__ = ("payloads", "first_at", "timer")
+
+    def __init__(self, payload: dict):
+        self.payloads = [payload]
+        self.first_at = time.monotonic()
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+def sender_key(payload: dict) -> str:
+    """Stable per-farmer key used to keep a sender on one worker lane."""
+    raw = str(payload.get("from") or payload.get("sender_jid") or "")
+    return raw.replace("whatsapp:", "").replace("+", "").replace(" ", "").strip()
+
+
+class MessageQueue:
+    """Bounded, per-sender ordered work queue backed by asyncio workers."""
+
+    def __init__(
+        self,
+        handler: Handler,
+        workers: Optional[int] = None,
+        max_depth: Optional[int] = None,
+        enqueue_timeout: Optional[float] = None,
+        coalesce_seconds: Optional[float] = None,
+        coalesce_max_messages: Optional[int] = None,
+    ):
+        self.handler = handler
+        self.workers = max(1, workers or env_int("WEBHOOK_WORKERS", 8))
+        self.max_depth = max(1, max_depth or env_int("WEBHOOK_QUEUE_MAX", 1000))
+        self.enqueue_timeout = (
+            enqueue_timeout
+            if enqueue_timeout is not None
+            else env_float("WEBHOOK_ENQUEUE_TIMEOUT", 2.0)
+        )
+        self.coalesce_seconds = (
+            coalesce_seconds
+            if coalesce_seconds is not None
+            else env_float("WEBHOOK_COALESCE_SECONDS", 0.4)
+        )
+        self.coalesce_max_messages = max(
+            1, coalesce_max_messages or env_int("WEBHOOK_COALESCE_MAX_MESSAGES", 10)
+        )
+        # A chatty sender is flushed after this long even if still typing
+        self.coalesce_max_wait = self.coalesce_seconds * 3
+
+        self._lanes: List[asyncio.Queue] = []
+        # Messages queued or running per lane, and each busy sender's lane
+        self._load: List[int] = []
+        self._assigned: Dict[str, List[int]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._depth = 0
+        self._bursts: Dict[str, _Burst] = {}
+
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.coalesced = 0
+        self._waits: Deque[float] = collections.deque(maxlen=1000)
+        self._max_wait = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._slots = asyncio.Semaphore(self.max_depth)
+        self._lanes = [asyncio.Queue() for _ in range(self.workers)]
+        self._load = [0] * self.workers
+        self._tasks = [asyncio.create_task(self._worker(lane)) for lane in self._lanes]
+        logger.info(
+            "📥 Webhook queue started (%s workers, max depth %s)",
+            self.workers,
+            self.max_depth,
+        )
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        """Let queued messages finish (up to `drain_timeout`), then stop workers."""
+        if not self.running:
+            return
+        for key in list(self._bursts):
+            self._flush(key)
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(lane.join() for lane in self._lanes)),
+                timeout=drain_timeout,
+            )
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Webhook queue stopped with %s messages pending", self._depth
+            )
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, payload: dict) -> bool:
+        """Queue a payload. Returns False if the queue stayed full (backpressure)."""
+        if not self.running or self._slots is None:
+            raise RuntimeError("MessageQueue.start() has not been called")
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+
+        key = sender_key(payload)
+        self.accepted += 1
+        burst = self._bursts.get(key)
+        if burst is not None and not is_text(payload):
+            # Media keeps its own turn, after the text that came before it
+            self._flush(key)
+            burst = None
+        if burst is not None:
+            # Joins the sender's open burst, which already holds a slot
+            self._slots.release()
+            self.coalesced += 1
+            burst.payloads.append(payload)
+            full = len(burst.payloads) >= self.coalesce_max_messages
+            if full or _ends_question(payload):
+                self._flush(key)
+            else:
+                self._schedule(key, burst)
+            return True
+
+        self._depth += 1
+        if (
+            self.coalesce_seconds <= 0
+            or not is_text(payload)
+            or _ends_question(payload)
+        ):
+            self._put(key, time.monotonic(), payload)
+            return True
+
+        burst = _Burst(payload)
+        self._bursts[key] = burst
+        self._schedule(key, burst)
+        return True
+
+    def _put(self, key: str, enqueued_at: float, payload: dict) -> None:
+        """Queue on the sender's busy lane, else on the least-loaded one."""
+        assigned = self._assigned.get(key)
+        if assigned is None:
+            lane = min(range(self.workers), key=self._load.__getitem__)
+            assigned = self._assigned[key] = [lane, 0]
+        assigned[1] += 1
+        self._load[assigned[0]] += 1
+        self._lanes[assigned[0]].put_nowait((key, enqueued_at, payload))
+
+    def _done(self, key: str) -> None:
+        assigned = self._assigned[key]
+        assigned[1] -= 1
+        self._load[assigned[0]] -= 1
+        if not assigned[1]:
+            del self._assigned[key]
+
+    def _schedule(self, key: str, burst: _Burst) -> None:
+        """(Re)arm the debounce timer, never past the burst's max wait."""
+        if burst.timer is not None:
+            burst.timer.cancel()
+        delay = min(
+            self.coalesce_seconds,
+            burst.first_at + self.coalesce_max_wait - time.monotonic(),
+        )
+        burst.timer = asyncio.get_running_loop().call_later(
+            max(0.0, delay), self._flush, key
+        )
+
+    def _flush(self, key: str) -> None:
+        burst = self._bursts.pop(key, None)
+        if burst is None:
+            return
+        if burst.timer is not None:
+            burst.timer.cancel()
+        self._put(key, burst.first_at, merge_payloads(burst.payloads))
+
+    async def _worker(self, lane: asyncio.Queue) -> None:
+        while True:
+            key, enqueued_at, payload = await lane.get()
+            wait = time.monotonic() - enqueued_at
+            self._waits.append(wait)
+            self._max_wait = max(self._max_wait, wait)
+            try:
+                await self.handler(payload)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error("Webhook handler failed: %s", e, exc_info=True)
+            finally:
+                self._done(key)
+                self._depth -= 1
+                if self._slots is not None:
+                    self._slots.release()
+                lane.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+
+        def pct(p: float) -> float:
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 1)
+
+        return {
+            "workers": self.workers,
+            "depth": self._depth,
+            "pending_bursts": len(self._bursts),
+            "max_depth": self.max_depth,
+            "lane_depths": [lane.qsize() for lane in self._lanes],
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "coalesce_seconds": self.coalesce_seconds,
+            "coalesced": self.coalesced,
+            "wait_ms_p50": pct(0.50),
+            "wait_ms_p95": pct(0.95),
+            "wait_ms_max": round(self._max_wait * 1000, 1),
+        }
@@ -1,15 +1,39 @@
 from __future__ import annotations
-from scheduler import morning_briefing_job, scheduler_loop
-from database import (
+from scheduler import (
+    last_brief_run,
+    last_render_run,
+    morning_briefing_job,
+    scheduler_loop,
+    scheduler_status,
+)
+from risk_job import risk_loop, run_risk_job
+from async_database import (
+    close_client as close_db_client,
     create_claim_record,
-    get_all_claims_data,
-    get_all_farmers_with_risk,
+    claim_query,
+    ensure_indexes,
+    farmer_query,
+    iter_claims,
+    iter_farmers,
+    page,
+    parse_cursor,
     save_user,
     update_claim_status,
 )
-from agent import handle_incoming_message
+from agent import handle_incoming_message, init_runtime, intent_router, llm_stats
+from ingest import MessageQueue
+from answer_cache import answer_cache
+from dedup import dedup_store
+from profile_cache import profile_cache
+from write_behind import activity_buffer
+from models import FarmerRegistration
+from weather_grid import cell_weather
+from tools import power_client
+from farmer_import import import_farmers
+import bridge
 
 import asyncio
+import json
 import os
 import random
 import smtplib
@@ -18,10 +42,10 @@ from email.mime.text import MIMEText
 from typing import Optional
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 
@@ -38,6 +62,9 @@ except Exception:
 
 app = FastAPI()
 
+# Inbound WhatsApp messages are acknowledged at once and processed here
+ingest_queue = MessageQueue(handle_incoming_message)
+
 # Serve backend/static at /static (for MP3, etc.)
 STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
 os.makedirs(STATIC_DIR, exist_ok=True)
@@ -65,12 +92,40 @@ async def startup_event():
     else:
         print("ℹ️ MCP not available (continuing without MCP).")
 
+    # Gemini model, tool registry, prompt prefix and RAG import are built once
+    # here (off the loop: the RAG import loads an embedding model)
+    try:
+        await asyncio.to_thread(init_runtime)
+        print("🧠 Agent runtime ready")
+    except Exception as e:
+        print(f"⚠️ Agent runtime init failed (will retry on first message): {e}")
+
+    # Phone lookups and the dashboard lists rely on these indexes
+    try:
+        await ensure_indexes()
+    except Exception as e:
+        print(f"⚠️ User index setup failed: {e}")
+
+    ingest_queue.start()
+    activity_buffer.start()
+
     print("⏰ Starting Morning Briefing Scheduler...")
     asyncio.create_task(scheduler_loop())
+    print("📈 Starting risk scoring job...")
+    asyncio.create_task(risk_loop())
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await ingest_queue.stop()
+    # Final flush of buffered activity, before the Mongo client goes away
+    await activity_buffer.stop()
+    await bridge.close_client()
+    await dedup_store.close()
+    await profile_cache.close()
+    await power_client.close()
+    await close_db_client()
+
     if mcp_manager is not None:
         print("🛑 Closing MCP Connections...")
         try:
@@ -128,17 +183,6 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
     return JSONResponse(status_code=422, content={"detail": exc.errors()})
 
 
-class FarmerRegistration(BaseModel):
-    name: str
-    phone_number: str
-    aadhar: str
-    bank_acc: str
-    language: str = "English"
-    lat: Optional[float] = None
-    long: Optional[float] = None
-    crop: Optional[str] = None
-
-
 class OTPRequest(BaseModel):
     phone_number: Optional[str] = None
     email: Optional[str] = None
@@ -233,20 +277,16 @@ async def save_any(request: Request):
 
     # farmer save path (backward compatible)
     farmer = FarmerRegistration.model_validate(payload)
-    return register_farmer(farmer)
+    return await register_farmer(farmer)
 
 
 @app.post("/api/register")
-def register_farmer(farmer: FarmerRegistration):
+async def register_farmer(farmer: FarmerRegistration):
     try:
         print(f"Incoming Data: {farmer.model_dump()}")
 
-        formatted_phone = farmer.phone_number
-        if not formatted_phone.startswith("91"):
-            formatted_phone = "91" + formatted_phone
-
-        result = save_user(
-            phone=formatted_phone,
+        result = await save_user(
+            phone=farmer.phone_number,
             name=farmer.name,
             aadhar=farmer.aadhar,
             bank_acc=farmer.bank_acc,
@@ -265,17 +305,44 @@ def register_farmer(farmer: FarmerRegistration):
                 else "Fetching NASA Data..."
             ),
         }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error saving user: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/farmers/import")
+async def import_farmers_api(
+    request: Request, format: Optional[str] = Query(None, pattern="^(csv|jsonl)$")
+):
+    """Bulk onboarding: POST a CSV or JSONL file as the raw request body."""
+    content_type = request.headers.get("content-type", "")
+    fmt = format or ("jsonl" if "json" in content_type else "csv")
+    report = await import_farmers(request.stream(), fmt)
+    print(
+        f"📥 Farmer import: {report['rows']} rows, {report['failed']} failed, "
+        f"{report['rows_per_second']} rows/s"
+    )
+    return {"success": True, **report}
+
+
 @app.post("/whatsapp-webhook")
 async def whatsapp_webhook(request: Request):
     payload = await request.json()
     print(f"📩 WhatsApp Payload: {payload}")
-    response = await handle_incoming_message(payload)
-    return {"status": "received", "agent_response": response}
+    if await dedup_store.seen(payload):
+        # Bridge re-post of a message we already accepted: ack, don't reprocess
+        return {"status": "duplicate"}
+    if not await ingest_queue.submit(payload):
+        # Queue is full: tell the bridge to retry instead of holding the request
+        await dedup_store.forget(payload)
+        return JSONResponse(
+            status_code=503,
+            content={"status": "busy"},
+            headers={"Retry-After": "2"},
+        )
+    return JSONResponse(status_code=202, content={"status": "queued"})
 
 
 @app.post("/admin/run-morning-brief")
@@ -284,18 +351,110 @@ async def run_morning_brief_now():
     return {"status": "success", "message": "Morning briefing job has been triggered."}
 
 
+@app.post("/admin/run-risk-job")
+async def run_risk_job_now(max_age_hours: float = 0):
+    """Rescore farmers now (default: everyone, not only stale scores)."""
+    asyncio.create_task(run_risk_job(max_age_hours=max_age_hours))
+    return {"status": "success", "message": "Risk job has been triggered."}
+
+
+@app.get("/admin/metrics")
+async def metrics_api():
+    return {
+        "webhook_queue": ingest_queue.stats(),
+        "webhook_dedup": dedup_store.stats(),
+        "llm": llm_stats(),
+        "answer_cache": answer_cache.stats(),
+        "intent_router": intent_router.stats(),
+        "profile_cache": profile_cache.stats(),
+        "activity_write_behind": activity_buffer.stats(),
+        "brief_render": last_render_run,
+        "morning_brief": last_brief_run,
+        "scheduler": scheduler_status,
+        "weather_cells": cell_weather.stats(),
+        "nasa_power": power_client.stats(),
+    }
+
+
+def _ndjson(items):
+    """Stream documents as NDJSON straight off the Mongo cursor."""
+
+    async def lines():
+        async for doc in items:
+            doc.pop("_id", None)
+            yield json.dumps(doc, default=str) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+def _fields(fields: Optional[str]) -> Optional[list]:
+    return [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+
+
 @app.get("/api/farmers")
-async def get_farmers_api():
-    return {"success": True, "farmers": get_all_farmers_with_risk()}
+async def get_farmers_api(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    crop: Optional[str] = None,
+    risk: Optional[str] = Query(None, pattern="^(low|medium|high)$"),
+    fields: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    """Farmers without Aadhaar/bank details, one keyset page at a time.
+
+    `format=ndjson` streams every matching farmer instead (full export).
+    """
+    try:
+        after = parse_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    query = farmer_query(crop=crop, risk=risk)
+    if format == "ndjson":
+        return _ndjson(iter_farmers(query, _fields(fields), after=after))
+
+    result = await page(
+        iter_farmers(query, _fields(fields), after=after, limit=limit), limit
+    )
+    return {
+        "success": True,
+        "farmers": result["items"],
+        "next_cursor": result["next_cursor"],
+    }
 
 
 @app.get("/api/claims")
-async def get_claims_api():
-    claims = get_all_claims_data()
-    if not claims:
-        create_claim_record("919998887776", "Drought")
-        claims = get_all_claims_data()
-    return {"success": True, "claims": claims}
+async def get_claims_api(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    fields: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    """Claims newest first, one keyset page at a time (or NDJSON export)."""
+    try:
+        before = parse_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    query = claim_query(status=status, date_from=date_from, date_to=date_to)
+    if format == "ndjson":
+        return _ndjson(iter_claims(query, _fields(fields), before=before))
+
+    result = await page(
+        iter_claims(query, _fields(fields), before=before, limit=limit), limit
+    )
+    if not result["items"] and not query and before is None:
+        # Empty demo database: seed one claim so the dashboard has a row
+        await create_claim_record("919998887776", "Drought")
+        result = await page(iter_claims(query, _fields(fields), limit=limit), limit)
+    return {
+        "success": True,
+        "claims": result["items"],
+        "next_cursor": result["next_cursor"],
+    }
 
 
 @app.post("/api/verify-claim")
@@ -321,7 +480,7 @@ async def verify_claim_api(req: VerifyClaimRequest):
             recommendation = "APPROVE"
             reason = f"Confirmed flood conditions. Rain: {simulated_rain}mm."
 
-    update_claim_status(req.claim_id, "Analyzed", reason)
+    await update_claim_status(req.claim_id, "Analyzed", reason)
     return {"success": True, "recommendation": recommendation, "reason": reason}
 
 
@@ -0,0 +1,27 @@
+"""One-off migration: canonical E.164 phones + unique index on `users`.
+
+Backfills `phone_e164` for users registered before phone normalisation and
+creates the indexes `get_user_by_phone` relies on. Safe to re-run.
+
+    cd backend && python migrate_phones.py
+"""
+
+from database import migrate_phone_numbers
+
+
+def main() -> None:
+    report = migrate_phone_numbers()
+    print(f"📱 Scanned {report['scanned']} users, updated {report['updated']}")
+    if report["invalid"]:
+        print(
+            f"⚠️ Unparseable phone on {len(report['invalid'])} users: {report['invalid'][:20]}"
+        )
+    if report["duplicates"]:
+        print(
+            f"⚠️ {len(report['duplicates'])} users share a number with another user "
+            f"(left unmigrated, merge by hand): {report['duplicates'][:20]}"
+        )
+
+
+if __name__ == "__main__":
+    main()
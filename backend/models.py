@@ -0,0 +1,16 @@
+"""Request models shared by the API and the bulk import CLI."""
+
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class FarmerRegistration(BaseModel):
+    name: str
+    phone_number: str
+    aadhar: str
+    bank_acc: str
+    language: str = "English"
+    lat: Optional[float] = None
+    long: Optional[float] = None
+    crop: Optional[str] = None
@@ -0,0 +1,175 @@
+"""Read-through cache of farmer profiles for the webhook hot path.
+
+Every inbound message needs the farmer's profile. Active conversations send
+several messages a minute, so profiles are kept in a bounded in-process
+TTL + LRU cache keyed by canonical (E.164) phone; unknown numbers are cached
+briefly too, so spam from unregistered numbers does not hit Mongo each time.
+
+Entries are dropped explicitly whenever a user document is written
+(`save_user`, farmer imports) via `on_user_changed`. Writers may run in
+worker threads, so the cache is guarded by a lock.
+
+With REDIS_URL set (and the optional `redis` package installed) profiles are
+also kept in Redis for PROFILE_CACHE_SHARED_TTL seconds so other uvicorn
+workers skip Mongo as well. Invalidation deletes the shared copy; other
+workers' local copies can lag by at most PROFILE_CACHE_TTL.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from bson import json_util
+
+try:
+    from async_database import get_user_by_phone
+    from cache import TTLCache
+    from database import normalise_phone, on_user_changed
+    from settings import env_float
+except ImportError:
+    from backend.async_database import get_user_by_phone
+    from backend.cache import TTLCache
+    from backend.database import normalise_phone, on_user_changed
+    from backend.settings import env_float
+
+logger = logging.getLogger(__name__)
+
+_NOT_FOUND = "__not_found__"
+
+
+class ProfileCache:
+    def __init__(
+        self,
+        maxsize: Optional[int] = None,
+        ttl: Optional[float] = None,
+        negative_ttl: Optional[float] = None,
+        redis_url: Optional[str] = None,
+        loader: Optional[Callable[[str], Awaitable[Optional[dict]]]] = None,
+    ):
+        self.loader = loader or get_user_by_phone
+        self.ttl = ttl if ttl is not None else env_float("PROFILE_CACHE_TTL", 120)
+        self.negative_ttl = (
+            negative_ttl
+            if negative_ttl is not None
+            else env_float("PROFILE_CACHE_NEGATIVE_TTL", 30)
+        )
+        self.shared_ttl = env_float("PROFILE_CACHE_SHARED_TTL", 600)
+        self.local = TTLCache(
+            maxsize=maxsize or int(env_float("PROFILE_CACHE_MAX", 20000)), ttl=self.ttl
+        )
+        self.redis_url = redis_url if redis_url is not None else os.getenv("REDIS_URL")
+        self._redis: Any = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+        self.db_reads = 0
+        self.shared_hits = 0
+        self.shared_errors = 0
+        self.invalidations = 0
+
+    def _shared(self) -> Any:
+        if self._redis is None and self.redis_url:
+            try:
+                import redis.asyncio as redis_asyncio  # type: ignore
+
+                self._redis = redis_asyncio.from_url(self.redis_url)
+            except Exception as e:
+                logger.warning("Shared profile cache disabled (%s)", e)
+                self.redis_url = None
+        return self._redis
+
+    async def get(self, phone: str) -> Optional[Dict[str, Any]]:
+        """Profile for `phone` (any format), or None if not registered."""
+        key = normalise_phone(phone)
+        if key is None:
+            return None
+        self._loop = asyncio.get_running_loop()
+
+        with self._lock:
+            cached = self.local.get(key)
+        if cached is None:
+            cached = await self._load(key)
+        return None if cached == _NOT_FOUND else dict(cached)
+
+    async def _load(self, key: str) -> Any:
+        shared = self._shared()
+        if shared is not None:
+            try:
+                raw = await shared.get(f"profile:{key}")
+                if raw is not None:
+                    self.shared_hits += 1
+                    user = json_util.loads(raw)
+                    with self._lock:
+                        self.local.set(key, user)
+                    return user
+            except Exception as e:
+                self.shared_errors += 1
+                logger.warning("Shared profile cache read failed: %s", e)
+
+        self.db_reads += 1
+        user = await self.loader(key)
+        with self._lock:
+            if user is None:
+                self.local.set(key, _NOT_FOUND, ttl=self.negative_ttl)
+            else:
+                self.local.set(key, user)
+        if user is not None and shared is not None:
+            try:
+                await shared.set(
+                    f"profile:{key}", json_util.dumps(user), ex=int(self.shared_ttl)
+                )
+            except Exception as e:
+                self.shared_errors += 1
+                logger.warning("Shared profile cache write failed: %s", e)
+        return _NOT_FOUND if user is None else user
+
+    def invalidate(self, phone: str) -> None:
+        """Drop a profile (safe to call from worker threads)."""
+        key = normalise_phone(phone)
+        if key is None:
+            return
+        with self._lock:
+            self.local.pop(key)
+        self.invalidations += 1
+
+        if self._redis is None or self._loop is None or self._loop.is_closed():
+            return
+        coro = self._delete_shared(key)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._loop.create_task(coro)
+        else:
+            asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    async def _delete_shared(self, key: str) -> None:
+        try:
+            await self._redis.delete(f"profile:{key}")
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning("Shared profile cache invalidation failed: %s", e)
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            local = self.local.stats()
+        return dict(
+            local,
+            db_reads=self.db_reads,
+            shared=bool(self.redis_url),
+            shared_hits=self.shared_hits,
+            shared_errors=self.shared_errors,
+            invalidations=self.invalidations,
+        )
+
+
+profile_cache = ProfileCache()
+on_user_changed(profile_cache.invalidate)
@@ -0,0 +1,56 @@
+"""Async token-bucket rate limiter.
+
+Used to keep proactive sends under the WhatsApp bridge's real send rate:
+`rate` tokens per second refill a bucket of `burst` tokens, and every send
+takes one. Waiters are served in arrival order.
+"""
+
+import asyncio
+import time
+from typing import Callable, Optional
+
+
+class TokenBucket:
+    def __init__(
+        self,
+        rate: float,
+        burst: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.capacity = max(1.0, burst if burst is not None else rate)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = asyncio.Lock()
+        self.waited_seconds = 0.0
+
+    def set_rate(self, rate: float, burst: Optional[float] = None) -> None:
+        """Change the refill rate (and burst), keeping the tokens earned so far."""
+        now = self._clock()
+        if self.rate > 0:
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+        self._updated = now
+        self.rate = rate
+        self.capacity = max(1.0, burst if burst is not None else rate)
+        self._tokens = min(self._tokens, self.capacity)
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it (no-op if rate <= 0)."""
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = self._clock()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+                self.waited_seconds += delay
+                await asyncio.sleep(delay)
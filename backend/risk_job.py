@@ -0,0 +1,200 @@
+"""Batch job: compute and persist each farmer's risk score and NDVI history.
+
+The dashboard used to invent `risk_score` / `ndvi_history` with `random` on
+every request. This job derives them from the weather tool (NASA POWER) and
+the GIS NDVI tool, and writes them back with unordered bulk writes, so
+/api/farmers only projects stored fields.
+
+Incremental and restartable: each farmer gets `risk_computed_at`, and a run
+only picks farmers whose score is missing or older than RISK_MAX_AGE_HOURS.
+If a run dies half way, the next one continues with whoever is still stale.
+
+`risk_loop` runs in every uvicorn worker, but only the holder of the
+"risk-job" lease (see coordination.py) runs the job; if it dies another
+worker takes the lease over and runs at once.
+"""
+
+import asyncio
+import datetime
+import time
+from typing import Any, Dict, Optional
+
+from pymongo import ASCENDING, UpdateOne
+
+try:
+    from async_database import users
+    from coordination import INSTANCE_ID, Lease, LeaseLost, run_with_lease
+    from settings import env_float
+    from tools import calculate_ndvi
+    from weather_grid import cell_weather, get_cell_weather
+except ImportError:
+    from backend.async_database import users
+    from backend.coordination import INSTANCE_ID, Lease, LeaseLost, run_with_lease
+    from backend.settings import env_float
+    from backend.tools import calculate_ndvi
+    from backend.weather_grid import cell_weather, get_cell_weather
+
+NDVI_HISTORY_LEN = 5
+
+
+def _clamp(x: float) -> float:
+    return max(0.0, min(1.0, x))
+
+
+def compute_risk(weather: Dict[str, Any], ndvi: Optional[float]) -> int:
+    """0-100 crop risk from daily rain/temperature and vegetation health.
+
+    Drought (little rain), flood (heavy rain) and heat stress come from the
+    weather; vegetation stress from NDVI when the GIS tool has a reading.
+    """
+    rain = float(weather.get("rainfall_mm") or 0.0)
+    temp = weather.get("temperature_c")
+    temp = 25.0 if temp is None else float(temp)
+    parts = [
+        (0.35, _clamp((5.0 - rain) / 5.0)),  # drought
+        (0.15, _clamp((rain - 50.0) / 50.0)),  # flood
+        (0.20, _clamp((temp - 30.0) / 10.0)),  # heat
+    ]
+    if ndvi is not None:
+        parts.append((0.30, _clamp((0.6 - ndvi) / 0.5)))  # vegetation stress
+    total_weight = sum(w for w, _ in parts)
+    return round(100 * sum(w * v for w, v in parts) / total_weight)
+
+
+async def _ndvi(lat: float, lon: float) -> Optional[float]:
+    try:
+        result = await calculate_ndvi(lat, lon)
+    except Exception:
+        return None
+    value = result.get("ndvi") if isinstance(result, dict) else None
+    return float(value) if value is not None else None
+
+
+async def _assess(farmer: dict) -> UpdateOne:
+    lat, lon = float(farmer["lat"]), float(farmer["lon"])
+    weather, ndvi = await asyncio.gather(get_cell_weather(lat, lon), _ndvi(lat, lon))
+    if "error" in weather:
+        # Keep the previous score rather than one computed from no weather
+        raise RuntimeError(weather["error"])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    update: Dict[str, Any] = {
+        "$set": {
+            "risk_score": compute_risk(weather, ndvi),
+            "risk_computed_at": now,
+            "weather_snapshot": weather,
+        }
+    }
+    if ndvi is not None:
+        update["$push"] = {
+            "ndvi_history": {"$each": [round(ndvi, 3)], "$slice": -NDVI_HISTORY_LEN}
+        }
+    return UpdateOne({"_id": farmer["_id"]}, update)
+
+
+async def run_risk_job(
+    max_age_hours: Optional[float] = None,
+    batch_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Refresh stale risk scores; returns counts and throughput."""
+    max_age = (
+        max_age_hours
+        if max_age_hours is not None
+        else env_float("RISK_MAX_AGE_HOURS", 24)
+    )
+    batch_size = int(batch_size or env_float("RISK_JOB_BATCH_SIZE", 500))
+    slots = asyncio.Semaphore(int(concurrency or env_float("RISK_JOB_CONCURRENCY", 16)))
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+        hours=max_age
+    )
+    query = {
+        "lat": {"$type": "number"},
+        "lon": {"$type": "number"},
+        "$or": [
+            {"risk_computed_at": {"$exists": False}},
+            {"risk_computed_at": {"$lt": cutoff}},
+        ],
+    }
+    stats = {"scanned": 0, "updated": 0, "failed": 0}
+    started = time.monotonic()
+
+    async def assess(farmer: dict) -> Optional[UpdateOne]:
+        async with slots:
+            try:
+                return await _assess(farmer)
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"⚠️ Risk assessment failed for {farmer.get('phone')}: {e}")
+                return None
+
+    async def flush(batch: list) -> None:
+        # One regional POWER request per tile instead of one per cell
+        try:
+            await cell_weather.prefetch([(f["lat"], f["lon"]) for f in batch])
+        except Exception as e:
+            print(f"⚠️ Regional weather prefetch failed: {e}")
+        ops = [op for op in await asyncio.gather(*(assess(f) for f in batch)) if op]
+        if ops:
+            result = await users().bulk_write(ops, ordered=False)
+            stats["updated"] += result.modified_count
+
+    print("📈 Risk job started")
+    batch = []
+    cursor = (
+        users()
+        .find(query, {"lat": 1, "lon": 1, "phone": 1})
+        .sort("_id", ASCENDING)
+        .batch_size(batch_size)
+    )
+    async for farmer in cursor:
+        stats["scanned"] += 1
+        batch.append(farmer)
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+    await flush(batch)
+
+    elapsed = time.monotonic() - started
+    stats["seconds"] = round(elapsed, 2)
+    stats["farmers_per_second"] = (
+        round(stats["scanned"] / elapsed, 1) if elapsed else 0.0
+    )
+    print(
+        f"📈 Risk job done: {stats['updated']}/{stats['scanned']} updated, "
+        f"{stats['failed']} failed in {stats['seconds']}s"
+    )
+    return stats
+
+
+async def risk_loop(owner: str = INSTANCE_ID) -> None:
+    """Refresh risk scores at startup, then every RISK_JOB_INTERVAL_SECONDS.
+
+    Safe to run in every worker process: only the "risk-job" lease holder
+    runs the job; the others check every RISK_JOB_POLL_SECONDS whether they
+    have taken the lease over.
+    """
+    interval = env_float("RISK_JOB_INTERVAL_SECONDS", 6 * 3600)
+    poll = max(1.0, min(interval, env_float("RISK_JOB_POLL_SECONDS", 60)))
+    lease = Lease("risk-job", owner=owner)
+
+    async def still_held() -> bool:
+        return lease.held  # renewed in the background by lease.start()
+
+    await lease.start()
+    last_run: Optional[float] = None
+    print(f"📈 Risk loop started ({owner})")
+    try:
+        while True:
+            if not lease.held:
+                last_run = None  # a new holder runs straight away
+            elif last_run is None or time.monotonic() - last_run >= interval:
+                last_run = time.monotonic()
+                try:
+                    await run_with_lease(run_risk_job(), still_held, lease.ttl)
+                except LeaseLost:
+                    print("⚠️ Lost the risk job lease; another worker takes over")
+                except Exception as e:
+                    print(f"❌ Risk job error: {e}")
+            await asyncio.sleep(poll)
+    finally:
+        await lease.stop()
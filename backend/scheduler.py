@@ -1,67 +1,545 @@
 import asyncio
+import collections
+import datetime
 import os
-from typing import Optional
+import random
+import time
+from typing import Any, Dict, Optional
+from zoneinfo import ZoneInfo
 
 # ✅ REQUIRED IMPORTS (per hackathon rules)
 try:
-    from database import get_all_farmers
-    from agent import generate_morning_brief, send_text_via_bridge
+    from async_database import (
+        claim_brief_delivery,
+        finish_brief_run,
+        get_brief_render,
+        iter_brief_recipients,
+        mark_brief_delivery,
+        save_brief_checkpoint,
+        save_brief_renders,
+        start_brief_run,
+    )
+    from agent import (
+        WEATHER_UNAVAILABLE,
+        generate_morning_brief,
+        send_text_via_bridge,
+        voice_language,
+    )
+    from coordination import (
+        INSTANCE_ID,
+        Lease,
+        LeaseLost,
+        claim_shard,
+        finish_shard,
+        lease_seconds,
+        live_delivery_shards,
+        plan_brief_run,
+        renew_shard,
+        run_with_lease,
+    )
+    from ratelimit import TokenBucket
+    from settings import env_flag, env_float
+    from voice_service import synthesise_mp3_bytes, upload_voice_bytes
+    from weather_grid import cell_key, cell_weather
 except ImportError:
-    from backend.database import get_all_farmers
-    from backend.agent import generate_morning_brief, send_text_via_bridge
+    from backend.async_database import (
+        claim_brief_delivery,
+        finish_brief_run,
+        get_brief_render,
+        iter_brief_recipients,
+        mark_brief_delivery,
+        save_brief_checkpoint,
+        save_brief_renders,
+        start_brief_run,
+    )
+    from backend.agent import (
+        WEATHER_UNAVAILABLE,
+        generate_morning_brief,
+        send_text_via_bridge,
+        voice_language,
+    )
+    from backend.coordination import (
+        INSTANCE_ID,
+        Lease,
+        LeaseLost,
+        claim_shard,
+        finish_shard,
+        lease_seconds,
+        live_delivery_shards,
+        plan_brief_run,
+        renew_shard,
+        run_with_lease,
+    )
+    from backend.ratelimit import TokenBucket
+    from backend.settings import env_flag, env_float
+    from backend.voice_service import synthesise_mp3_bytes, upload_voice_bytes
+    from backend.weather_grid import cell_key, cell_weather
 
+# Stats of the latest render and delivery runs, shown on /admin/metrics
+last_render_run: Dict[str, Any] = {}
+last_brief_run: Dict[str, Any] = {}
+# This instance's part in the multi-worker schedule, also on /admin/metrics
+scheduler_status: Dict[str, Any] = {
+    "instance": INSTANCE_ID,
+    "leader": False,
+    "shards_done": 0,
+}
 
-async def morning_briefing_job() -> int:
-    """Send a proactive morning brief to every farmer in the DB.
 
-    Returns number of messages attempted.
+def _local_now(now: Optional[datetime.datetime] = None) -> datetime.datetime:
+    tz = ZoneInfo(os.getenv("BRIEF_TIMEZONE", "Asia/Kolkata"))
+    return (now or datetime.datetime.now(datetime.timezone.utc)).astimezone(tz)
+
+
+def brief_run_id(now: Optional[datetime.datetime] = None) -> str:
+    """One briefing run per calendar day in the farmers' timezone."""
+    return "brief-" + _local_now(now).strftime("%Y-%m-%d")
+
+
+def brief_delivery_time(now: Optional[datetime.datetime] = None) -> datetime.datetime:
+    """Today's delivery window start (BRIEF_DELIVER_AT, local HH:MM; 07:00)."""
+    deliver_at = os.getenv("BRIEF_DELIVER_AT", "").strip() or "07:00"
+    try:
+        hour, minute = (int(part) for part in deliver_at.split(":"))
+        local = _local_now(now).replace(
+            hour=hour, minute=minute, second=0, microsecond=0
+        )
+    except ValueError:
+        print(f"⚠️ Ignoring invalid BRIEF_DELIVER_AT={deliver_at!r} (want HH:MM)")
+        local = _local_now(now).replace(hour=7, minute=0, second=0, microsecond=0)
+    return local.astimezone(datetime.timezone.utc)
+
+
+def _farmer_lat_lon(farmer: dict) -> tuple:
+    location = farmer.get("location") or {}
+    return (
+        farmer.get("lat") or location.get("lat"),
+        farmer.get("lon") or location.get("lon"),
+    )
+
+
+def _recipient(farmer: dict) -> Optional[str]:
+    # Prefer the stored sender_jid (opt-in / established session). Without an
+    # established signal session, proactive sends may fail: the farmer can
+    # opt in by sending one WhatsApp message to the bot first.
+    return (
+        farmer.get("sender_jid")
+        or farmer.get("last_sender_jid")
+        or farmer.get("whatsapp_jid")
+    )
+
+
+async def render_briefs_job(shard: Optional[dict] = None) -> Dict[str, Any]:
+    """Render phase: compute and store every recipient's brief ahead of time.
+
+    Runs hours before the delivery window, so weather fetches (and gTTS, with
+    BRIEF_AUDIO=1) never hold up sends. Briefs are rendered by
+    BRIEF_RENDER_CONCURRENCY workers and stored in `brief_renders` in bulk
+    writes of BRIEF_RENDER_BATCH; re-rendering a shard just overwrites them.
+    The MP3 is stored as bytes with the text, so whichever host claims the
+    delivery shard can upload it. A brief that could not get weather is not
+    stored: the delivery phase renders it again inline.
     """
-    farmers = get_all_farmers() or []
-    print(f"🌅 Morning Briefing Job: {len(farmers)} farmers")
+    run_id = shard["run_id"] if shard else brief_run_id()
+    concurrency = max(1, int(env_float("BRIEF_RENDER_CONCURRENCY", 16)))
+    batch_size = max(1, int(env_float("BRIEF_RENDER_BATCH", 500)))
+    with_audio = env_flag("BRIEF_AUDIO")
+    stats: Dict[str, Any] = {
+        "run_id": shard["_id"] if shard else run_id,
+        "rendered": 0,
+        "failed": 0,
+        "skipped": 0,
+        "no_weather": 0,
+        "audio": 0,
+    }
+    rendered: list = []
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    fetches_before = cell_weather.fetches
+    started = time.monotonic()
 
-    attempted = 0
-    for farmer in farmers:
+    async def store() -> None:
+        batch = rendered[:]
+        rendered.clear()
+        await save_brief_renders(run_id, batch)
+
+    async def render(farmer: dict) -> None:
+        recipient = _recipient(farmer)
+        if not recipient or not farmer.get("phone"):
+            stats["skipped"] += 1
+            return
+        doc = {
+            "farmer_id": farmer["_id"],
+            "text": await generate_morning_brief(farmer),
+        }
+        if doc["text"] == WEATHER_UNAVAILABLE:
+            stats["no_weather"] += 1
+            return
+        if with_audio:
+            try:
+                doc["audio"] = await asyncio.to_thread(
+                    synthesise_mp3_bytes,
+                    doc["text"],
+                    voice_language(farmer),
+                )
+                stats["audio"] += 1
+            except Exception as e:
+                print(f"⚠️ Brief audio failed for {farmer.get('phone')}: {e}")
+        rendered.append(doc)
+        stats["rendered"] += 1
+        if len(rendered) >= batch_size:
+            await store()
+
+    async def worker() -> None:
+        while True:
+            farmer = await queue.get()
+            try:
+                if farmer is None:
+                    return
+                await render(farmer)
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"❌ Brief render error for {farmer.get('phone')}: {e}")
+            finally:
+                queue.task_done()
+
+    async def prefetch_and_queue(chunk: list) -> None:
+        # One regional POWER request per tile for the whole chunk, so the
+        # workers' per-farmer weather lookups hit the cell cache
         try:
-            phone = farmer.get("phone")
-            if not phone:
-                continue
-
-            # Prefer the stored sender_jid (opt-in / established session)
-            recipient = (
-                farmer.get("sender_jid")
-                or farmer.get("last_sender_jid")
-                or farmer.get("whatsapp_jid")
+            await cell_weather.prefetch(
+                [_farmer_lat_lon(f) for f in chunk if _recipient(f)]
             )
-            if not recipient:
-                # Without an established signal session, proactive sends may fail.
-                # User can opt-in by sending one WhatsApp message to the bot first.
-                continue
-
-            msg = await generate_morning_brief(farmer)
-            await send_text_via_bridge(recipient, msg)
-            attempted += 1
-            await asyncio.sleep(0.5)
         except Exception as e:
-            print(f"❌ Morning brief error for {farmer.get('phone')}: {e}")
-    return attempted
+            print(f"⚠️ Regional weather prefetch failed: {e}")
+        for farmer in chunk:
+            await queue.put(farmer)
 
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        chunk: list = []
+        async for farmer in iter_brief_recipients(
+            start=shard.get("start") if shard else None,
+            end=shard.get("end") if shard else None,
+        ):
+            chunk.append(farmer)
+            if len(chunk) >= batch_size:
+                await prefetch_and_queue(chunk)
+                chunk = []
+        await prefetch_and_queue(chunk)
+    except BaseException:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise
+    for _ in workers:
+        await queue.put(None)
+    await asyncio.gather(*workers)
+    await store()
 
-async def scheduler_loop() -> None:
-    """Runs once immediately (demo), then sleeps.
+    elapsed = time.monotonic() - started
+    stats["seconds"] = round(elapsed, 2)
+    stats["per_second"] = round(stats["rendered"] / elapsed, 1) if elapsed else 0.0
+    stats["weather_fetches"] = cell_weather.fetches - fetches_before
+    last_render_run.clear()
+    last_render_run.update(stats)
+    print(
+        f"🖨️ Brief render {stats['run_id']}: {stats['rendered']} rendered, "
+        f"{stats['failed']} failed, {stats['no_weather']} left for delivery "
+        f"(no weather), {stats['audio']} with audio in {elapsed:.1f}s "
+        f"({stats['per_second']}/s, {stats['weather_fetches']} weather fetches)"
+    )
+    return stats
 
-    You can override sleep with env var MORNING_BRIEF_SLEEP_SECONDS.
+
+async def morning_briefing_job(shard: Optional[dict] = None) -> Dict[str, Any]:
+    """Delivery phase: send the morning brief to every farmer with a JID.
+
+    Briefs come from the render phase (`render_briefs_job`); a farmer without
+    a stored render (registered since, render failed or had no weather) is
+    rendered inline, which serves last-known-good weather if NASA is down.
+
+    Farmers are streamed off a Mongo cursor into a bounded queue and served by
+    BRIEF_CONCURRENCY workers. Sends share a token bucket sized to the bridge
+    (BRIDGE_SEND_RATE per second, BRIDGE_SEND_BURST burst), split evenly
+    between all delivery shards running in the deployment and re-split every
+    BRIEF_BUDGET_REFRESH_SECONDS; a failed send is retried with exponential
+    backoff and jitter up to BRIEF_MAX_RETRIES times.
+
+    Runs are checkpointed in Mongo, one per calendar day (`brief_run_id`).
+    Each farmer is claimed with a unique per-day marker before sending, so a
+    second run the same day (restart, manual trigger, another worker) skips
+    farmers already briefed, and a crashed run resumes from its last cursor
+    checkpoint instead of starting over. Farmers the crashed attempt had
+    claimed but not finished are reclaimed by the resumed one. Returns the
+    run's counts and throughput.
+
+    With `shard` (a document from `coordination.claim_shard`) only that
+    shard's `_id` range is briefed, checkpointed under the shard's own id.
     """
-    sleep_seconds: Optional[int]
+    run_id = shard["run_id"] if shard else brief_run_id()
+    state_id = shard["_id"] if shard else run_id
+    run = await start_brief_run(state_id)
+    if run.get("status") == "done":
+        print(f"🌅 Morning brief {state_id} already completed; skipping")
+        return {"run_id": state_id, "status": "already_done"}
+    checkpoint = run.get("checkpoint")
+    run_attempt = run.get("attempt", 1)
+    if checkpoint is not None:
+        print(f"🌅 Resuming morning brief {state_id} after {checkpoint}")
+
+    concurrency = max(1, int(env_float("BRIEF_CONCURRENCY", 32)))
+    max_retries = int(env_float("BRIEF_MAX_RETRIES", 3))
+    backoff = env_float("BRIEF_RETRY_BASE_SECONDS", 1.0)
+    progress_every = max(1, int(env_float("BRIEF_PROGRESS_EVERY", 1000)))
+    checkpoint_every = max(1, int(env_float("BRIEF_CHECKPOINT_EVERY", 200)))
+    stale_claim = env_float("BRIEF_CLAIM_STALE_SECONDS", 600)
+    send_rate = env_float("BRIDGE_SEND_RATE", 20)
+    send_burst = env_float("BRIDGE_SEND_BURST", 20)
+    budget_refresh = max(1.0, env_float("BRIEF_BUDGET_REFRESH_SECONDS", 5))
+    bucket = TokenBucket(send_rate, send_burst)
+
+    async def split_budget() -> None:
+        # An unsharded run (startup demo, manual trigger) is not in the count
+        try:
+            senders = await live_delivery_shards(run_id) + (0 if shard else 1)
+        except Exception as e:
+            print(f"⚠️ Could not count delivery shards: {e}")
+            return
+        senders = max(1, senders)
+        bucket.set_rate(send_rate / senders, max(1.0, send_burst / senders))
+        stats["send_rate"] = round(bucket.rate, 2)
+
+    async def keep_budget_split() -> None:
+        while True:
+            await asyncio.sleep(budget_refresh)
+            await split_budget()
+
+    stats: Dict[str, Any] = {
+        "run_id": state_id,
+        "queued": 0,
+        "processed": 0,
+        "sent": 0,
+        "failed": 0,
+        "skipped": 0,
+        "already_sent": 0,
+        "in_flight_elsewhere": 0,
+        "retries": 0,
+        "prerendered": 0,
+        "rendered_inline": 0,
+        "audio_sent": 0,
+        "send_rate": send_rate,
+    }
+    if send_rate > 0:
+        await split_budget()
+    # Farmers in cursor order; the checkpoint only moves past a farmer once
+    # every farmer before it is finished (workers complete out of order)
+    in_order: collections.deque = collections.deque()
+    finished = set()
+
+    def advance_checkpoint(farmer_id: Any) -> None:
+        nonlocal checkpoint
+        finished.add(farmer_id)
+        while in_order and in_order[0] in finished:
+            checkpoint = in_order.popleft()
+            finished.discard(checkpoint)
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    # Weather is fetched once per POWER grid cell and fanned out to its farmers
+    cells = set()
+    fetches_before = cell_weather.fetches
+    started = time.monotonic()
+    print(f"🌅 Morning Briefing Job: {concurrency} workers")
+
+    def report(final: bool = False) -> None:
+        elapsed = time.monotonic() - started
+        done = stats["sent"] + stats["failed"]
+        rate = done / elapsed if elapsed else 0.0
+        stats["seconds"] = round(elapsed, 2)
+        stats["per_second"] = round(rate, 1)
+        stats["weather_cells"] = len(cells)
+        stats["weather_fetches"] = cell_weather.fetches - fetches_before
+        last_brief_run.clear()
+        last_brief_run.update(stats, running=not final)
+        label = "done" if final else "progress"
+        print(
+            f"🌅 Morning brief {label}: {stats['sent']} sent, {stats['failed']} failed, "
+            f"{stats['skipped']} skipped, {stats['retries']} retries "
+            f"({rate:.1f} msg/s, {elapsed:.0f}s); weather: "
+            f"{stats['weather_fetches']} fetches for {len(cells)} cells"
+        )
+
+    async def deliver(farmer: dict) -> None:
+        recipient = _recipient(farmer)
+        if not recipient or not farmer.get("phone"):
+            stats["skipped"] += 1
+            return
+        lat, lon = _farmer_lat_lon(farmer)
+        if lat is not None and lon is not None:
+            cells.add(cell_key(lat, lon))
+        held = await claim_brief_delivery(
+            run_id, farmer["_id"], stale_claim, state_id, run_attempt
+        )
+        if held == "sent":
+            stats["already_sent"] += 1
+            return
+        if held:
+            # Another run state is sending it right now (e.g. a manual run)
+            stats["in_flight_elsewhere"] += 1
+            return
+        rendered = await get_brief_render(run_id, farmer["_id"])
+        if rendered and rendered.get("text") != WEATHER_UNAVAILABLE:
+            stats["prerendered"] += 1
+            msg = rendered["text"]
+        else:
+            rendered = None
+            stats["rendered_inline"] += 1
+            msg = await generate_morning_brief(farmer)
+        for attempt in range(max_retries + 1):
+            await bucket.acquire()
+            try:
+                if await send_text_via_bridge(recipient, msg):
+                    stats["sent"] += 1
+                    await mark_brief_delivery(run_id, farmer["_id"], "sent")
+                    audio = (rendered or {}).get("audio")
+                    if audio:
+                        await bucket.acquire()
+                        if await upload_voice_bytes(recipient, bytes(audio)):
+                            stats["audio_sent"] += 1
+                    return
+            except Exception as e:
+                print(f"❌ Morning brief send error for {farmer.get('phone')}: {e}")
+            if attempt < max_retries:
+                stats["retries"] += 1
+                await asyncio.sleep(backoff * 2**attempt * random.uniform(0.5, 1.5))
+        stats["failed"] += 1
+        # A failed farmer may be retried by a later run the same day
+        await mark_brief_delivery(run_id, farmer["_id"], "failed")
+
+    async def worker() -> None:
+        while True:
+            farmer = await queue.get()
+            try:
+                if farmer is None:
+                    return
+                await deliver(farmer)
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"❌ Morning brief error for {farmer.get('phone')}: {e}")
+            finally:
+                queue.task_done()
+            advance_checkpoint(farmer["_id"])
+            stats["processed"] += 1
+            if stats["processed"] % checkpoint_every == 0 and checkpoint is not None:
+                await save_brief_checkpoint(state_id, checkpoint, _counts())
+            if stats["processed"] % progress_every == 0:
+                report()
+
+    def _counts() -> Dict[str, Any]:
+        return {k: v for k, v in stats.items() if isinstance(v, int)}
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    splitter = asyncio.create_task(keep_budget_split()) if send_rate > 0 else None
     try:
-        sleep_seconds = int(os.getenv("MORNING_BRIEF_SLEEP_SECONDS", "86400"))
-    except ValueError:
-        sleep_seconds = 86400
+        async for farmer in iter_brief_recipients(
+            after=checkpoint,
+            start=shard.get("start") if shard else None,
+            end=shard.get("end") if shard else None,
+        ):
+            stats["queued"] += 1
+            in_order.append(farmer["_id"])
+            await queue.put(farmer)
+    except BaseException:
+        # Crash or shutdown: stop now; the checkpoint and the delivery
+        # markers let the next run pick up from here
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        if splitter is not None:
+            splitter.cancel()
+        raise
+    for _ in workers:
+        await queue.put(None)
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        if splitter is not None:
+            splitter.cancel()
+
+    report(final=True)
+    if checkpoint is not None:
+        await save_brief_checkpoint(state_id, checkpoint, _counts())
+    await finish_brief_run(state_id, _counts())
+    return stats
 
-    print("⏰ Scheduler started")
-    print("🚀 Running morning briefing immediately (startup demo)")
-    await morning_briefing_job()
 
+async def work_brief_shards(run_id: str, owner: str = INSTANCE_ID) -> int:
+    """Claim and brief shards of `run_id` until none is left; returns shards done."""
+    ttl = lease_seconds()
+    done = 0
     while True:
-        print(f"😴 Scheduler sleeping for {sleep_seconds}s")
-        await asyncio.sleep(sleep_seconds)
-        await morning_briefing_job()
+        shard = await claim_shard(run_id, owner, ttl=ttl)
+        if shard is None:
+            return done
+        shard_id = shard["_id"]
+        render = shard.get("phase") == "render"
+        print(f"🧩 {owner} {'rendering' if render else 'delivering'} shard {shard_id}")
+        job = render_briefs_job if render else morning_briefing_job
+        try:
+            stats = await run_with_lease(
+                job(shard),
+                lambda: renew_shard(shard_id, owner, ttl=ttl),
+                ttl,
+            )
+        except LeaseLost:
+            print(f"⚠️ Lost the lease on shard {shard_id}; another worker took it")
+            continue
+        await finish_shard(shard_id, stats, owner)
+        done += 1
+
+
+async def scheduler_loop() -> None:
+    """Plans each day's run as soon as the day starts (and right at startup).
+
+    The run renders every brief straight away and delivers them from
+    BRIEF_DELIVER_AT (local time, default 07:00). A day first planned more
+    than BRIEF_LATE_SECONDS after that (the service was down all morning)
+    is skipped rather than greeting farmers in the evening. With
+    BRIEF_DEMO_ON_STARTUP=1 the run planned at startup is delivered right
+    after rendering instead. Safe to run in every worker process: only the
+    instance holding the scheduler lease plans runs (split into BRIEF_SHARDS
+    shards), and every instance polls for due shards every BRIEF_POLL_SECONDS.
+    """
+    shards = max(1, int(env_float("BRIEF_SHARDS", 8)))
+    poll = max(1.0, env_float("BRIEF_POLL_SECONDS", 30))
+    late = datetime.timedelta(seconds=env_float("BRIEF_LATE_SECONDS", 3 * 3600))
+    demo = env_flag("BRIEF_DEMO_ON_STARTUP")
+
+    leader = Lease("scheduler-leader")
+    await leader.start()
+    planned = None
+    print(f"⏰ Scheduler started ({INSTANCE_ID})")
+    try:
+        while True:
+            run_id = brief_run_id()
+            scheduler_status["leader"] = leader.held
+            try:
+                if leader.held and planned != run_id:
+                    deliver_at = None if demo else brief_delivery_time()
+                    now = datetime.datetime.now(datetime.timezone.utc)
+                    if deliver_at is not None and now > deliver_at + late:
+                        # Shards of a run planned before still get worked below
+                        print(f"⏭️ Too late to plan morning brief {run_id}")
+                    else:
+                        count = await plan_brief_run(run_id, shards, deliver_at)
+                        print(
+                            f"🗓️ Planned morning brief {run_id} in {count} shards, "
+                            f"delivery from {deliver_at or 'now (startup demo)'}"
+                        )
+                    planned = run_id
+                scheduler_status["shards_done"] += await work_brief_shards(run_id)
+            except Exception as e:
+                print(f"❌ Scheduler error: {e}")
+            demo = False  # only the run planned at startup
+            await asyncio.sleep(poll)
+    finally:
+        await leader.stop()
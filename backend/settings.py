@@ -0,0 +1,26 @@
+"""Environment variable parsing shared by the backend modules.
+
+A missing or malformed value falls back to the default instead of failing at
+import time, so a typo in .env never keeps the app from starting.
+"""
+
+import os
+
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def env_flag(name: str, default: bool = False) -> bool:
+    """True for "1", "true" or "yes" (any case)."""
+    return os.getenv(name, "1" if default else "0").lower() in ("1", "true", "yes")
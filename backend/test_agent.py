@@ -0,0 +1,236 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import agent
+import voice_service
+
+
+class SlowModel:
+    """Stands in for genai.GenerativeModel; every call takes `delay` seconds."""
+
+    active = 0
+    peak = 0
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+
+    async def generate_content_async(self, prompt):
+        SlowModel.active += 1
+        SlowModel.peak = max(SlowModel.peak, SlowModel.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            SlowModel.active -= 1
+        return type("Resp", (), {"text": json.dumps({"final": "ok"})})()
+
+
+@pytest.fixture
+def slow_model(monkeypatch):
+    SlowModel.active = SlowModel.peak = 0
+    runtime = agent.AgentRuntime(model=SlowModel(), tools={}, load_rag=False)
+    monkeypatch.setattr(agent, "_runtime", runtime)
+    return SlowModel
+
+
+def test_llm_calls_are_capped_and_loop_stays_responsive(slow_model, monkeypatch):
+    monkeypatch.setattr(agent, "_llm_slots", asyncio.Semaphore(2))
+
+    async def run():
+        ticks = 0
+
+        async def heartbeat():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        beat = asyncio.create_task(heartbeat())
+        replies = await asyncio.gather(
+            *(agent._gemini_with_tools("q") for _ in range(6))
+        )
+        beat.cancel()
+        return replies, ticks
+
+    replies, ticks = asyncio.run(run())
+    assert replies == ["ok"] * 6
+    assert slow_model.peak == 2
+    # 3 waves of 50 ms: the heartbeat must have kept running throughout
+    assert ticks >= 10
+
+
+def test_deadline_covers_the_whole_loop(slow_model):
+    async def run():
+        return await agent._gemini_with_tools("q", deadline=time.monotonic() + 0.01)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(run())
+
+
+def test_batched_tool_calls_run_concurrently(monkeypatch):
+    prompts = []
+    replies = iter(
+        [
+            {
+                "tools": [
+                    {"tool": "weather", "args": {"lat": 1, "lon": 2}},
+                    {"tool": "ndvi", "args": {"lat": 1, "lon": 2}},
+                ]
+            },
+            {"final": "done"},
+        ]
+    )
+
+    class ScriptedModel:
+        async def generate_content_async(self, prompt):
+            prompts.append(prompt)
+            return type("Resp", (), {"text": json.dumps(next(replies))})()
+
+    def weather(lat, lon):
+        time.sleep(0.1)  # blocking tool: must run in a thread
+        return {"rainfall_mm": 3}
+
+    async def ndvi(lat, lon):
+        await asyncio.sleep(0.1)
+        return {"ndvi": 0.5}
+
+    runtime = agent.AgentRuntime(
+        model=ScriptedModel(),
+        tools={"weather": weather, "ndvi": ndvi},
+        load_rag=False,
+    )
+    monkeypatch.setattr(agent, "_runtime", runtime)
+
+    started = time.monotonic()
+    reply = asyncio.run(agent._gemini_with_tools("q"))
+    elapsed = time.monotonic() - started
+
+    assert reply == "done"
+    assert elapsed < 0.18
+    assert len(prompts) == 2
+    assert '"rainfall_mm": 3' in prompts[1] and '"ndvi": 0.5' in prompts[1]
+
+
+class StreamingModel:
+    """Streams a final answer in chunks, 50 ms apart."""
+
+    chunks = [
+        "Water lightly ",
+        "this evening.\n",
+        "===VOICE_SUMMARY===\n",
+        "Namaste! Water lightly today. ",
+        "Check the soil ",
+        "tomorrow.",
+    ]
+
+    async def generate_content_async(self, prompt, stream=False):
+        assert stream
+
+        async def gen():
+            for text in self.chunks:
+                await asyncio.sleep(0.05)
+                yield type("Chunk", (), {"text": text})()
+
+        return gen()
+
+
+def test_streamed_reply_is_delivered_before_generation_ends(monkeypatch):
+    events = []
+    started = time.monotonic()
+
+    def stamp(name):
+        events.append((name, round(time.monotonic() - started, 3)))
+
+    async def fake_send_text(to, text):
+        stamp("text")
+        return True
+
+    def fake_tts(text, language="en"):
+        stamp("tts:" + text.strip())
+        return b"mp3"
+
+    async def fake_upload(to, mp3):
+        stamp("voice")
+
+    monkeypatch.setattr(agent, "send_text_via_bridge", fake_send_text)
+    monkeypatch.setattr(voice_service, "synthesise_mp3_bytes", fake_tts)
+    monkeypatch.setattr(voice_service, "_save_mp3", lambda data: {})
+    monkeypatch.setattr(voice_service, "_upload_mp3", fake_upload)
+    runtime = agent.AgentRuntime(model=StreamingModel(), tools={}, load_rag=False)
+
+    async def run():
+        stream = agent.ReplyStream("91x@s.whatsapp.net")
+        reply = await agent._gemini_with_tools("q", runtime=runtime, stream=stream)
+        return stream, reply
+
+    stream, reply = asyncio.run(run())
+    times = dict(events)
+
+    assert stream.delivered
+    assert reply.startswith("Water lightly this evening.")
+    # Text goes out right after the divider (3rd chunk), not after the 6th
+    assert times["text"] < 0.25
+    # The first voice sentence is synthesised while chunks are still arriving
+    assert times["tts:Namaste!"] < 0.25
+    assert [e[0] for e in events][-1] == "voice"
+    assert times["voice"] >= 0.3
+
+
+def test_intent_router_tables():
+    router = agent.IntentRouter()
+    cases = {
+        "hi": "greeting",
+        "Namaste ji 🙏": "greeting",
+        "नमस्ते": "greeting",
+        "weather today?": "weather",
+        "aaj mausam kaisa hai": "weather",
+        "कल बारिश होगी?": "weather",
+        "my claim status": "claim_status",
+        "mera bima claim kya hua": "claim_status",
+        "मेरा दावा": "claim_status",
+        "crop health": "health",
+        "fasal kaisi hai": "health",
+        # Advice or open questions still go to Gemini
+        "should I water my crops if rain is coming?": None,
+        "hi, my wheat leaves are turning yellow": None,
+        "barish ke baad spray kab karun": None,
+        # Starting a claim is not a status lookup
+        "file a claim": None,
+        "I want to claim": None,
+        "बीमा दावा दर्ज करना है": None,
+    }
+    for text, expected in cases.items():
+        assert router.route(text) == expected, text
+
+    stats = router.stats()
+    assert stats["llm"] == 6
+    assert stats["routed"]["weather"] == 3
+    assert stats["llm_avoided_share"] == round(11 / 17, 3)
+
+
+def test_stale_weather_is_flagged_with_its_date(monkeypatch):
+    weather = {"rainfall_mm": 14.0, "temperature_c": 30.0}
+
+    async def fake_weather(lat, lon):
+        return dict(weather)
+
+    sent = []
+
+    async def fake_send(jid, text):
+        sent.append(text)
+        return True
+
+    monkeypatch.setattr(agent, "get_cell_weather", fake_weather)
+    monkeypatch.setattr(agent, "send_text_via_bridge", fake_send)
+    farmer = {"lat": 19.0, "lon": 73.0, "crop": "Wheat", "language": "Hindi"}
+
+    fresh = asyncio.run(agent.generate_morning_brief(farmer))
+    assert "⏳" not in fresh
+
+    weather.update(stale=True, as_of="2026-10-14T06:00:00+00:00")
+    brief = asyncio.run(agent.generate_morning_brief(farmer))
+    asyncio.run(agent._handle_weather_request({"lat": 19.0, "lon": 73.0}, "jid"))
+    assert "2026-10-14" in brief and "पुराना" in brief
+    assert "as of 2026-10-14" in sent[0]
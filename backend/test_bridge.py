@@ -0,0 +1,36 @@
+import asyncio
+
+import httpx
+
+import bridge
+
+
+def test_text_endpoint_is_discovered_once(monkeypatch):
+    hits = []
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        hits.append(request.url.path)
+        if request.url.path == "/send/text":
+            return httpx.Response(200, json={"status": "sent"})
+        return httpx.Response(404)
+
+    async def run():
+        monkeypatch.setattr(bridge, "_text_endpoint", None)
+        monkeypatch.setattr(
+            bridge,
+            "_client",
+            httpx.AsyncClient(
+                base_url="http://bridge", transport=httpx.MockTransport(handle)
+            ),
+        )
+        monkeypatch.setattr(bridge, "_client_loop", asyncio.get_running_loop())
+        first = await bridge.post_text({"recipient": "91x", "message": "a"})
+        second = await bridge.post_text({"recipient": "91x", "message": "b"})
+        client = bridge.get_client()
+        await bridge.close_client()
+        return first, second, client
+
+    first, second, client = asyncio.run(run())
+    assert first and second
+    assert hits == ["/api/send", "/send/text", "/send/text"]
+    assert client.is_closed
@@ -0,0 +1,164 @@
+import asyncio
+
+import mongomock
+
+import async_database
+import database
+from answer_cache import AnswerCache, normalise_question
+from cache import TTLCache
+from profile_cache import ProfileCache
+import weather_grid
+from test_database import _AsyncCollection
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_and_lru_bounds():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" is now most recent
+    cache.set("c", 3)  # evicts "b"
+    assert cache.get("b") is None
+    clock.now = 11
+    assert cache.get("a") is None and cache.get("c") is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 3
+    assert stats["evictions"] == 1
+    assert stats["expirations"] == 2
+
+
+def test_answer_key_ignores_phrasing_noise_and_nearby_farms():
+    cache = AnswerCache(ttl=60, cell_deg=0.25, persist=False)
+    ravi = {"crop": "Wheat", "language": "English", "name": "Ravi"}
+    sita = {"crop": "wheat ", "language": "english", "name": "Sita"}
+
+    assert normalise_question("  Should I water my crops?? ") == (
+        "should i water my crops"
+    )
+    k1 = cache.key(ravi, 26.81, 80.91, "Should I water my crops?")
+    k2 = cache.key(sita, 26.90, 80.99, "should i WATER my crops")
+    assert k1 == k2
+    assert k1 != cache.key(ravi, 27.10, 80.91, "Should I water my crops?")
+    assert k1 != cache.key({**ravi, "crop": "Rice"}, 26.81, 80.91, "water?")
+
+    async def run():
+        await cache.set(k1, "Namaste RAVI! Water lightly, Ravindra.", user=ravi)
+        return await cache.get(k2, name="Sita")
+
+    assert asyncio.run(run()) == "Namaste Sita! Water lightly, Ravindra."
+
+
+def test_answers_with_personal_details_are_not_cached():
+    cache = AnswerCache(ttl=60, persist=False)
+    ram = {"name": "Ram", "phone": "919876543210", "village": "Kheri", "lat": 26.8123}
+
+    async def run():
+        await cache.set("greet", "Ram Ram Ram ji! Sow after rain.", user=ram)
+        await cache.set("village", "Rain expected in Kheri tomorrow.", user=ram)
+        await cache.set("where", "Your farm at 26.81, 80.9 is dry.", user=ram)
+        await cache.set("ok", "Ram ji, the Ramkali variety suits you.", user=ram)
+        return [await cache.get(k, name="Sita") for k in ("greet", "village", "where")]
+
+    assert asyncio.run(run()) == [None, None, None]
+    assert cache.memory.get("ok") == "\x00NAME\x00 ji, the Ramkali variety suits you."
+    assert cache.stats()["skipped_personal"] == 3
+
+
+def test_profile_cache_reads_through_and_invalidates(monkeypatch):
+    users = mongomock.MongoClient().db.users
+    monkeypatch.setattr(async_database, "users", lambda: _AsyncCollection(users))
+    monkeypatch.setattr(async_database, "_user_indexes_ready", False)
+
+    cache = ProfileCache(
+        maxsize=10,
+        ttl=60,
+        negative_ttl=60,
+        redis_url="",
+        loader=async_database.get_user_by_phone,
+    )
+    monkeypatch.setattr(database, "_user_listeners", [cache.invalidate])
+    save = async_database.save_user
+
+    async def run():
+        await save("9876543210", "Ravi", "1", "2", "Hindi")
+        first = await cache.get("whatsapp:+919876543210")
+        again = await cache.get("919876543210")
+        missing = await cache.get("9000000001")
+        missing_again = await cache.get("9000000001")
+        await save("9876543210", "Ravi", "1", "2", "Marathi")
+        fresh = await cache.get("919876543210")
+        return first, again, missing, missing_again, fresh
+
+    first, again, missing, missing_again, fresh = asyncio.run(run())
+    assert first["name"] == again["name"] == "Ravi"
+    assert missing is None and missing_again is None
+    assert fresh["language"] == "Marathi"
+    stats = cache.stats()
+    # Ravi, the unknown number, then Ravi again after the profile update
+    assert stats["db_reads"] == 3
+    assert stats["hits"] == 2
+    assert stats["invalidations"] == 2
+
+
+def test_weather_is_fetched_once_per_grid_cell(monkeypatch):
+    calls = []
+
+    async def fake_nasa(lat, lon):
+        calls.append((lat, lon))
+        await asyncio.sleep(0.02)
+        return {"rainfall_mm": 2.0, "temperature_c": 30.0}
+
+    monkeypatch.setattr(weather_grid, "get_nasa_weather", fake_nasa)
+    assert weather_grid.snap(19.07, 72.88) == (19.0, 73.125)
+    assert weather_grid.cell_key(19.2, 72.9) == weather_grid.cell_key(18.8, 73.3)
+
+    cells = weather_grid.CellWeather(ttl=60)
+
+    async def run():
+        village = [cells.get(19.0 + i * 0.01, 73.0 + i * 0.01) for i in range(20)]
+        results = await asyncio.gather(*village, cells.get(28.6, 77.2))
+        results.append(await cells.get(19.05, 73.05))
+        return results
+
+    results = asyncio.run(run())
+    assert calls == [(19.0, 73.125), (28.5, 77.5)]
+    assert all(r["rainfall_mm"] == 2.0 for r in results)
+    stats = cells.stats()
+    assert stats["requests"] == 22 and stats["cell_fetches"] == 2
+    assert stats["coalesced"] == 19 and stats["hits"] == 1
+
+
+def test_cancelled_fetch_does_not_cancel_coalesced_waiters(monkeypatch):
+    calls = []
+
+    async def fake_nasa(lat, lon):
+        calls.append((lat, lon))
+        await asyncio.sleep(0.05)
+        return {"rainfall_mm": 2.0, "temperature_c": 30.0}
+
+    monkeypatch.setattr(weather_grid, "get_nasa_weather", fake_nasa)
+    cells = weather_grid.CellWeather(ttl=60)
+
+    async def run():
+        # A chat tool call starts the fetch, then hits its deadline
+        chat = asyncio.create_task(cells.get(19.0, 73.0))
+        await asyncio.sleep(0.01)
+        job = asyncio.create_task(cells.get(19.01, 73.01))
+        await asyncio.sleep(0.01)
+        chat.cancel()
+        return await job, await asyncio.gather(chat, return_exceptions=True)
+
+    weather, (chat_result,) = asyncio.run(run())
+    assert weather["rainfall_mm"] == 2.0
+    assert isinstance(chat_result, asyncio.CancelledError)
+    assert len(calls) == 2  # the waiter fetched the cell itself
@@ -0,0 +1,144 @@
+import asyncio
+import datetime
+
+import mongomock
+
+import coordination
+import scheduler
+from test_database import _AsyncCollection
+from test_scheduler import _FakeRuns, _farmers
+
+
+def _install_mongo(monkeypatch):
+    db = mongomock.MongoClient().db
+    monkeypatch.setattr(coordination, "leases", lambda: _AsyncCollection(db.leases))
+    monkeypatch.setattr(
+        coordination, "brief_shards", lambda: _AsyncCollection(db.brief_shards)
+    )
+    return db
+
+
+def test_lease_is_exclusive_until_it_expires(monkeypatch):
+    db = _install_mongo(monkeypatch)
+
+    async def run():
+        a = coordination.Lease("scheduler-leader", owner="a", ttl=30)
+        b = coordination.Lease("scheduler-leader", owner="b", ttl=30)
+        assert await a.acquire()
+        assert not await b.acquire()
+        assert await a.acquire()  # renewal
+        # a dies: its lease runs out
+        db.leases.update_one(
+            {"_id": "scheduler-leader"},
+            {"$set": {"expires_at": coordination._now().replace(year=2000)}},
+        )
+        assert await b.acquire()
+        assert not await a.acquire()
+        await b.release()
+        assert await a.acquire()
+
+    asyncio.run(run())
+
+
+def test_workers_split_shards_and_take_over_a_dead_one(monkeypatch):
+    _install_mongo(monkeypatch)
+    farmers = _farmers(120)
+    runs = _FakeRuns()
+    sends = {}
+    briefed_by = {}
+
+    async def bounds(shards):
+        return [[None, 30], [30, 60], [60, 90], [90, None]]
+
+    async def fake_recipients(after=None, start=None, end=None, **kwargs):
+        for farmer in farmers:
+            fid = farmer["_id"]
+            if after is not None and fid <= after:
+                continue
+            if (start is not None and fid < start) or (end is not None and fid >= end):
+                continue
+            yield farmer
+
+    async def fake_brief(farmer):
+        return "Good morning"
+
+    async def fake_send(jid, text):
+        await asyncio.sleep(0.001)
+        sends[jid] = sends.get(jid, 0) + 1
+        return True
+
+    original_claim = coordination.claim_shard
+
+    async def tracking_claim(run_id, owner, ttl=None):
+        shard = await original_claim(run_id, owner, ttl=ttl)
+        if shard is not None:
+            briefed_by.setdefault(owner, []).append(shard["_id"])
+        return shard
+
+    runs.install(monkeypatch)
+    monkeypatch.setattr(coordination, "brief_shard_bounds", bounds)
+    monkeypatch.setattr(scheduler, "claim_shard", tracking_claim)
+    monkeypatch.setattr(scheduler, "iter_brief_recipients", fake_recipients)
+    monkeypatch.setattr(scheduler, "generate_morning_brief", fake_brief)
+    monkeypatch.setattr(scheduler, "send_text_via_bridge", fake_send)
+    monkeypatch.setenv("BRIEF_CONCURRENCY", "4")
+    monkeypatch.setenv("BRIDGE_SEND_RATE", "0")
+
+    async def run():
+        assert await coordination.plan_brief_run("day", 4) == 8
+        # Planning again (a second leader) changes nothing
+        assert await coordination.plan_brief_run("day", 8) == 8
+        # Render shards come first; a worker claims one and dies
+        dead = await coordination.claim_shard("day", "dead", ttl=-1)
+        assert dead["_id"] == "day:render:000"
+        done = await asyncio.gather(
+            scheduler.work_brief_shards("day", "a"),
+            scheduler.work_brief_shards("day", "b"),
+        )
+        return done
+
+    done = asyncio.run(run())
+    assert sum(done) == 8
+    assert set(briefed_by) == {"a", "b"}
+    assert "day:render:000" in briefed_by["a"] + briefed_by["b"]
+    assert len(sends) == len(farmers)
+    assert len(runs.renders) == len(farmers)
+    assert set(sends.values()) == {1}
+
+
+def test_delivery_shards_wait_for_the_delivery_time(monkeypatch):
+    _install_mongo(monkeypatch)
+
+    async def bounds(shards):
+        return [[None, None]]
+
+    monkeypatch.setattr(coordination, "brief_shard_bounds", bounds)
+    later = coordination._now().replace(year=2999)
+
+    async def run():
+        await coordination.plan_brief_run("day", 1, deliver_at=later)
+        render = await coordination.claim_shard("day", "a")
+        nothing = await coordination.claim_shard("day", "a")
+        return render, nothing
+
+    render, nothing = asyncio.run(run())
+    assert render["phase"] == "render"
+    assert nothing is None
+
+
+def test_live_delivery_shards_counts_unexpired_senders(monkeypatch):
+    db = _install_mongo(monkeypatch)
+    now = coordination._now()
+    alive = now + datetime.timedelta(seconds=60)
+    dead = now - datetime.timedelta(seconds=1)
+    base = {"run_id": "day", "kind": "shard", "status": "running"}
+    db.brief_shards.insert_many(
+        [
+            dict(base, _id="a", phase="deliver", lease_until=alive),
+            dict(base, _id="b", phase="deliver", lease_until=alive),
+            dict(base, _id="c", phase="deliver", lease_until=dead),
+            dict(base, _id="d", phase="render", lease_until=alive),
+            dict(base, _id="e", phase="deliver", lease_until=alive, run_id="old"),
+        ]
+    )
+    assert asyncio.run(coordination.live_delivery_shards("day")) == 2
@@ -0,0 +1,256 @@
+import asyncio
+
+import mongomock
+
+import async_database
+import database
+import write_behind
+from database import normalise_phone
+
+
+def test_phone_numbers_normalise_to_e164():
+    for raw in (
+        "9876543210",
+        "09876543210",
+        "919876543210",
+        "+91 98765 43210",
+        "whatsapp:+919876543210",
+        "00919876543210",
+        "919876543210@s.whatsapp.net",
+        "919876543210:12@s.whatsapp.net",
+    ):
+        assert normalise_phone(raw) == "+919876543210", raw
+    assert normalise_phone("+1 (415) 555-0100") == "+14155550100"
+    assert normalise_phone("123456789012345@lid") is None
+    assert normalise_phone("12") is None
+    assert normalise_phone("") is None
+
+
+def test_async_client_is_lazy_and_pooled(monkeypatch):
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "17")
+    monkeypatch.setattr(async_database, "_client", None)
+    assert async_database._client is None
+
+    async def run():
+        client = async_database.get_client()
+        assert async_database.get_client() is client
+        size = client.options.pool_options.max_pool_size
+        await async_database.close_client()
+        return size
+
+    assert asyncio.run(run()) == 17
+    assert async_database._client is None
+
+
+class _AsyncCursor:
+    """Just enough of pymongo's async cursor over a mongomock cursor."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def sort(self, *args):
+        self._cursor = self._cursor.sort(*args)
+        return self
+
+    def limit(self, n):
+        self._cursor = self._cursor.limit(n)
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    async def __aiter__(self):
+        for doc in self._cursor:
+            yield doc
+
+
+class _AsyncCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return _AsyncCursor(self._collection.find(*args, **kwargs))
+
+    async def find_one(self, *args, **kwargs):
+        return self._collection.find_one(*args, **kwargs)
+
+    async def find_one_and_update(self, *args, **kwargs):
+        return self._collection.find_one_and_update(*args, **kwargs)
+
+    async def count_documents(self, *args, **kwargs):
+        return self._collection.count_documents(*args, **kwargs)
+
+    async def create_index(self, *args, **kwargs):
+        return self._collection.create_index(*args, **kwargs)
+
+    async def update_one(self, *args, **kwargs):
+        return self._collection.update_one(*args, **kwargs)
+
+    async def delete_one(self, *args, **kwargs):
+        return self._collection.delete_one(*args, **kwargs)
+
+    async def bulk_write(self, ops, ordered=True):
+        # mongomock's bulk_write does not match current pymongo operations
+        modified = 0
+        for op in ops:
+            result = self._collection.update_one(op._filter, op._doc, upsert=op._upsert)
+            modified += result.modified_count
+        return type("BulkResult", (), {"modified_count": modified})()
+
+
+def test_lookup_uses_canonical_phone(monkeypatch):
+    users = mongomock.MongoClient().db.users
+    monkeypatch.setattr(async_database, "users", lambda: _AsyncCollection(users))
+    monkeypatch.setattr(async_database, "_user_indexes_ready", False)
+    # Written before normalisation existed
+    users.insert_one({"phone": "919000000001", "name": "Old"})
+
+    async def run():
+        save, get = async_database.save_user, async_database.get_user_by_phone
+        await save("9876543210", "Ravi", "1", "2", "Hindi")
+        await save("+91 98765 43210", "Ravi K", "1", "2", "Hindi")
+        await save("9000000001", "Old Farmer", "1", "2", "English")
+        return [
+            await get("whatsapp:+919876543210"),
+            await get("919876543210"),
+            await get("+919000000001"),
+            await get("98765"),
+        ]
+
+    ravi, ravi_digits, old, invalid = asyncio.run(run())
+    assert users.count_documents({}) == 2
+    assert ravi["name"] == "Ravi K"
+    assert ravi_digits["phone"] == "919876543210"
+    assert old["name"] == "Old Farmer"
+    assert invalid is None
+    # The sync API used by scripts reads the same documents
+    monkeypatch.setattr(database, "users_collection", users)
+    assert database.get_user_by_phone("+919000000001")["name"] == "Old Farmer"
+
+
+def test_farmer_listing_is_paged_projected_and_filtered(monkeypatch):
+    users = mongomock.MongoClient().db.users
+    users.insert_many(
+        {
+            "name": f"F{i}",
+            "phone": f"9190000000{i:02d}",
+            "aadhar": "1234",
+            "bank_acc": "5678",
+            "crop": "Wheat" if i % 2 else "Rice",
+            "risk_score": 10 * (i % 10),
+        }
+        for i in range(25)
+    )
+    monkeypatch.setattr(async_database, "users", lambda: _AsyncCollection(users))
+
+    async def all_pages(query):
+        names, cursor = [], None
+        while True:
+            result = await async_database.page(
+                async_database.iter_farmers(
+                    query, after=async_database.parse_cursor(cursor), limit=10
+                ),
+                10,
+            )
+            names += [f["name"] for f in result["items"]]
+            assert all(
+                "aadhar" not in f and "bank_acc" not in f for f in result["items"]
+            )
+            cursor = result["next_cursor"]
+            if cursor is None:
+                return names
+
+    names = asyncio.run(all_pages({}))
+    assert names == [f"F{i}" for i in range(25)]
+
+    high_wheat = asyncio.run(
+        all_pages(async_database.farmer_query(crop="Wheat", risk="high"))
+    )
+    assert high_wheat == [f"F{i}" for i in range(25) if i % 2 and i % 10 > 7]
+
+
+def test_activity_is_coalesced_and_written_in_bulk(monkeypatch):
+    users = mongomock.MongoClient().db.users
+    a = users.insert_one({"phone": "911", "message_count": 4}).inserted_id
+    b = users.insert_one({"phone": "912"}).inserted_id
+    collection = _AsyncCollection(users)
+    monkeypatch.setattr(write_behind, "users", lambda: collection)
+    writes = []
+    real_bulk_write = collection.bulk_write
+
+    async def counting_bulk_write(ops, ordered=True):
+        writes.append(len(ops))
+        if len(writes) == 1:
+            raise RuntimeError("mongo down")
+        return await real_bulk_write(ops, ordered=ordered)
+
+    collection.bulk_write = counting_bulk_write
+
+    async def run():
+        buf = write_behind.ActivityBuffer(interval=60, max_entries=100)
+        buf.record(a, "111@lid")
+        buf.record(a, None)
+        buf.record(b, "912@s.whatsapp.net")
+        assert await buf.flush() == 0  # failed: entries are kept
+        buf.record(a, "222@lid")
+        await buf.stop()  # final flush
+        return buf.stats()
+
+    stats = asyncio.run(run())
+    assert writes == [2, 2]
+    assert users.find_one({"_id": a})["message_count"] == 7
+    assert users.find_one({"_id": a})["sender_jid"] == "222@lid"
+    assert users.find_one({"_id": b})["message_count"] == 1
+    assert stats["recorded"] == 4 and stats["errors"] == 1 and stats["pending"] == 0
+
+
+def test_claim_date_to_includes_the_whole_day():
+    query = async_database.claim_query(date_from="2025-01-01", date_to="2025-01-31")
+    assert query["date"] == {"$gte": "2025-01-01", "$lt": "2025-02-01"}
+    # Claim dates are stored as ISO timestamps
+    assert "2025-01-31T18:30:00+00:00" < query["date"]["$lt"]
+    exact = async_database.claim_query(date_to="2025-01-31T12:00:00")
+    assert exact["date"] == {"$lte": "2025-01-31T12:00:00"}
+
+
+def test_size_flushes_back_off_while_mongo_is_down(monkeypatch):
+    attempts = []
+
+    class _Down:
+        async def bulk_write(self, ops, ordered=True):
+            attempts.append(len(ops))
+            raise RuntimeError("mongo down")
+
+    monkeypatch.setattr(write_behind, "users", lambda: _Down())
+
+    async def run():
+        buf = write_behind.ActivityBuffer(interval=60, max_entries=2)
+        for i in range(50):
+            buf.record(i)
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        return buf.stats()
+
+    stats = asyncio.run(run())
+    assert attempts == [2]
+    assert stats["pending"] == 50 and stats["retry_in_s"] > 0
+
+
+def test_resumed_brief_attempt_reclaims_its_crashed_claims(monkeypatch):
+    db = mongomock.MongoClient().db
+    monkeypatch.setattr(
+        async_database, "brief_deliveries", lambda: _AsyncCollection(db.deliveries)
+    )
+    claim = async_database.claim_brief_delivery
+
+    async def run():
+        first = await claim("day", 1, 600, "day:000", 1)
+        # A manual run of the same day must not steal a live claim
+        other = await claim("day", 1, 600, "day", 5)
+        # The shard's next attempt takes over what the crashed one left
+        resumed = await claim("day", 1, 600, "day:000", 2)
+        await async_database.mark_brief_delivery("day", 1, "sent")
+        after = await claim("day", 1, 600, "day:000", 3)
+        return first, other, resumed, after
+
+    assert asyncio.run(run()) == (None, "claimed", None, "sent")
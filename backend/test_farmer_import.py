@@ -0,0 +1,111 @@
+import asyncio
+
+import database
+from farmer_import import import_farmers
+
+
+async def _chunks(text, size=7):
+    # Small chunks: rows and multi-byte characters split across reads
+    data = text.encode("utf-8")
+    for i in range(0, len(data), size):
+        yield data[i : i + size]
+
+
+class _Collection:
+    def __init__(self):
+        self.batches = []
+
+    async def bulk_write(self, ops, ordered=True):
+        assert ordered is False
+        self.batches.append(ops)
+        result = type("Result", (), {})()
+        result.bulk_api_result = {"nUpserted": len(ops), "nMatched": 0}
+        return result
+
+
+def test_csv_rows_are_validated_normalised_and_batched(monkeypatch):
+    changed = []
+    monkeypatch.setattr(database, "_user_listeners", [changed.append])
+    csv_text = (
+        "Name,Phone,Aadhaar,Bank_Account,Language,Latitude,Longitude,Crop\n"
+        "Ravi,98765 43210,1111,2222,Hindi,19.07,72.87,Wheat\n"
+        "Sita,+91 9000000001,3333,4444,,,,\n"
+        "Bad Phone,12,5555,6666,English,,,\n"
+        "No Aadhaar,9000000002,,7777,English,,,\n"
+        "Ravi Again,919876543210,1111,2222,Hindi,19.07,72.87,Rice\n"
+        "Asha,9000000003,8888,9999,English,not-a-number,72.8,\n"
+    )
+    collection = _Collection()
+    report = asyncio.run(
+        import_farmers(_chunks(csv_text), "csv", batch_size=2, collection=collection)
+    )
+
+    assert report["rows"] == 6
+    assert report["failed"] == 3
+    assert [e["line"] for e in report["errors"]] == [4, 5, 7]
+    assert "Invalid phone" in report["errors"][0]["error"]
+    assert "aadhar" in report["errors"][1]["error"]
+
+    ops = [op for batch in collection.batches for op in batch]
+    assert [len(b) for b in collection.batches] == [2, 1]
+    fields = [op._doc["$set"] for op in ops]
+    assert [f["phone_e164"] for f in fields] == [
+        "+919876543210",
+        "+919000000001",
+        "+919876543210",
+    ]
+    assert fields[0]["lat"] == 19.07 and fields[0]["crop"] == "Wheat"
+    assert fields[1]["language"] == "English"
+    assert all(op._upsert for op in ops)
+    assert changed == [f["phone_e164"] for f in fields]
+
+
+def test_jsonl_reports_unreadable_lines():
+    jsonl = (
+        '{"name": "Ravi", "phone_number": "9876543210", "aadhar": "1", "bank_acc": "2"}\n'
+        "\n"
+        "{not json\n"
+        "[1, 2]\n"
+        '"x"\n'
+    )
+    report = asyncio.run(
+        import_farmers(_chunks(jsonl), "jsonl", collection=_Collection())
+    )
+    assert report["rows"] == 4 and report["inserted"] == 1
+    assert [e["line"] for e in report["errors"]] == [3, 4, 5]
+    assert "JSON object" in report["errors"][1]["error"]
+
+
+def test_csv_quoted_newlines_and_utf8_across_chunks():
+    csv_text = (
+        "\ufeffname,phone,aadhaar,bank_account,crop\n"
+        '"Ravi ""Bhau"" Patil",9876543210,1,2,"Wheat,\nlate sown"\n'
+        "रामू,9000000001,3,4,गेहूं"
+    )
+    collection = _Collection()
+    report = asyncio.run(
+        import_farmers(_chunks(csv_text, size=5), "csv", collection=collection)
+    )
+    assert report["rows"] == 2 and report["failed"] == 0
+    fields = [op._doc["$set"] for op in collection.batches[0]]
+    assert fields[0]["name"] == 'Ravi "Bhau" Patil'
+    assert fields[0]["crop"] == "Wheat,\nlate sown"
+    assert fields[1]["name"] == "रामू" and fields[1]["crop"] == "गेहूं"
+
+
+def test_csv_stray_quote_is_literal_and_unclosed_quote_is_reported():
+    csv_text = (
+        "name,phone,aadhaar,bank_account\n"
+        'Ram "Bhai,9876543210,1,2\n'
+        "Sita,9000000001,3,4\n"
+        '"Gita,9000000002,5,6\n'
+        "Mohan,9000000003,7,8\n"
+    )
+    collection = _Collection()
+    report = asyncio.run(
+        import_farmers(_chunks(csv_text), "csv", collection=collection)
+    )
+    names = [op._doc["$set"]["name"] for op in collection.batches[0]]
+    assert names == ['Ram "Bhai', "Sita"]
+    assert report["rows"] == 3 and report["failed"] == 1
+    assert report["errors"][0]["line"] == 4
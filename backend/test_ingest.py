@@ -0,0 +1,165 @@
+import asyncio
+
+from dedup import DedupStore
+from ingest import MessageQueue
+
+
+def test_same_sender_stays_in_order():
+    seen = []
+
+    async def handler(payload):
+        # Earlier messages sleep longer; order must still hold per sender
+        await asyncio.sleep(0.01 * (5 - payload["n"]))
+        seen.append((payload["from"], payload["n"]))
+
+    async def run():
+        q = MessageQueue(handler, workers=4, max_depth=100, coalesce_seconds=0)
+        q.start()
+        for n in range(5):
+            for sender in ("whatsapp:+911", "whatsapp:+912"):
+                assert await q.submit({"from": sender, "n": n})
+        await q.stop()
+        return q.stats()
+
+    stats = asyncio.run(run())
+    for sender in ("whatsapp:+911", "whatsapp:+912"):
+        assert [n for s, n in seen if s == sender] == list(range(5))
+    assert stats["processed"] == 10
+    assert stats["depth"] == 0
+
+
+def test_slow_sender_does_not_block_others():
+    handled = []
+
+    async def handler(payload):
+        if payload["from"] == "slow":
+            await release.wait()
+        handled.append(payload["from"])
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        q = MessageQueue(handler, workers=2, max_depth=100, coalesce_seconds=0)
+        q.start()
+        assert await q.submit({"from": "slow"})
+        for sender in ("a", "b", "c"):
+            assert await q.submit({"from": sender})
+        await asyncio.sleep(0.05)
+        before = list(handled)
+        release.set()
+        await q.stop()
+        return before
+
+    release = None
+    assert sorted(asyncio.run(run())) == ["a", "b", "c"]
+    assert handled[-1] == "slow"
+
+
+def test_full_queue_rejects():
+    release = None
+
+    async def handler(payload):
+        await release.wait()
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        q = MessageQueue(
+            handler,
+            workers=1,
+            max_depth=2,
+            enqueue_timeout=0.05,
+            coalesce_seconds=0,
+        )
+        q.start()
+        assert await q.submit({"from": "a"})
+        assert await q.submit({"from": "a"})
+        accepted = await q.submit({"from": "a"})
+        release.set()
+        await q.stop()
+        return accepted, q.stats()
+
+    accepted, stats = asyncio.run(run())
+    assert accepted is False
+    assert stats["rejected"] == 1
+    assert stats["processed"] == 2
+
+
+def test_duplicate_deliveries_are_suppressed():
+    store = DedupStore(ttl=60, maxsize=100, redis_url="")
+    msg = {"from": "whatsapp:+911", "id": "3EB0ABC", "content": "hi"}
+    no_id = {"from": "whatsapp:+911", "content": "hi", "timestamp": "1700000000"}
+
+    async def run():
+        return [
+            await store.seen(msg),
+            await store.seen(dict(msg)),
+            await store.seen({**msg, "id": "3EB0ABD"}),
+            await store.seen(no_id),
+            await store.seen(dict(no_id)),
+            await store.seen({**no_id, "timestamp": "1700000005"}),
+        ]
+
+    assert asyncio.run(run()) == [False, True, False, False, True, False]
+    assert store.stats()["duplicates"] == 2
+
+    asyncio.run(store.forget(msg))
+    assert asyncio.run(store.seen(msg)) is False
+
+
+def test_bursts_from_one_sender_become_one_turn():
+    handled = []
+
+    async def handler(payload):
+        handled.append(payload)
+
+    async def run():
+        q = MessageQueue(handler, workers=2, max_depth=10, coalesce_seconds=0.05)
+        q.start()
+        for text in ("hello", "my wheat", "leaves yellow", "what to do"):
+            assert await q.submit({"from": "whatsapp:+911", "content": text})
+            await asyncio.sleep(0.01)
+        assert await q.submit({"from": "whatsapp:+912", "content": "hi"})
+        await asyncio.sleep(0.15)
+        # A later message opens a new burst
+        assert await q.submit({"from": "whatsapp:+911", "content": "thanks"})
+        await q.stop()
+        return q.stats()
+
+    stats = asyncio.run(run())
+    contents = {(p["from"], p["content"]) for p in handled}
+    assert contents == {
+        ("whatsapp:+911", "hello\nmy wheat\nleaves yellow\nwhat to do"),
+        ("whatsapp:+912", "hi"),
+        ("whatsapp:+911", "thanks"),
+    }
+    assert stats["coalesced"] == 3
+    assert stats["processed"] == 3
+    assert stats["depth"] == 0
+
+
+def test_questions_and_media_are_not_held_back():
+    handled = []
+
+    async def handler(payload):
+        handled.append((payload.get("type"), payload["content"]))
+
+    async def run():
+        q = MessageQueue(handler, workers=2, max_depth=10, coalesce_seconds=5)
+        q.start()
+        for text in ("hello", "my wheat"):
+            assert await q.submit({"from": "a", "content": text})
+        assert await q.submit({"from": "a", "type": "audio", "content": "note"})
+        assert await q.submit({"from": "b", "content": "will it rain?"})
+        await asyncio.sleep(0.05)
+        done = list(handled)
+        await q.stop()
+        return done
+
+    done = asyncio.run(run())
+    # All handled well before the 5 s window, the media after a's text
+    assert [c for c in done if c != (None, "will it rain?")] == [
+        (None, "hello\nmy wheat"),
+        ("audio", "note"),
+    ]
+    assert (None, "will it rain?") in done
@@ -0,0 +1,91 @@
+import asyncio
+import datetime
+
+import mongomock
+
+import async_database
+import coordination
+import risk_job
+from risk_job import compute_risk, run_risk_job
+from test_database import _AsyncCollection
+
+
+def test_risk_score_follows_weather_and_ndvi():
+    dry_hot = {"rainfall_mm": 0.0, "temperature_c": 38.0}
+    mild = {"rainfall_mm": 8.0, "temperature_c": 26.0}
+    assert compute_risk(dry_hot, 0.15) > 70
+    assert compute_risk(mild, 0.7) == 0
+    assert compute_risk(dry_hot, None) == compute_risk(dry_hot, None)
+    assert 0 <= compute_risk({"rainfall_mm": 120.0}, 0.5) <= 100
+
+
+def test_risk_job_persists_and_only_refreshes_stale(monkeypatch):
+    users = mongomock.MongoClient().db.users
+    fresh = datetime.datetime.now(datetime.timezone.utc)
+    users.insert_many(
+        [
+            {"phone": "911", "lat": 19.0, "lon": 73.0},
+            {"phone": "912", "lat": 19.1, "lon": 73.1, "ndvi_history": [0.5] * 5},
+            {"phone": "913", "lat": 19.2, "lon": 73.2, "risk_computed_at": fresh},
+            {"phone": "914"},  # no location yet
+        ]
+    )
+    monkeypatch.setattr(async_database, "users", lambda: _AsyncCollection(users))
+    monkeypatch.setattr(risk_job, "users", lambda: _AsyncCollection(users))
+
+    async def fake_weather(lat, lon):
+        return {"rainfall_mm": 1.0, "temperature_c": 33.0}
+
+    monkeypatch.setattr(risk_job, "get_cell_weather", fake_weather)
+    prefetched = []
+
+    async def fake_prefetch(points):
+        prefetched.append(points)
+        return 0
+
+    monkeypatch.setattr(risk_job.cell_weather, "prefetch", fake_prefetch)
+
+    async def fake_ndvi(lat, lon):
+        return {"ndvi": 0.3, "status": "Stressed"}
+
+    monkeypatch.setattr(risk_job, "calculate_ndvi", fake_ndvi)
+
+    stats = asyncio.run(run_risk_job(max_age_hours=24, batch_size=1))
+    assert stats["scanned"] == 2 and stats["updated"] == 2
+    # Each batch warms its weather cells with regional requests first
+    assert prefetched[:2] == [[(19.0, 73.0)], [(19.1, 73.1)]]
+
+    expected = compute_risk({"rainfall_mm": 1.0, "temperature_c": 33.0}, 0.3)
+    first = users.find_one({"phone": "911"})
+    assert first["risk_score"] == expected
+    assert first["ndvi_history"] == [0.3]
+    assert users.find_one({"phone": "912"})["ndvi_history"] == [0.5] * 4 + [0.3]
+    assert "risk_score" not in users.find_one({"phone": "913"})
+
+    # A second run finds nothing stale
+    assert asyncio.run(run_risk_job(max_age_hours=24))["scanned"] == 0
+
+
+def test_risk_loop_runs_in_one_worker_only(monkeypatch):
+    leases = _AsyncCollection(mongomock.MongoClient().db.leases)
+    monkeypatch.setattr(coordination, "leases", lambda: leases)
+    monkeypatch.setenv("RISK_JOB_INTERVAL_SECONDS", "3600")
+    monkeypatch.setenv("RISK_JOB_POLL_SECONDS", "1")
+    runs = []
+
+    async def fake_job():
+        runs.append(1)
+        return {}
+
+    monkeypatch.setattr(risk_job, "run_risk_job", fake_job)
+
+    async def run():
+        # Three uvicorn workers start together
+        loops = [asyncio.create_task(risk_job.risk_loop(w)) for w in "abc"]
+        await asyncio.sleep(0.2)
+        for loop in loops:
+            loop.cancel()
+        await asyncio.gather(*loops, return_exceptions=True)
+
+    asyncio.run(run())
+    assert len(runs) == 1
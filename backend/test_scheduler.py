@@ -0,0 +1,335 @@
+import asyncio
+import datetime
+import time
+
+import scheduler
+from ratelimit import TokenBucket
+
+
+def test_token_bucket_limits_rate():
+    async def run():
+        bucket = TokenBucket(rate=100, burst=5)
+        start = time.monotonic()
+        for _ in range(25):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    # 5 from the burst, then 20 at 100/s
+    assert 0.15 < asyncio.run(run()) < 0.6
+
+
+class _FakeRuns:
+    """In-memory stand-in for the brief_runs / brief_deliveries collections."""
+
+    def __init__(self):
+        self.runs = {}
+        self.deliveries = {}
+        self.renders = {}
+        self.claims = 0
+        self.claimed_by = {}
+        # Delivery shards other owners are running right now
+        self.senders = 0
+
+    def install(self, monkeypatch):
+        for name in (
+            "start_brief_run",
+            "save_brief_checkpoint",
+            "finish_brief_run",
+            "claim_brief_delivery",
+            "mark_brief_delivery",
+            "save_brief_renders",
+            "get_brief_render",
+            "live_delivery_shards",
+        ):
+            monkeypatch.setattr(scheduler, name, getattr(self, name))
+
+    async def start_brief_run(self, run_id):
+        run = self.runs.setdefault(
+            run_id,
+            {"_id": run_id, "checkpoint": None, "status": "running", "attempt": 0},
+        )
+        run["attempt"] += 1
+        return dict(run)
+
+    async def save_brief_checkpoint(self, run_id, checkpoint, stats):
+        run = self.runs[run_id]
+        if run["checkpoint"] is None or checkpoint > run["checkpoint"]:
+            run["checkpoint"] = checkpoint
+
+    async def finish_brief_run(self, run_id, stats):
+        self.runs[run_id]["status"] = "done"
+
+    async def claim_brief_delivery(
+        self, run_id, farmer_id, stale_after=600, state_id=None, attempt=0
+    ):
+        key = (run_id, farmer_id)
+        status = self.deliveries.get(key)
+        if status == "sent":
+            return status
+        if status == "claimed" and self.claimed_by[key] >= (state_id, attempt):
+            return status
+        self.deliveries[key] = "claimed"
+        self.claimed_by[key] = (state_id, attempt)
+        self.claims += 1
+        return None
+
+    async def mark_brief_delivery(self, run_id, farmer_id, status):
+        self.deliveries[(run_id, farmer_id)] = status
+
+    async def save_brief_renders(self, run_id, renders):
+        for render in renders:
+            self.renders[(run_id, render["farmer_id"])] = dict(render)
+
+    async def get_brief_render(self, run_id, farmer_id):
+        return self.renders.get((run_id, farmer_id))
+
+    async def live_delivery_shards(self, run_id):
+        return self.senders
+
+
+def _farmers(n):
+    return [
+        {
+            "_id": i,
+            "phone": f"91900000{i:04d}",
+            "sender_jid": f"91900000{i:04d}@s.whatsapp.net",
+        }
+        for i in range(n)
+    ]
+
+
+def test_briefs_fan_out_with_retries(monkeypatch):
+    farmers = _farmers(200)
+    farmers.append({"_id": 200, "phone": "919999999999"})  # never messaged us
+    attempts = {}
+    in_flight = 0
+    peak = 0
+
+    async def fake_recipients(after=None, **kwargs):
+        for farmer in farmers:
+            yield farmer
+
+    async def fake_brief(farmer):
+        return "Good morning"
+
+    async def fake_send(jid, text):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.005)
+        in_flight -= 1
+        attempts[jid] = attempts.get(jid, 0) + 1
+        # Every 10th farmer's first send fails; farmer 0 always fails
+        if jid.startswith("919000000000"):
+            return False
+        return not (jid.endswith("0@s.whatsapp.net") and attempts[jid] == 1)
+
+    runs = _FakeRuns()
+    runs.senders = 3  # this run makes four senders sharing the bridge
+    runs.install(monkeypatch)
+    monkeypatch.setattr(scheduler, "iter_brief_recipients", fake_recipients)
+    monkeypatch.setattr(scheduler, "generate_morning_brief", fake_brief)
+    monkeypatch.setattr(scheduler, "send_text_via_bridge", fake_send)
+    monkeypatch.setenv("BRIEF_CONCURRENCY", "16")
+    monkeypatch.setenv("BRIDGE_SEND_RATE", "8000")
+    monkeypatch.setenv("BRIDGE_SEND_BURST", "50")
+    monkeypatch.setenv("BRIEF_MAX_RETRIES", "2")
+    monkeypatch.setenv("BRIEF_RETRY_BASE_SECONDS", "0.01")
+
+    stats = asyncio.run(scheduler.morning_briefing_job())
+    assert stats["send_rate"] == 2000
+    assert stats["sent"] == 199
+    assert stats["failed"] == 1
+    assert stats["skipped"] == 1
+    assert stats["retries"] == 19 + 2
+    assert attempts["919000000000@s.whatsapp.net"] == 3
+    assert 1 < peak <= 16
+    assert scheduler.last_brief_run["running"] is False
+
+
+def test_interrupted_brief_resumes_without_resending(monkeypatch):
+    farmers = _farmers(300)
+    runs = _FakeRuns()
+    sends = {}
+
+    async def fake_recipients(after=None, **kwargs):
+        for farmer in farmers:
+            if after is None or farmer["_id"] > after:
+                yield farmer
+
+    async def fake_brief(farmer):
+        return "Good morning"
+
+    async def fake_send(jid, text):
+        await asyncio.sleep(0.002)
+        sends[jid] = sends.get(jid, 0) + 1
+        return True
+
+    runs.install(monkeypatch)
+    monkeypatch.setattr(scheduler, "iter_brief_recipients", fake_recipients)
+    monkeypatch.setattr(scheduler, "generate_morning_brief", fake_brief)
+    monkeypatch.setattr(scheduler, "send_text_via_bridge", fake_send)
+    monkeypatch.setenv("BRIEF_CONCURRENCY", "8")
+    monkeypatch.setenv("BRIDGE_SEND_RATE", "0")
+    monkeypatch.setenv("BRIEF_CHECKPOINT_EVERY", "20")
+
+    async def crash_then_resume():
+        try:
+            await asyncio.wait_for(scheduler.morning_briefing_job(), timeout=0.05)
+        except asyncio.TimeoutError:
+            pass
+        (run,) = runs.runs.values()
+        assert run["status"] == "running"
+        assert 0 < len(sends) < len(farmers)
+        # Farmers cancelled mid-send keep their claim from the first attempt
+        assert "claimed" in runs.deliveries.values()
+        checkpoint = run["checkpoint"]
+        resumed = await scheduler.morning_briefing_job()
+        again = await scheduler.morning_briefing_job()
+        return checkpoint, resumed, again
+
+    checkpoint, resumed, again = asyncio.run(crash_then_resume())
+    assert checkpoint is not None
+    # The resumed run starts after the checkpoint, not from the top
+    assert resumed["queued"] == len(farmers) - checkpoint - 1
+    assert resumed["in_flight_elsewhere"] == 0
+    assert set(runs.deliveries.values()) == {"sent"}
+    assert len(sends) == len(farmers)
+    assert set(sends.values()) == {1}
+    assert again["status"] == "already_done"
+
+
+def test_delivery_sends_prerendered_briefs_when_weather_is_down(monkeypatch):
+    farmers = _farmers(50)
+    runs = _FakeRuns()
+    sent = {}
+    weather_up = True
+
+    async def fake_recipients(after=None, **kwargs):
+        for farmer in farmers:
+            if after is None or farmer["_id"] > after:
+                yield farmer
+
+    async def fake_brief(farmer):
+        if not weather_up:
+            raise RuntimeError("NASA POWER unreachable")
+        return f"Good morning {farmer['_id']}"
+
+    async def fake_send(jid, text):
+        sent[jid] = text
+        return True
+
+    runs.install(monkeypatch)
+    monkeypatch.setattr(scheduler, "iter_brief_recipients", fake_recipients)
+    monkeypatch.setattr(scheduler, "generate_morning_brief", fake_brief)
+    monkeypatch.setattr(scheduler, "send_text_via_bridge", fake_send)
+    monkeypatch.setenv("BRIDGE_SEND_RATE", "0")
+
+    async def run():
+        nonlocal weather_up
+        rendered = await scheduler.render_briefs_job()
+        weather_up = False
+        delivered = await scheduler.morning_briefing_job()
+        return rendered, delivered
+
+    rendered, delivered = asyncio.run(run())
+    assert rendered["rendered"] == 50
+    assert delivered["sent"] == 50
+    assert delivered["prerendered"] == 50
+    assert delivered["rendered_inline"] == 0
+    assert sent["919000000007@s.whatsapp.net"] == "Good morning 7"
+    assert scheduler.last_render_run["rendered"] == 50
+
+
+def test_briefs_go_out_in_the_morning_with_stored_audio(monkeypatch):
+    monkeypatch.delenv("BRIEF_DELIVER_AT", raising=False)
+    monkeypatch.setenv("BRIEF_TIMEZONE", "Asia/Kolkata")
+    midnight = datetime.datetime(2026, 3, 1, 18, 35, tzinfo=datetime.timezone.utc)
+    deliver_at = scheduler.brief_delivery_time(midnight)
+    assert scheduler._local_now(deliver_at).strftime("%d %H:%M") == "02 07:00"
+
+    farmers = _farmers(3)
+    for farmer, language in zip(farmers, ("English", "Hindi", None)):
+        farmer["language"] = language
+    runs = _FakeRuns()
+    voice_notes = {}
+    tts_languages = []
+
+    def fake_tts(text, language):
+        tts_languages.append(language)
+        return text.encode()
+
+    async def fake_recipients(after=None, **kwargs):
+        for farmer in farmers:
+            yield farmer
+
+    async def fake_brief(farmer):
+        return f"Good morning {farmer['_id']}"
+
+    async def fake_send(jid, text):
+        return True
+
+    async def fake_upload(jid, data):
+        voice_notes[jid] = data
+        return True
+
+    runs.install(monkeypatch)
+    monkeypatch.setattr(scheduler, "iter_brief_recipients", fake_recipients)
+    monkeypatch.setattr(scheduler, "generate_morning_brief", fake_brief)
+    monkeypatch.setattr(scheduler, "send_text_via_bridge", fake_send)
+    monkeypatch.setattr(scheduler, "synthesise_mp3_bytes", fake_tts)
+    monkeypatch.setattr(scheduler, "upload_voice_bytes", fake_upload)
+    monkeypatch.setenv("BRIDGE_SEND_RATE", "0")
+    monkeypatch.setenv("BRIEF_AUDIO", "1")
+
+    async def run():
+        await scheduler.render_briefs_job()
+        return await scheduler.morning_briefing_job()
+
+    delivered = asyncio.run(run())
+    # The MP3 travels in the render document, not as a path on the render host
+    assert "audio_path" not in runs.renders[(delivered["run_id"], 1)]
+    assert delivered["audio_sent"] == 3
+    # gTTS takes codes, not the stored language names
+    assert sorted(tts_languages) == ["en", "en", "hi"]
+    assert voice_notes["919000000001@s.whatsapp.net"] == b"Good morning 1"
+
+
+def test_render_without_weather_is_redone_at_delivery(monkeypatch):
+    farmers = _farmers(4)
+    runs = _FakeRuns()
+    sent = {}
+    weather_up = False
+
+    async def fake_recipients(after=None, **kwargs):
+        for farmer in farmers:
+            if after is None or farmer["_id"] > after:
+                yield farmer
+
+    async def fake_brief(farmer):
+        if not weather_up and farmer["_id"] % 2:
+            return scheduler.WEATHER_UNAVAILABLE
+        return f"Good morning {farmer['_id']}"
+
+    async def fake_send(jid, text):
+        sent[jid] = text
+        return True
+
+    runs.install(monkeypatch)
+    monkeypatch.setattr(scheduler, "iter_brief_recipients", fake_recipients)
+    monkeypatch.setattr(scheduler, "generate_morning_brief", fake_brief)
+    monkeypatch.setattr(scheduler, "send_text_via_bridge", fake_send)
+    monkeypatch.setenv("BRIDGE_SEND_RATE", "0")
+
+    async def run():
+        nonlocal weather_up
+        rendered = await scheduler.render_briefs_job()
+        weather_up = True
+        return rendered, await scheduler.morning_briefing_job()
+
+    rendered, delivered = asyncio.run(run())
+    assert rendered["rendered"] == 2 and rendered["no_weather"] == 2
+    assert len(runs.renders) == 2
+    assert delivered["prerendered"] == 2 and delivered["rendered_inline"] == 2
+    assert scheduler.WEATHER_UNAVAILABLE not in sent.values()
+    assert sent["919000000001@s.whatsapp.net"] == "Good morning 1"
@@ -0,0 +1,279 @@
+import asyncio
+import datetime
+import json
+from urllib.parse import parse_qs, urlsplit
+
+import numpy
+
+import breaker
+import tools
+import weather_grid
+
+
+async def _power_stand_in(requests, status=200):
+    """A local HTTP server answering like POWER's daily point endpoint.
+
+    `status` may be a list; the server answers with its first element, so a
+    test can flip it while the server runs.
+    """
+
+    async def serve(reader, writer):
+        head = await reader.readuntil(b"\r\n\r\n")
+        query = parse_qs(urlsplit(head.split(b" ")[1].decode()).query)
+        requests.append(query)
+        await asyncio.sleep(0.05)
+        days = ["20250101", "20250102", "20250103"]
+        body = json.dumps(
+            {
+                "properties": {
+                    "parameter": {
+                        # POWER has not filled in the last day yet
+                        "PRECTOTCORR": dict(zip(days, [1.5, 4.25, -999.0])),
+                        "T2M": dict(zip(days, [27.0, 29.44, -999.0])),
+                    }
+                }
+            }
+        ).encode()
+        code = status[0] if isinstance(status, list) else status
+        writer.write(
+            f"HTTP/1.1 {code} OK\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(serve, "127.0.0.1", 0)
+    return server, f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/daily"
+
+
+def test_power_client_caches_on_disk_and_coalesces(monkeypatch, tmp_path):
+    requests = []
+    cache_path = str(tmp_path / "power.sqlite3")
+
+    async def run():
+        server, url = await _power_stand_in(requests)
+        async with server:
+            client = tools.NasaPowerClient(base_url=url, cache_path=cache_path)
+            monkeypatch.setattr(tools, "power_client", client)
+            # One village: every farmer is in the same POWER cell
+            first = await asyncio.gather(
+                *(tools.get_nasa_weather(19.0 + i * 0.01, 73.0) for i in range(10))
+            )
+            stats = client.stats()
+            await client.close()
+
+            # A restarted process reads the same file instead of refetching
+            restarted = tools.NasaPowerClient(base_url=url, cache_path=cache_path)
+            monkeypatch.setattr(tools, "power_client", restarted)
+            again = await tools.get_nasa_weather(19.05, 73.05)
+            restarted_stats = restarted.stats()
+            await restarted.close()
+        return first, stats, again, restarted_stats
+
+    first, stats, again, restarted_stats = asyncio.run(run())
+    assert len(requests) == 1
+    query = requests[0]
+    assert query["latitude"] == ["19.0"] and query["longitude"] == ["73.125"]
+    assert query["start"] != ["20230101"]
+    assert first[0] == {"rainfall_mm": 4.25, "temperature_c": 29.4, "date": "20250102"}
+    assert all(r == first[0] for r in first)
+    assert stats["misses"] == 1 and stats["coalesced"] == 9
+    assert again == first[0]
+    assert restarted_stats["hits"] == 1 and restarted_stats["misses"] == 0
+
+
+def test_power_errors_are_not_cached(monkeypatch, tmp_path):
+    requests = []
+
+    async def run():
+        server, url = await _power_stand_in(requests, status=503)
+        async with server:
+            client = tools.NasaPowerClient(
+                base_url=url, cache_path=str(tmp_path / "power.sqlite3")
+            )
+            monkeypatch.setattr(tools, "power_client", client)
+            first = await tools.get_nasa_weather(19.0, 73.0)
+            second = await tools.get_nasa_weather(19.0, 73.0)
+            stats = client.stats()
+            await client.close()
+        return first, second, stats
+
+    first, second, stats = asyncio.run(run())
+    # No reading was ever fetched for this cell, so there is nothing to serve
+    assert "error" in first and "error" in second
+    assert len(requests) == 2
+    assert stats["errors"] == 2 and stats["hits"] == 0
+    assert stats["unavailable"] == 2
+
+
+def test_circuit_breaker_opens_and_half_opens():
+    now = [0.0]
+    b = breaker.CircuitBreaker(
+        failure_threshold=2, reset_timeout=10, clock=lambda: now[0]
+    )
+    assert b.allow()
+    b.record_failure()
+    assert b.state == breaker.CLOSED
+    b.record_failure()
+    assert b.state == breaker.OPEN and not b.allow()
+    assert b.retry_after() == 10
+
+    now[0] = 10.0
+    assert b.state == breaker.HALF_OPEN
+    assert b.allow() and not b.allow()  # one trial at a time
+    b.record_failure()  # the trial failed: open for another period
+    assert b.state == breaker.OPEN and b.retry_after() == 10
+
+    now[0] = 20.0
+    assert b.allow()
+    b.record_success()
+    assert b.state == breaker.CLOSED and b.allow()
+    assert b.stats()["opened"] == 2 and b.stats()["rejected"] == 2
+
+
+def test_power_outage_serves_last_known_good_and_recovers(monkeypatch, tmp_path):
+    requests = []
+    status = [200]
+    monkeypatch.setenv("POWER_BREAKER_FAILURES", "2")
+    monkeypatch.setenv("POWER_BREAKER_RESET_SECONDS", "0.2")
+
+    async def run():
+        server, url = await _power_stand_in(requests, status)
+        async with server:
+            client = tools.NasaPowerClient(
+                base_url=url, cache_path=str(tmp_path / "power.sqlite3")
+            )
+            client.ttl_recent = 0  # every call goes to the server
+            monkeypatch.setattr(tools, "power_client", client)
+            good = await tools.get_nasa_weather(19.0, 73.0)
+
+            status[0] = 503
+            failing = [await tools.get_nasa_weather(19.0, 73.0) for _ in range(2)]
+            assert client.breaker.state == breaker.OPEN
+            # While open, POWER is not called at all
+            open_ = await asyncio.gather(
+                *(tools.get_nasa_weather(19.0 + i * 0.01, 73.0) for i in range(5))
+            )
+            calls_while_open = len(requests)
+
+            status[0] = 200
+            await asyncio.sleep(0.5)  # the background refresh's trial request
+            recovered = await tools.get_nasa_weather(19.0, 73.0)
+            stats = client.stats()
+            await client.close()
+        return good, failing, open_, calls_while_open, recovered, stats
+
+    good, failing, open_, calls_while_open, recovered, stats = asyncio.run(run())
+    assert "stale" not in good
+    for weather in failing + open_:
+        assert weather["stale"] is True and weather["as_of"]
+        assert weather["rainfall_mm"] == good["rainfall_mm"]
+    assert calls_while_open == 3
+    assert recovered == good
+    assert stats["background_refreshes"] == 1 and stats["stale_served"] == 7
+    assert stats["breaker"]["state"] == breaker.CLOSED
+
+
+def test_recent_range_ends_yesterday():
+    assert tools.recent_range(datetime.date(2025, 3, 10)) == ("20250303", "20250309")
+
+
+async def _regional_stand_in(requests):
+    """Stand-in for POWER's regional endpoint: a grid point every 0.5° x 0.625°.
+
+    T2M encodes the latitude and PRECTOTCORR the longitude of each point, so
+    tests can tell which grid point a farmer was served from.
+    """
+
+    async def serve(reader, writer):
+        head = await reader.readuntil(b"\r\n\r\n")
+        query = parse_qs(urlsplit(head.split(b" ")[1].decode()).query)
+        requests.append(query)
+        lat_min, lat_max = (
+            float(query[k][0]) for k in ("latitude-min", "latitude-max")
+        )
+        lon_min, lon_max = (
+            float(query[k][0]) for k in ("longitude-min", "longitude-max")
+        )
+        features = []
+        for i in range(int(round((lat_max - lat_min) / 0.5)) + 1):
+            for j in range(int(round((lon_max - lon_min) / 0.625)) + 1):
+                lat, lon = lat_min + i * 0.5, lon_min + j * 0.625
+                features.append(
+                    {
+                        "geometry": {"coordinates": [lon, lat, 100.0]},
+                        "properties": {
+                            "parameter": {
+                                "T2M": {"20250101": lat, "20250102": -999.0},
+                                "PRECTOTCORR": {"20250101": lon / 10, "20250102": 1},
+                            }
+                        },
+                    }
+                )
+        body = json.dumps({"type": "FeatureCollection", "features": features}).encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(serve, "127.0.0.1", 0)
+    return server, f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/regional"
+
+
+def test_bulk_weather_fetches_each_region_once(monkeypatch, tmp_path):
+    requests = []
+    # 200 farmers spread over one 5° tile, and two in another tile
+    points = [(16.0 + i * 0.015, 71.0 + i * 0.015) for i in range(200)]
+    points += [(28.6, 77.2), (28.7, 77.3)]
+
+    async def run():
+        server, url = await _regional_stand_in(requests)
+        async with server:
+            client = tools.NasaPowerClient(
+                regional_url=url, cache_path=str(tmp_path / "power.sqlite3")
+            )
+            results = await weather_grid.bulk_weather(points, client=client)
+            again = await weather_grid.bulk_weather(points[:5], client=client)
+            stats = client.stats()
+            await client.close()
+        return results, again, stats
+
+    results, again, stats = asyncio.run(run())
+    assert len(requests) == 2
+    assert stats["regional_fetches"] == 2 and stats["hits"] == 1
+    assert {(q["latitude-min"][0], q["longitude-min"][0]) for q in requests} == {
+        ("15.0", "70.0"),
+        ("25.0", "75.0"),
+    }
+    for (lat, lon), weather in zip(points, results):
+        cell_lat, cell_lon = weather_grid.snap(lat, lon)
+        # 20250102 has -999 for T2M, so the latest complete day is used
+        assert weather == {
+            "rainfall_mm": round(cell_lon / 10, 2),
+            "temperature_c": round(cell_lat, 1),
+            "date": "20250101",
+        }
+    assert again == results[:5]
+
+
+def test_region_grid_lookup_is_vectorised_and_bounded():
+    features = [
+        {
+            "geometry": {"coordinates": [73.125, 19.0]},
+            "properties": {"parameter": {"T2M": {"20250101": 30.0}}},
+        },
+        {
+            "geometry": {"coordinates": [73.75, 19.5]},
+            "properties": {"parameter": {"T2M": {"20250101": -999.0}}},
+        },
+    ]
+    grid = weather_grid.RegionGrid(features, ["T2M"])
+    assert grid.values["T2M"].shape == (1, 2, 2)
+    values, day = grid.lookup(
+        numpy.array([19.1, 19.4, 19.0, 40.0]), numpy.array([73.0, 73.8, 73.75, 73.0])
+    )
+    assert values["T2M"][0] == 30.0
+    assert list(day) == [0, -1, -1, -1]  # -999, no grid point, outside
@@ -1,58 +1,459 @@
 # tools.py
-import requests
-import random
+"""NASA POWER weather and GIS tool functions.
+
+`get_nasa_weather` goes through `NasaPowerClient`: an async httpx client with
+an on-disk SQLite cache (POWER_CACHE_PATH) keyed by grid cell, parameter set
+and date range, so a restart or another worker process does not refetch
+what POWER already gave us. Recent ranges are cached for POWER_TTL_RECENT
+(POWER publishes daily and fills in its latest days late); ranges that ended
+more than a week ago never change and are kept for POWER_TTL_ARCHIVE.
+Concurrent callers for one key share a single in-flight request.
+
+`NasaPowerClient.regional` fetches a whole bounding box in one request (see
+weather_grid.bulk_weather), through the same cache.
+
+Network calls go through a circuit breaker (POWER_BREAKER_FAILURES,
+POWER_BREAKER_RESET_SECONDS). While it is open, `get_nasa_weather` does not
+wait on POWER at all: it serves the cell's last known good reading (kept in
+the same SQLite file) flagged `stale`, and a background task refreshes the
+cell once the breaker lets a trial request through.
+"""
+
+import asyncio
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+try:
+    from settings import env_float
+except ImportError:
+    from backend.settings import env_float
+
+try:
+    from breaker import CircuitBreaker, CircuitOpen
+except ImportError:
+    from backend.breaker import CircuitBreaker, CircuitOpen
+
+logger = logging.getLogger(__name__)
+
+
+class FetchCancelled(Exception):
+    """Given to coalesced waiters when the caller doing the fetch was cancelled.
+
+    They retry rather than inherit a CancelledError that was not meant for
+    them (e.g. a chat tool call hitting its deadline under a batch job).
+    """
+
 
 # NASA POWER API Endpoint
 NASA_API_URL = "https://power.larc.nasa.gov/api/temporal/daily/point"
+NASA_REGIONAL_URL = "https://power.larc.nasa.gov/api/temporal/daily/regional"
+WEATHER_PARAMETERS = ("PRECTOTCORR", "T2M")  # Precipitation, Temperature at 2 m
+# POWER's daily data lags a few days; ask for a week and use the latest value
+RECENT_DAYS = 7
+MISSING = -999.0
 
+BACKEND_DIR = os.path.dirname(__file__)
 
-def get_nasa_weather(lat: float, lon: float):
-    """
-    Fetches weather data from NASA POWER API.
-    Falls back to realistic mock data if the API fails.
-    """
-    try:
-        # Define parameters for the API call
-        params = {
-            "parameters": "PRECTOTCORR,T2M",  # Precipitation, Temperature at 2 Meters
-            "community": "AG",
-            "longitude": lon,
-            "latitude": lat,
-            "start": "20230101",  # NASA data has a delay, so we request a past date range
-            "end": "20230105",
-            "format": "JSON",
+
+def recent_range(today: Optional[datetime.date] = None) -> Tuple[str, str]:
+    """The last RECENT_DAYS days up to yesterday (UTC), as POWER YYYYMMDD."""
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    end = today - datetime.timedelta(days=1)
+    start = end - datetime.timedelta(days=RECENT_DAYS - 1)
+    return start.strftime("%Y%m%d"), end.strftime("%Y%m%d")
+
+
+class PowerCache:
+    """SQLite store of raw POWER responses, shared by every local process."""
+
+    def __init__(self, path: str):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS power_cache ("
+                "key TEXT PRIMARY KEY, body TEXT NOT NULL, "
+                "fetched_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            # Latest good reading per cell; never expires (served when stale)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS last_good ("
+                "cell TEXT PRIMARY KEY, weather TEXT NOT NULL, fetched_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body FROM power_cache WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, body: dict, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO power_cache VALUES (?, ?, ?, ?)",
+                (key, json.dumps(body), now, now + ttl),
+            )
+            self._conn.execute("DELETE FROM power_cache WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+
+    def get_last_good(self, cell: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT weather, fetched_at FROM last_good WHERE cell = ?", (cell,)
+            ).fetchone()
+        return dict(json.loads(row[0]), fetched_at=row[1]) if row else None
+
+    def set_last_good(self, cell: str, weather: dict) -> None:
+        self.set_last_good_many({cell: weather})
+
+    def set_last_good_many(self, readings: Dict[str, dict]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO last_good VALUES (?, ?, ?)",
+                [(cell, json.dumps(w), now) for cell, w in readings.items()],
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class NasaPowerClient:
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        cache_path: Optional[str] = None,
+        regional_url: Optional[str] = None,
+        timeout: float = 10.0,
+    ):
+        self.base_url = base_url or os.getenv("NASA_POWER_URL") or NASA_API_URL
+        self.regional_url = (
+            regional_url or os.getenv("NASA_POWER_REGIONAL_URL") or NASA_REGIONAL_URL
+        )
+        self.cache_path = (
+            cache_path
+            or os.getenv("POWER_CACHE_PATH")
+            or os.path.join(BACKEND_DIR, "cache", "nasa_power.sqlite3")
+        )
+        self.timeout = timeout
+        self.ttl_recent = env_float("POWER_TTL_RECENT", 6 * 3600)
+        self.ttl_archive = env_float("POWER_TTL_ARCHIVE", 30 * 24 * 3600)
+        self._cache: Optional[PowerCache] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(env_float("POWER_BREAKER_FAILURES", 5)),
+            reset_timeout=env_float("POWER_BREAKER_RESET_SECONDS", 60),
+        )
+        self._refreshing: Dict[str, asyncio.Task] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.regional_fetches = 0
+        self.fetch_ms_total = 0.0
+        self.stale_served = 0
+        self.unavailable = 0
+        self.refreshes = 0
+
+    @property
+    def cache(self) -> PowerCache:
+        if self._cache is None:
+            self._cache = PowerCache(self.cache_path)
+        return self._cache
+
+    def _http(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if (
+            self._client is None
+            or self._client.is_closed
+            or self._client_loop is not loop
+        ):
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(self.timeout))
+            self._client_loop = loop
+        return self._client
+
+    def _ttl(self, end: str) -> float:
+        ended = datetime.datetime.strptime(end, "%Y%m%d").date()
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+        if (today - ended).days > RECENT_DAYS:
+            return self.ttl_archive
+        return self.ttl_recent
+
+    async def daily(
+        self,
+        lat: float,
+        lon: float,
+        start: str,
+        end: str,
+        parameters: Iterable[str] = WEATHER_PARAMETERS,
+    ) -> Dict[str, Dict[str, float]]:
+        """Daily values {parameter: {YYYYMMDD: value}} for the grid cell of (lat, lon).
+
+        Raises on HTTP/network errors; nothing is cached then.
+        """
+        try:
+            from weather_grid import snap
+        except ImportError:
+            from backend.weather_grid import snap
+
+        cell_lat, cell_lon = snap(lat, lon)
+        params = ",".join(sorted(parameters))
+        query = {"longitude": cell_lon, "latitude": cell_lat}
+        key = f"{cell_lat}:{cell_lon}|{params}|{start}-{end}"
+        body = await self._get(key, self.base_url, query, params, start, end)
+        return body["properties"]["parameter"]
+
+    async def regional(
+        self,
+        bbox: Tuple[float, float, float, float],
+        start: str,
+        end: str,
+        parameters: Iterable[str] = WEATHER_PARAMETERS,
+    ) -> List[dict]:
+        """GeoJSON features (one per grid point) for bbox = (lat_min, lat_max,
+        lon_min, lon_max), each with `properties.parameter` like `daily`."""
+        lat_min, lat_max, lon_min, lon_max = bbox
+        params = ",".join(sorted(parameters))
+        query = {
+            "latitude-min": lat_min,
+            "latitude-max": lat_max,
+            "longitude-min": lon_min,
+            "longitude-max": lon_max,
+        }
+        key = f"region:{lat_min}:{lat_max}:{lon_min}:{lon_max}|{params}|{start}-{end}"
+        body = await self._get(key, self.regional_url, query, params, start, end)
+        return body.get("features", [])
+
+    async def _get(
+        self, key: str, url: str, query: dict, params: str, start: str, end: str
+    ) -> dict:
+        """Cached, coalesced GET; raises on HTTP/network errors (not cached).
+
+        A cache miss while the breaker is open raises CircuitOpen at once.
+        """
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        while (pending := self._inflight.get(key)) is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(pending)
+            except FetchCancelled:
+                continue  # its caller was cancelled; fetch it ourselves
+
+        self.misses += 1
+        if not self.breaker.allow():
+            raise CircuitOpen("NASA POWER circuit is open")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            try:
+                body = await self._fetch(url, query, params, start, end)
+            except asyncio.CancelledError:
+                self.breaker.abandon()
+                raise
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            self.breaker.record_success()
+            await asyncio.to_thread(self.cache.set, key, body, self._ttl(end))
+            future.set_result(body)
+            return body
+        except asyncio.CancelledError:
+            # Only this caller was cancelled: waiters retry instead
+            future.set_exception(FetchCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            self.errors += 1
+            future.set_exception(e)
+            future.exception()  # consumed here; waiters re-raise it
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _fetch(
+        self, url: str, query: dict, params: str, start: str, end: str
+    ) -> dict:
+        if url == self.regional_url:
+            self.regional_fetches += 1
+        started = time.monotonic()
+        response = await self._http().get(
+            url,
+            params=dict(
+                query,
+                parameters=params,
+                community="AG",
+                start=start,
+                end=end,
+                format="JSON",
+            ),
+        )
+        self.fetch_ms_total += (time.monotonic() - started) * 1000
+        response.raise_for_status()
+        return response.json()
+
+    async def close(self) -> None:
+        for task in list(self._refreshing.values()):
+            task.cancel()
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "regional_fetches": self.regional_fetches,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "fetch_ms_avg": (
+                round(self.fetch_ms_total / self.misses, 1) if self.misses else 0.0
+            ),
+            "stale_served": self.stale_served,
+            "unavailable": self.unavailable,
+            "background_refreshes": self.refreshes,
+            "breaker": self.breaker.stats(),
         }
 
-        response = requests.get(NASA_API_URL, params=params, timeout=5)
 
-        if response.status_code == 200:
-            data = response.json()
-            # Extract the latest available data point
-            precip_data = data["properties"]["parameter"]["PRECTOTCORR"]
-            temp_data = data["properties"]["parameter"]["T2M"]
+power_client = NasaPowerClient()
 
-            # Get the last value from the dictionary (simulating 'today')
-            last_date = list(precip_data.keys())[-1]
 
-            rain = precip_data[last_date]
-            temp = temp_data[last_date]
+def _latest(values: Dict[str, float]) -> Tuple[Optional[str], Optional[float]]:
+    for day in sorted(values, reverse=True):
+        if values[day] is not None and values[day] > MISSING:
+            return day, values[day]
+    return None, None
 
-            # Validate data (NASA sometimes returns -999 for missing data)
-            if temp < -100 or rain < 0:
-                raise ValueError("Invalid data from NASA")
 
-            return {"rainfall_mm": round(rain, 2), "temperature_c": round(temp, 1)}
+async def _fresh_weather(lat: float, lon: float) -> Dict[str, Any]:
+    """Latest reading from POWER (or its cache); raises if there is none."""
+    start, end = recent_range()
+    data = await power_client.daily(lat, lon, start, end)
+    day, rain = _latest(data["PRECTOTCORR"])
+    temp = data["T2M"].get(day) if day else None
 
+    # Validate data (NASA returns -999 for days it has not filled in yet)
+    if rain is None or temp is None or temp < -100 or rain < 0:
+        raise ValueError("Invalid data from NASA")
+
+    return {"rainfall_mm": round(rain, 2), "temperature_c": round(temp, 1), "date": day}
+
+
+def _cell(lat: float, lon: float) -> str:
+    try:
+        from weather_grid import cell_key
+    except ImportError:
+        from backend.weather_grid import cell_key
+    return cell_key(lat, lon)
+
+
+async def _refresh(client: NasaPowerClient, lat: float, lon: float) -> None:
+    # Wait for the breaker to allow a trial request (or, if it is still
+    # closed, one reset period), then try the cell again
+    await asyncio.sleep(client.breaker.retry_after() or client.breaker.reset_timeout)
+    while client.breaker.retry_after() > 0:  # it opened while we slept
+        await asyncio.sleep(client.breaker.retry_after())
+    try:
+        weather = await _fresh_weather(lat, lon)
     except Exception as e:
-        print(f"⚠️ NASA API Failed: {e}. Using Mock Data.")
-
-    # --- FALLBACK: REALISTIC MOCK DATA ---
-    # Generate realistic values for Indian agriculture context
-    mock_temp = round(random.uniform(22.0, 34.0), 1)  # 22°C to 34°C
-    mock_rain = round(random.uniform(0.0, 15.0), 2)  # 0mm to 15mm
-
-    return {
-        "rainfall_mm": mock_rain,
-        "temperature_c": mock_temp,
-        "note": "Simulated Data",
-    }
+        logger.info("Background weather refresh for %s failed: %s", (lat, lon), e)
+        return
+    client.refreshes += 1
+    await asyncio.to_thread(client.cache.set_last_good, _cell(lat, lon), weather)
+
+
+def _refresh_later(lat: float, lon: float) -> None:
+    """Schedule one background refresh per cell (later calls are no-ops)."""
+    client, cell = power_client, _cell(lat, lon)
+    if cell in client._refreshing:
+        return
+    task = asyncio.get_running_loop().create_task(_refresh(client, lat, lon))
+    client._refreshing[cell] = task
+    task.add_done_callback(lambda _: client._refreshing.pop(cell, None))
+
+
+async def get_nasa_weather(lat: float, lon: float):
+    """
+    Latest daily rainfall and temperature from NASA POWER.
+
+    If POWER is failing (or its circuit is open) this returns the cell's last
+    known good reading with `stale: True` and its `as_of` time, and refreshes
+    the cell in the background; with no reading at all, an `error` dict.
+    """
+    cell = _cell(lat, lon)
+    try:
+        weather = await _fresh_weather(lat, lon)
+        await asyncio.to_thread(power_client.cache.set_last_good, cell, weather)
+        return weather
+    except CircuitOpen:
+        reason = "circuit open"
+    except Exception as e:
+        reason = str(e) or type(e).__name__
+        print(f"⚠️ NASA API Failed: {reason}")
+
+    _refresh_later(lat, lon)
+    last_good = await asyncio.to_thread(power_client.cache.get_last_good, cell)
+    if last_good is None:
+        power_client.unavailable += 1
+        return {"error": f"Weather data unavailable ({reason})"}
+
+    power_client.stale_served += 1
+    fetched_at = last_good.pop("fetched_at")
+    return dict(
+        last_good,
+        stale=True,
+        as_of=datetime.datetime.fromtimestamp(
+            fetched_at, datetime.timezone.utc
+        ).isoformat(timespec="seconds"),
+    )
+
+
+async def calculate_ndvi(lat: float, lon: float):
+    """
+    Vegetation health (NDVI) for a location via the GIS MCP server.
+    """
+    try:
+        from mcp_client import calculate_ndvi_mcp
+    except ImportError:
+        from backend.mcp_client import calculate_ndvi_mcp
+
+    ndvi_raw = await calculate_ndvi_mcp(float(lat), float(lon))
+    try:
+        ndvi_val = float(ndvi_raw)
+    except Exception:
+        return {"error": f"Invalid NDVI value: {ndvi_raw}"}
+
+    status = (
+        "Healthy" if ndvi_val >= 0.6 else "Moderate" if ndvi_val >= 0.4 else "Stressed"
+    )
+    return {"ndvi": round(ndvi_val, 2), "status": status}
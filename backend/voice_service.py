@@ -1,11 +1,18 @@
+import asyncio
+import io
 import os
+import re
 import uuid
 import logging
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
-import httpx
 from gtts import gTTS
 
+try:
+    import bridge
+except ImportError:
+    from backend import bridge
+
 logger = logging.getLogger(__name__)
 
 # Save audio under backend/static/audio so FastAPI can serve it via /static
@@ -14,22 +21,22 @@ STATIC_DIR = os.path.join(BACKEND_DIR, "static")
 AUDIO_DIR = os.path.join(STATIC_DIR, "audio")
 os.makedirs(AUDIO_DIR, exist_ok=True)
 
-BRIDGE_AUDIO_URL = "http://localhost:8080/api/send_audio"
+# Sentence ends: Latin punctuation and the Devanagari danda
+_SENTENCE_END = re.compile(r"(?<=[.!?।])\s+")
 
 
-def generate_mp3(text: str, language: str = "en") -> Dict[str, str]:
-    """Generate an MP3 file using gTTS and return paths.
+def synthesise_mp3_bytes(text: str, language: str = "en") -> bytes:
+    """Run gTTS for one piece of text and return the MP3 bytes (blocking)."""
+    buf = io.BytesIO()
+    gTTS(text=text.strip(), lang=language or "en", slow=False).write_to_fp(buf)
+    return buf.getvalue()
 
-    Rule: MP3-only. No ffmpeg, no pydub, no ogg.
-    """
-    if not text or not text.strip():
-        raise ValueError("Text is required for TTS")
 
+def _save_mp3(data: bytes) -> Dict[str, str]:
     filename = f"voice_{uuid.uuid4().hex[:10]}.mp3"
     abs_path = os.path.join(AUDIO_DIR, filename)
-
-    tts = gTTS(text=text.strip(), lang=language or "en", slow=False)
-    tts.save(abs_path)
+    with open(abs_path, "wb") as f:
+        f.write(data)
 
     return {
         "file_path": abs_path,
@@ -38,41 +45,120 @@ def generate_mp3(text: str, language: str = "en") -> Dict[str, str]:
     }
 
 
-async def send_voice_note(
-    recipient_jid: str, text: str, language: str = "en"
-) -> Optional[str]:
-    """Generate an MP3 voice note and upload it to the WhatsApp bridge.
+def generate_mp3(text: str, language: str = "en") -> Dict[str, str]:
+    """Generate an MP3 file using gTTS and return paths.
 
-    Returns the public URL path (served by FastAPI) if generation succeeds.
+    Rule: MP3-only. No ffmpeg, no pydub, no ogg.
     """
     if not text or not text.strip():
-        return None
+        raise ValueError("Text is required for TTS")
+
+    return _save_mp3(synthesise_mp3_bytes(text, language))
 
-    mp3 = generate_mp3(text=text, language=language)
-    abs_path = mp3["file_path"]
 
+async def upload_voice_note(recipient_jid: str, file_path: str) -> bool:
+    """Upload an MP3 on disk to the WhatsApp bridge as a voice note.
+
+    True if the bridge accepted it.
+    """
     try:
-        with open(abs_path, "rb") as f:
+        with open(file_path, "rb") as f:
             file_bytes = f.read()
+    except OSError as e:
+        logger.error("Voice note send failed: %s", e)
+        return False
+    return await upload_voice_bytes(
+        recipient_jid, file_bytes, os.path.basename(file_path)
+    )
 
-        files = {"file": (os.path.basename(abs_path), file_bytes, "audio/mpeg")}
+
+async def upload_voice_bytes(
+    recipient_jid: str, file_bytes: bytes, filename: str = "voice.mp3"
+) -> bool:
+    """Upload MP3 bytes (e.g. stored with a pre-rendered brief) as a voice note.
+
+    True if the bridge accepted it.
+    """
+    try:
+        files = {"file": (filename, file_bytes, "audio/mpeg")}
         data = {
             "recipient": recipient_jid,
             "phone": recipient_jid,
             "is_voice_note": "true",
         }
 
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                BRIDGE_AUDIO_URL, data=data, files=files, timeout=60
-            )
+        resp = await bridge.post_audio(data=data, files=files, timeout=60)
 
         if resp.status_code != 200:
             logger.warning(
                 "Bridge rejected MP3 upload (%s): %s", resp.status_code, resp.text
             )
-
-        return mp3["url_path"]
+            return False
+        return True
     except Exception as e:
         logger.error("Voice note send failed: %s", e)
-        return mp3["url_path"]
+        return False
+
+
+async def _upload_mp3(recipient_jid: str, mp3: Dict[str, str]) -> Optional[str]:
+    """Upload a saved MP3 to the WhatsApp bridge as a voice note."""
+    await upload_voice_note(recipient_jid, mp3["file_path"])
+    return mp3["url_path"]
+
+
+async def send_voice_note(
+    recipient_jid: str, text: str, language: str = "en"
+) -> Optional[str]:
+    """Generate an MP3 voice note and upload it to the WhatsApp bridge.
+
+    Returns the public URL path (served by FastAPI) if generation succeeds.
+    """
+    if not text or not text.strip():
+        return None
+
+    # gTTS makes a blocking HTTPS call; keep it off the event loop
+    mp3 = await asyncio.to_thread(generate_mp3, text, language)
+    return await _upload_mp3(recipient_jid, mp3)
+
+
+class VoiceNoteStream:
+    """Build a voice note while its script is still streaming in.
+
+    Each complete sentence is handed to gTTS (in a worker thread) as soon as
+    it arrives; `finish()` synthesises the tail, joins the MP3 segments in
+    order (MP3 frames concatenate cleanly) and uploads one voice note.
+    """
+
+    def __init__(self, recipient_jid: str, language: str = "en"):
+        self.recipient_jid = recipient_jid
+        self.language = language
+        self._pending = ""
+        self._segments: List[asyncio.Task] = []
+
+    def feed(self, text: str) -> None:
+        self._pending += text
+        *sentences, self._pending = _SENTENCE_END.split(self._pending)
+        for sentence in sentences:
+            self._synthesise(sentence)
+
+    def _synthesise(self, sentence: str) -> None:
+        if sentence.strip():
+            self._segments.append(
+                asyncio.create_task(
+                    asyncio.to_thread(synthesise_mp3_bytes, sentence, self.language)
+                )
+            )
+
+    async def finish(self) -> Optional[str]:
+        self._synthesise(self._pending)
+        self._pending = ""
+        if not self._segments:
+            return None
+
+        try:
+            audio = b"".join(await asyncio.gather(*self._segments))
+        except Exception as e:
+            logger.error("Voice note synthesis failed: %s", e)
+            return None
+        mp3 = await asyncio.to_thread(_save_mp3, audio)
+        return await _upload_mp3(self.recipient_jid, mp3)
@@ -0,0 +1,276 @@
+"""Weather per NASA POWER grid cell, shared by every caller.
+
+POWER's meteorology comes from MERRA-2 on a 0.5° (lat) x 0.625° (lon) grid,
+so every farmer in the same cell gets the same numbers. Coordinates are
+snapped to the nearest grid point and results are cached per cell, so the
+morning brief, the risk job, the chat weather flow and the Gemini tool all
+share one fetch per cell. Concurrent requests for a cell that is already
+being fetched wait for that fetch instead of starting another.
+
+District-wide jobs (briefs, risk scoring) call `CellWeather.prefetch` with a
+batch of farmer coordinates first: the missing cells are grouped into fixed
+POWER_REGION_DEG x POWER_REGION_DEG tiles, each tile is fetched with one
+regional POWER request, decoded into a NumPy grid (`RegionGrid`) and every
+point is read out by vectorised indexing. Cells the regional data does not
+cover fall back to the per-point request.
+"""
+
+import asyncio
+import logging
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import tools
+    from cache import TTLCache
+    from settings import env_float
+    from tools import get_nasa_weather
+except ImportError:
+    from backend import tools
+    from backend.cache import TTLCache
+    from backend.settings import env_float
+    from backend.tools import get_nasa_weather
+
+logger = logging.getLogger(__name__)
+
+LAT_STEP = 0.5
+LON_STEP = 0.625
+
+
+def snap(lat: float, lon: float) -> Tuple[float, float]:
+    """Nearest POWER grid point (cell centre) for a coordinate."""
+    return (
+        round(round(float(lat) / LAT_STEP) * LAT_STEP, 3),
+        round(round(float(lon) / LON_STEP) * LON_STEP, 3),
+    )
+
+
+def cell_key(lat: float, lon: float) -> str:
+    cell_lat, cell_lon = snap(lat, lon)
+    return f"{cell_lat}:{cell_lon}"
+
+
+def region_tile(lat: float, lon: float, size: float) -> Tuple[float, ...]:
+    """Fixed bounding box (lat_min, lat_max, lon_min, lon_max) containing a point.
+
+    Tiles are aligned to multiples of `size` so every caller asks for the same
+    boxes, which keeps the regional responses cacheable.
+    """
+    lat0 = math.floor(lat / size) * size
+    lon0 = math.floor(lon / size) * size
+    return (lat0, lat0 + size, lon0, lon0 + size)
+
+
+class RegionGrid:
+    """A regional POWER response decoded onto the 0.5° x 0.625° grid.
+
+    `values[parameter]` is a (days, lat, lon) array with NaN where POWER has no
+    value (-999) or returned no grid point.
+    """
+
+    def __init__(self, features: List[dict], parameters: Sequence[str]):
+        coords = np.array(
+            [f["geometry"]["coordinates"][:2] for f in features], dtype=float
+        ).reshape(-1, 2)
+        self.days: List[str] = sorted(
+            features[0]["properties"]["parameter"][parameters[0]] if features else []
+        )
+        ilat = np.rint(coords[:, 1] / LAT_STEP).astype(int)
+        ilon = np.rint(coords[:, 0] / LON_STEP).astype(int)
+        self.lat0 = int(ilat.min()) if len(ilat) else 0
+        self.lon0 = int(ilon.min()) if len(ilon) else 0
+        shape = (
+            len(self.days),
+            int(ilat.max()) - self.lat0 + 1 if len(ilat) else 0,
+            int(ilon.max()) - self.lon0 + 1 if len(ilon) else 0,
+        )
+        self.values: Dict[str, np.ndarray] = {}
+        for parameter in parameters:
+            grid = np.full(shape, np.nan)
+            series = np.array(
+                [
+                    [
+                        f["properties"]["parameter"][parameter].get(day, np.nan)
+                        for day in self.days
+                    ]
+                    for f in features
+                ],
+                dtype=float,
+            ).reshape(len(features), len(self.days))
+            grid[:, ilat - self.lat0, ilon - self.lon0] = series.T
+            grid[grid <= tools.MISSING] = np.nan
+            self.values[parameter] = grid
+
+    def lookup(
+        self, lats: np.ndarray, lons: np.ndarray
+    ) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        """Latest day with every parameter present, for each point.
+
+        Returns ({parameter: value per point}, day index per point); the day
+        index is -1 (values NaN) where the grid has nothing for a point.
+        """
+        n = len(lats)
+        _, n_lat, n_lon = next(iter(self.values.values())).shape
+        ilat = np.rint(np.asarray(lats) / LAT_STEP).astype(int) - self.lat0
+        ilon = np.rint(np.asarray(lons) / LON_STEP).astype(int) - self.lon0
+        inside = (ilat >= 0) & (ilat < n_lat) & (ilon >= 0) & (ilon < n_lon)
+        ilat, ilon = np.where(inside, ilat, 0), np.where(inside, ilon, 0)
+
+        series = {p: grid[:, ilat, ilon] for p, grid in self.values.items()}
+        valid = np.logical_and.reduce([~np.isnan(v) for v in series.values()])
+        valid &= inside
+        if not self.days:
+            return {p: np.full(n, np.nan) for p in series}, np.full(n, -1)
+        # Last valid day per point: argmax over the reversed day axis
+        last = len(self.days) - 1 - np.argmax(valid[::-1], axis=0)
+        found = valid.any(axis=0)
+        day = np.where(found, last, -1)
+        picked = {
+            p: np.where(found, v[np.where(found, last, 0), np.arange(n)], np.nan)
+            for p, v in series.items()
+        }
+        return picked, day
+
+
+async def bulk_weather(
+    points: Sequence[Tuple[float, float]],
+    region_deg: Optional[float] = None,
+    client: Optional[Any] = None,
+) -> List[Optional[Dict[str, Any]]]:
+    """Weather for many points with one regional request per tile.
+
+    Returns one dict per point (same shape as get_nasa_weather), or None
+    where the regional data has no reading; a failed tile yields Nones too.
+    """
+    client = client or tools.power_client
+    size = region_deg or env_float("POWER_REGION_DEG", 5.0)
+    start, end = tools.recent_range()
+    lats = np.array([float(p[0]) for p in points])
+    lons = np.array([float(p[1]) for p in points])
+    results: List[Optional[Dict[str, Any]]] = [None] * len(points)
+
+    tiles: Dict[Tuple[float, ...], List[int]] = {}
+    for i, (lat, lon) in enumerate(zip(lats, lons)):
+        tiles.setdefault(region_tile(lat, lon, size), []).append(i)
+
+    async def fill(tile: Tuple[float, ...], idx: List[int]) -> None:
+        try:
+            features = await client.regional(tile, start, end)
+        except Exception as e:
+            logger.warning("Regional POWER fetch for %s failed: %s", tile, e)
+            return
+        grid = RegionGrid(features, tools.WEATHER_PARAMETERS)
+        values, day = grid.lookup(lats[idx], lons[idx])
+        rain, temp = values["PRECTOTCORR"], values["T2M"]
+        for k, i in enumerate(idx):
+            if day[k] < 0 or rain[k] < 0 or temp[k] < -100:
+                continue
+            results[i] = {
+                "rainfall_mm": round(float(rain[k]), 2),
+                "temperature_c": round(float(temp[k]), 1),
+                "date": grid.days[day[k]],
+            }
+
+    await asyncio.gather(*(fill(tile, idx) for tile, idx in tiles.items()))
+    # Remembered as last-known-good, served (stale) if POWER goes down later
+    good = {cell_key(*points[i]): w for i, w in enumerate(results) if w}
+    if good:
+        await asyncio.to_thread(client.cache.set_last_good_many, good)
+    return results
+
+
+class CellWeather:
+    def __init__(self, ttl: Optional[float] = None, maxsize: Optional[int] = None):
+        self.ttl = ttl if ttl is not None else env_float("WEATHER_CELL_TTL", 3 * 3600)
+        # Stale or missing readings (NASA down) are only kept briefly
+        self.fallback_ttl = env_float("WEATHER_FALLBACK_TTL", 60)
+        self.cells = TTLCache(
+            maxsize=maxsize or int(env_float("WEATHER_CELL_MAX", 20000)), ttl=self.ttl
+        )
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        self.requests = 0
+        self.fetches = 0
+        self.coalesced = 0
+        self.prefetched = 0
+
+    async def get(self, lat: float, lon: float) -> Dict[str, Any]:
+        """Weather for the grid cell containing (lat, lon)."""
+        self.requests += 1
+        key = cell_key(lat, lon)
+        while True:
+            cached = self.cells.get(key)
+            if cached is not None:
+                return dict(cached)
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            self.coalesced += 1
+            try:
+                return dict(await asyncio.shield(pending))
+            except tools.FetchCancelled:
+                continue  # its caller was cancelled; fetch it ourselves
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            self.fetches += 1
+            weather = await get_nasa_weather(*snap(lat, lon))
+            degraded = weather.get("stale") or "error" in weather
+            ttl = self.fallback_ttl if degraded else None
+            self.cells.set(key, weather, ttl=ttl)
+            future.set_result(weather)
+            return dict(weather)
+        except asyncio.CancelledError:
+            future.set_exception(tools.FetchCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # consumed here; waiters re-raise it
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def prefetch(self, points: Sequence[Tuple[Any, Any]]) -> int:
+        """Warm the cache for a batch of coordinates with regional requests.
+
+        Points without coordinates and cells already cached are skipped;
+        returns the number of cells filled.
+        """
+        cells: Dict[str, Tuple[float, float]] = {}
+        for lat, lon in points:
+            if lat is None or lon is None:
+                continue
+            key = cell_key(lat, lon)
+            if key not in cells and self.cells.get(key, count=False) is None:
+                cells[key] = snap(lat, lon)
+        if not cells:
+            return 0
+        results = await bulk_weather(list(cells.values()))
+        filled = 0
+        for key, weather in zip(cells, results):
+            if weather is not None:
+                self.cells.set(key, weather)
+                filled += 1
+        self.prefetched += filled
+        return filled
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            self.cells.stats(),
+            requests=self.requests,
+            cell_fetches=self.fetches,
+            coalesced=self.coalesced,
+            prefetched=self.prefetched,
+        )
+
+
+cell_weather = CellWeather()
+
+
+async def get_cell_weather(lat: float, lon: float) -> Dict[str, Any]:
+    """tools.get_nasa_weather, cached per grid cell in memory."""
+    return await cell_weather.get(lat, lon)
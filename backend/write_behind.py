@@ -0,0 +1,179 @@
+"""Write-behind buffer for per-farmer activity (sender JID, last active, counts).
+
+Every inbound message used to write the sender JID straight to Mongo. That
+data only matters to the scheduler, so messages now just update an entry in
+memory, coalesced per farmer; the buffer is flushed as one unordered
+`bulk_write` every WRITE_BEHIND_INTERVAL seconds, as soon as
+WRITE_BEHIND_MAX_ENTRIES farmers are pending, and once more on shutdown.
+
+A failed flush puts its entries back (counts are merged), so a Mongo blip
+delays activity data instead of losing it. After a failure, size-triggered
+flushes back off (doubling from WRITE_BEHIND_INTERVAL up to a minute) so a
+Mongo outage is not hammered once per message; the periodic flush keeps
+retrying meanwhile. The profile cache is not
+invalidated by these writes: nothing on the chat path reads them.
+"""
+
+import asyncio
+import datetime
+import logging
+import time
+from collections import deque
+from typing import Any, Dict, Hashable, Optional
+
+from pymongo import UpdateOne
+
+try:
+    from settings import env_float
+except ImportError:
+    from backend.settings import env_float
+
+try:
+    from async_database import users
+except ImportError:
+    from backend.async_database import users
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("sender_jid", "last_active", "messages", "first_at")
+
+    def __init__(self):
+        self.sender_jid: Optional[str] = None
+        self.last_active: Optional[datetime.datetime] = None
+        self.messages = 0
+        self.first_at = time.monotonic()
+
+
+class ActivityBuffer:
+    def __init__(
+        self, interval: Optional[float] = None, max_entries: Optional[int] = None
+    ):
+        self.interval = (
+            interval
+            if interval is not None
+            else env_float("WRITE_BEHIND_INTERVAL", 5.0)
+        )
+        self.max_entries = int(
+            max_entries or env_float("WRITE_BEHIND_MAX_ENTRIES", 500)
+        )
+        self._pending: Dict[Hashable, _Entry] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._flushing: Optional[asyncio.Task] = None
+        # No size-triggered flush before this (monotonic) time after a failure
+        self._retry_at = 0.0
+        self._backoff = 0.0
+
+        self.recorded = 0
+        self.flushes = 0
+        self.written = 0
+        self.errors = 0
+        self._sizes: deque = deque(maxlen=200)
+        self._lags: deque = deque(maxlen=200)
+
+    def record(self, user_id: Hashable, sender_jid: Optional[str] = None) -> None:
+        """Note one inbound message from the farmer with Mongo `_id` user_id."""
+        entry = self._pending.get(user_id)
+        if entry is None:
+            entry = self._pending[user_id] = _Entry()
+        if sender_jid:
+            entry.sender_jid = sender_jid
+        entry.last_active = datetime.datetime.now(datetime.timezone.utc)
+        entry.messages += 1
+        self.recorded += 1
+        if (
+            len(self._pending) >= self.max_entries
+            and self._flushing is None
+            and time.monotonic() >= self._retry_at
+        ):
+            self._flushing = asyncio.get_running_loop().create_task(self._size_flush())
+
+    async def _size_flush(self) -> None:
+        try:
+            await self.flush()
+        finally:
+            self._flushing = None
+
+    async def flush(self) -> int:
+        """Write everything pending as one bulk write; returns entries written."""
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        now = time.monotonic()
+        ops = []
+        for user_id, entry in batch.items():
+            fields: Dict[str, Any] = {"last_active": entry.last_active}
+            if entry.sender_jid:
+                fields["sender_jid"] = entry.sender_jid
+            ops.append(
+                UpdateOne(
+                    {"_id": user_id},
+                    {"$set": fields, "$inc": {"message_count": entry.messages}},
+                )
+            )
+        try:
+            await users().bulk_write(ops, ordered=False)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Activity flush of %d entries failed: %s", len(ops), e)
+            self._restore(batch)
+            self._backoff = min(60.0, max(self.interval, 1.0, self._backoff * 2))
+            self._retry_at = time.monotonic() + self._backoff
+            return 0
+
+        self._backoff = self._retry_at = 0.0
+        self.flushes += 1
+        self.written += len(ops)
+        self._sizes.append(len(ops))
+        self._lags.append(max(now - e.first_at for e in batch.values()) * 1000)
+        return len(ops)
+
+    def _restore(self, batch: Dict[Hashable, _Entry]) -> None:
+        for user_id, old in batch.items():
+            newer = self._pending.get(user_id)
+            if newer is None:
+                self._pending[user_id] = old
+                continue
+            newer.messages += old.messages
+            newer.sender_jid = newer.sender_jid or old.sender_jid
+            newer.first_at = old.first_at
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._flushing is not None:
+            await self._flushing
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        sizes, lags = list(self._sizes), list(self._lags)
+        return {
+            "pending": len(self._pending),
+            "recorded": self.recorded,
+            "flushes": self.flushes,
+            "written": self.written,
+            "errors": self.errors,
+            "retry_in_s": round(max(0.0, self._retry_at - time.monotonic()), 1),
+            "flush_size_avg": round(sum(sizes) / len(sizes), 1) if sizes else 0.0,
+            "flush_size_max": max(sizes) if sizes else 0,
+            "lag_ms_avg": round(sum(lags) / len(lags), 1) if lags else 0.0,
+            "lag_ms_max": round(max(lags), 1) if lags else 0.0,
+        }
+
+
+activity_buffer = ActivityBuffer()
@@ -31,6 +31,23 @@ interface Claim {
   date: string;
 }
 
+// The list endpoints return one keyset page at a time; follow next_cursor to the end
+const fetchAllPages = async <T,>(path: string, key: "farmers" | "claims"): Promise<T[]> => {
+  const items: T[] = [];
+  let cursor: string | null = null;
+  do {
+    const url = new URL(path, "http://localhost:8000");
+    url.searchParams.set("limit", "1000");
+    if (cursor) url.searchParams.set("cursor", cursor);
+    const res = await fetch(url);
+    const data = await res.json();
+    if (!data.success) break;
+    items.push(...data[key]);
+    cursor = data.next_cursor;
+  } while (cursor);
+  return items;
+};
+
 const InsuranceDashboard = () => {
   const { t } = useTranslation();
   const navigate = useNavigate();
@@ -50,24 +67,20 @@ const InsuranceDashboard = () => {
   const [analysisResult, setAnalysisResult] = useState<any>(null);
 
   // --- DATA FETCHING ---
+  const offline = (e: unknown) => {
+    console.error("Connection Error:", e);
+    toast({ title: "System Offline", description: "Could not connect to backend.", variant: "destructive" });
+  };
+
+  // Farmers: the backend filters high risk (score > 70) when the toggle is on
   useEffect(() => {
-    const fetchData = async () => {
-      try {
-        // Fetch Farmers
-        const fRes = await fetch("http://localhost:8000/api/farmers");
-        const fData = await fRes.json();
-        if (fData.success) setFarmers(fData.farmers);
+    fetchAllPages<Farmer>(riskFilter ? "/api/farmers?risk=high" : "/api/farmers", "farmers")
+      .then(setFarmers)
+      .catch(offline);
+  }, [riskFilter]);
 
-        // Fetch Claims
-        const cRes = await fetch("http://localhost:8000/api/claims");
-        const cData = await cRes.json();
-        if (cData.success) setClaims(cData.claims);
-      } catch (e) {
-        console.error("Connection Error:", e);
-        toast({ title: "System Offline", description: "Could not connect to backend.", variant: "destructive" });
-      }
-    };
-    fetchData();
+  useEffect(() => {
+    fetchAllPages<Claim>("/api/claims", "claims").then(setClaims).catch(offline);
   }, []);
 
   // --- ACTIONS ---
@@ -97,9 +110,7 @@ const InsuranceDashboard = () => {
       });
       
       // Refresh claims list to show updated status
-      const cRes = await fetch("http://localhost:8000/api/claims");
-      const cData = await cRes.json();
-      if (cData.success) setClaims(cData.claims);
+      setClaims(await fetchAllPages<Claim>("/api/claims", "claims"));
 
     } catch (e) { 
       toast({ title: "Signal Lost", description: "Backend unreachable.", variant: "destructive" }); 
@@ -135,9 +146,6 @@ const InsuranceDashboard = () => {
     } catch (e) { console.error(e); }
   };
 
-  // Filter Logic
-  const displayedFarmers = riskFilter ? farmers.filter(f => (f.risk_score || 0) > 70) : farmers;
-
   return (
     <div className="min-h-screen bg-black text-slate-200 font-sans selection:bg-cyan-500/30">
       <StarsBackground />
@@ -217,10 +225,10 @@ const InsuranceDashboard = () => {
                     </TableRow>
                   </TableHeader>
                   <TableBody>
-                    {displayedFarmers.length === 0 ? (
+                    {farmers.length === 0 ? (
                       <TableRow><TableCell colSpan={5} className="text-center text-slate-600 font-mono text-xs py-10">NO DATA FOUND</TableCell></TableRow>
                     ) : (
-                      displayedFarmers.map((farmer, idx) => (
+                      farmers.map((farmer, idx) => (
                       <TableRow key={idx} className="border-white/5 hover:bg-white/5 transition-colors group">
                         <TableCell className="font-medium text-slate-300 py-3">{farmer.name}</TableCell>
                         <TableCell className="font-mono text-slate-500 text-xs py-3">{farmer.phone}</TableCell>
@@ -10,8 +10,10 @@ import (
 	"net/http"
 	"os"
 	"os/signal"
+	"strconv"
 	"strings"
 	"syscall"
+	"time"
 
 	"github.com/gin-gonic/gin"
 	_ "github.com/mattn/go-sqlite3"
@@ -168,6 +170,9 @@ func eventHandler(evt interface{}) {
 			"sender_jid": senderJID,
 			"content":    content,
 			"type":       "text",
+			// Lets the backend drop re-posted copies of the same message
+			"id":        msg.Info.ID,
+			"timestamp": strconv.FormatInt(msg.Info.Timestamp.Unix(), 10),
 		}
 		if mediaType != "" {
 			payload["type"] = mediaType
@@ -176,15 +181,43 @@ func eventHandler(evt interface{}) {
 		jsonData, _ := json.Marshal(payload)
 
 		// Fire Webhook
-		go func() {
-			resp, err := http.Post("http://localhost:8000/whatsapp-webhook", "application/json", bytes.NewBuffer(jsonData))
-			if err != nil {
-				fmt.Printf("❌ [BRIDGE] Webhook Failed: %v\n", err)
-			} else {
+		go postWebhook(jsonData)
+	}
+}
+
+const webhookURL = "http://localhost:8000/whatsapp-webhook"
+const webhookAttempts = 6
+
+// postWebhook delivers one message to the backend. A busy backend answers 503
+// with Retry-After (its queue is full); network errors and other 5xx are
+// retried with exponential backoff. The backend drops re-posted message IDs,
+// so retrying is safe.
+func postWebhook(jsonData []byte) {
+	backoff := time.Second
+	for attempt := 1; ; attempt++ {
+		resp, err := http.Post(webhookURL, "application/json", bytes.NewBuffer(jsonData))
+		wait := backoff
+		if err != nil {
+			fmt.Printf("❌ [BRIDGE] Webhook Failed (attempt %d): %v\n", attempt, err)
+		} else {
+			resp.Body.Close()
+			if resp.StatusCode < 500 && resp.StatusCode != http.StatusTooManyRequests {
 				fmt.Printf("✅ [BRIDGE] Sent to Backend: %s\n", resp.Status)
-				resp.Body.Close()
+				return
 			}
-		}()
+			fmt.Printf("⏳ [BRIDGE] Backend busy (attempt %d): %s\n", attempt, resp.Status)
+			if secs, err := strconv.Atoi(resp.Header.Get("Retry-After")); err == nil && secs > 0 {
+				wait = time.Duration(secs) * time.Second
+			}
+		}
+		if attempt >= webhookAttempts {
+			fmt.Printf("❌ [BRIDGE] Webhook gave up after %d attempts\n", attempt)
+			return
+		}
+		time.Sleep(wait)
+		if backoff < 30*time.Second {
+			backoff *= 2
+		}
 	}
 }
 